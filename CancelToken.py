@@ -0,0 +1,53 @@
+# CancelToken.py
+# Proyecto Canvas — cooperative cancellation for preview / generation work
+#
+# Un token por trabajo. Quien lo lanza llama cancel() cuando el trabajo queda
+# obsoleto (p.ej. llega un snapshot de preview más nuevo); el trabajo comprueba el
+# token en puntos seguros (por fila en la difusión de error, entre etapas del render)
+# y aborta con RenderCancelled sin dejar cachés ni ficheros a medias.
+#
+# El flag es un array uint8 (1,) para que los kernels Numba (nogil) lo lean
+# directamente, sin volver a Python.
+
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+
+class RenderCancelled(RuntimeError):
+    """Raised when work is aborted through its CancelToken."""
+
+
+class CancelToken:
+    """Thread-safe cancellation flag (set once, never reset)."""
+
+    __slots__ = ("flag",)
+
+    def __init__(self):
+        self.flag = np.zeros((1,), dtype=np.uint8)
+
+    def cancel(self) -> None:
+        self.flag[0] = 1
+
+    @property
+    def cancelled(self) -> bool:
+        return bool(self.flag[0])
+
+    def check(self) -> None:
+        if self.flag[0]:
+            raise RenderCancelled("trabajo cancelado")
+
+
+def check_cancel(token: Optional[CancelToken]) -> None:
+    """token.check() that accepts None (no cancellation)."""
+    if token is not None and token.flag[0]:
+        raise RenderCancelled("trabajo cancelado")
+
+
+def cancel_flag(token: Optional[CancelToken]) -> np.ndarray:
+    """Flag array for Numba kernels (a fresh, never-set one when token is None)."""
+    if token is None:
+        return np.zeros((1,), dtype=np.uint8)
+    return token.flag
@@ -1,5 +1,7 @@
 import numpy as np
 
+from CancelToken import check_cancel
+
 # ==========================================================
 # Bayer 4×4 (canonical 0..15)
 # ==========================================================
@@ -27,6 +29,7 @@ def floyd_steinberg_dither(
     img_rgb_linear: np.ndarray,
     quantize_fn,
     strength: float = 1.0,
+    cancel=None,
 ):
     """
     Aplica dithering Floyd–Steinberg en RGB lineal.
@@ -39,6 +42,9 @@ def floyd_steinberg_dither(
 
     strength:
         0.0–1.0, controla cuánto error se difunde
+
+    cancel:
+        CancelToken opcional, se comprueba por fila (RenderCancelled)
     """
     strength = _clamp01(float(strength))
 
@@ -46,6 +52,7 @@ def floyd_steinberg_dither(
     img = img_rgb_linear.copy()
 
     for y in range(h):
+        check_cancel(cancel)
         for x in range(w):
             old = img[y, x]
             new = np.array(
@@ -72,6 +79,7 @@ def ordered_dither(
     img_rgb_linear: np.ndarray,
     quantize_fn,
     strength: float = 1.0,
+    cancel=None,
 ):
     """
     Ordered dithering usando matriz Bayer 4×4.
@@ -84,6 +92,9 @@ def ordered_dither(
 
     strength:
         controla cuánto se perturba el valor antes de cuantizar.
+
+    cancel:
+        CancelToken opcional, se comprueba por fila (RenderCancelled)
     """
     strength = _clamp01(float(strength))
 
@@ -93,6 +104,7 @@ def ordered_dither(
     # Umbral canónico: ((b + 0.5)/16 - 0.5) en [-0.46875, +0.46875]
     # Escalado a una perturbación muy pequeña (1/255) para no “romper” colorimetría.
     for y in range(h):
+        check_cancel(cancel)
         for x in range(w):
             b = _BAYER_4x4[y & 3, x & 3]
             threshold = ((b + 0.5) / 16.0) - 0.5
@@ -0,0 +1,251 @@
+"""DyeMatchState_v1
+
+Proyecto Canvas — incremental nearest / 2nd-nearest dye match for the preview.
+
+Toggling one dye used to re-match every pixel against the whole palette. But for the
+no-dither and ordered paths the per-pixel answer only depends on the top-2 dyes:
+
+- removing a dye only changes colors whose nearest or 2nd nearest was that dye;
+- adding a dye only changes colors that the new dye beats (one distance per color).
+
+DyeMatchState keeps, per *unique* color of the current preview image, the top-2
+(dye byte, distance) for the current enabled set and updates it incrementally when
+the pack changes. Results are identical to a full re-match with either engine
+(Numba or NumPy: same per-element distances as the full kernel, same first-minimum
+tie order as the pack). PC_DYEMATCH_DEBUG=1 checks every incremental update
+against a full re-match.
+
+Dyes are identified by their byte, so the state works directly on the packs the
+preview already receives (no access to the full dye table needed).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Hashable, Optional, Tuple
+
+import numpy as np
+
+from ErrorDiffusion_v1 import _default_sqrt_w, _nearest2_idx, _pal_dists_idx, _stats_add, dedup_rgb24
+
+
+# Si cambian muchos dyes a la vez, el re-match completo es igual de caro y más simple.
+_FULL_REMATCH_RATIO = 0.5
+
+# Debug-only: tras cada update incremental, compara con un re-match completo (PC_DYEMATCH_DEBUG=1).
+PC_DYEMATCH_DEBUG = os.environ.get("PC_DYEMATCH_DEBUG", "0") == "1"
+
+
+class DyeMatchState:
+    """Per-image top-2 dye match, updated incrementally on enabled-dye changes.
+
+    Thread-safe; one instance per controller. The key identifies the pixels
+    (image/prepared revision, size, alpha threshold) and must NOT include the
+    enabled-dye set: that is what gets diffed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key: Optional[Hashable] = None
+
+        self._n = 0
+        self._rgb_u: Optional[np.ndarray] = None   # (U,3) float32
+        self._inv: Optional[np.ndarray] = None     # (N,) intp, None = sin dedup
+
+        # Per unique color: byte + dist (d2 = inf si sólo hay 1 dye)
+        self._b1: Optional[np.ndarray] = None
+        self._d1: Optional[np.ndarray] = None
+        self._b2: Optional[np.ndarray] = None
+        self._d2: Optional[np.ndarray] = None
+
+        self._enabled = np.zeros((256,), dtype=bool)
+        self._sqrt_w: Optional[np.ndarray] = None
+
+        # Stats (debug)
+        self.full = 0
+        self.incremental = 0
+        self._matched = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._key = None
+            self._rgb_u = self._inv = None
+            self._b1 = self._d1 = self._b2 = self._d2 = None
+            self._enabled[:] = False
+
+    # --------------------------------------------------
+    # Internals
+    # --------------------------------------------------
+
+    @staticmethod
+    def _top2(rgb: np.ndarray, pack: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        pal_bytes = np.asarray(pack["palette_bytes"], dtype=np.uint8)
+        i1, d1, i2, d2 = _nearest2_idx(
+            rgb,
+            palette_w=pack["palette_w"],
+            palette_w_norm2=pack["palette_w_norm2"],
+            sqrt_w=pack.get("sqrt_w"),
+            want2=True,
+        )
+        b1 = pal_bytes[i1]
+        b2 = pal_bytes[i2]
+        if pal_bytes.shape[0] == 1:
+            d2 = np.full_like(d1, np.inf)
+        return b1, d1, b2, d2
+
+    def _rebuild(self, pack: dict) -> None:
+        self._b1, self._d1, self._b2, self._d2 = self._top2(self._rgb_u, pack)
+        self.full += 1
+        self._matched = int(self._rgb_u.shape[0])
+
+    def _update(self, pack: dict, enabled: np.ndarray) -> None:
+        pal_bytes = np.asarray(pack["palette_bytes"], dtype=np.uint8)
+        removed = self._enabled & ~enabled
+        added = enabled & ~self._enabled
+        n_changed = int(removed.sum()) + int(added.sum())
+        if n_changed == 0:
+            return
+        if n_changed > _FULL_REMATCH_RATIO * max(1, int(pal_bytes.shape[0])):
+            self._rebuild(pack)
+            return
+
+        self.incremental += 1
+        self._matched = 0
+
+        # Orden de desempate = posición en el pack nuevo (primer mínimo gana).
+        pos = np.full((256,), 256, dtype=np.int32)
+        pos[pal_bytes] = np.arange(pal_bytes.shape[0], dtype=np.int32)
+
+        b1, d1, b2, d2 = self._b1, self._d1, self._b2, self._d2
+
+        # 1) Quitar: colores cuyo top-2 usaba un dye eliminado -> re-match contra el pack nuevo
+        #    (que ya incluye los añadidos).
+        redo = np.zeros((b1.shape[0],), dtype=bool)
+        if removed.any():
+            redo = removed[b1] | (removed[b2] & np.isfinite(d2))
+            ri = np.nonzero(redo)[0]
+            if ri.shape[0]:
+                rb1, rd1, rb2, rd2 = self._top2(self._rgb_u[ri], pack)
+                b1[ri], d1[ri], b2[ri], d2[ri] = rb1, rd1, rb2, rd2
+                self._matched += int(ri.shape[0])
+
+        # 2) Añadir: una distancia por color y dye nuevo, insertada en el top-2.
+        #    Mismo cálculo por elemento que el kernel completo (ver _pal_dists_idx).
+        keep = np.nonzero(~redo)[0]
+        cols = np.nonzero(np.isin(pal_bytes, np.nonzero(added)[0]))[0]
+        if keep.shape[0] and cols.shape[0]:
+            dists = _pal_dists_idx(
+                self._rgb_u[keep],
+                palette_w=pack["palette_w"],
+                palette_w_norm2=pack["palette_w_norm2"],
+                sqrt_w=pack.get("sqrt_w"),
+                cols=cols,
+            )
+            self._matched += int(keep.shape[0]) * int(cols.shape[0])
+            for c, j in enumerate(cols):
+                a = int(pal_bytes[j])
+                da = dists[:, c]
+                pa = pos[a]
+                c1 = b1[keep]
+                c2 = b2[keep]
+                e1 = d1[keep]
+                e2 = d2[keep]
+
+                beat1 = (da < e1) | ((da == e1) & (pa < pos[c1]))
+                beat2 = ~beat1 & ((da < e2) | ((da == e2) & (pa < pos[c2])))
+
+                i = keep[beat1]
+                b2[i] = c1[beat1]
+                d2[i] = e1[beat1]
+                b1[i] = a
+                d1[i] = da[beat1]
+
+                i = keep[beat2]
+                b2[i] = a
+                d2[i] = da[beat2]
+
+        if PC_DYEMATCH_DEBUG:
+            self._check(pack)
+
+    def _check(self, pack: dict) -> None:
+        rb1, rd1, rb2, rd2 = self._top2(self._rgb_u, pack)
+        if not (
+            np.array_equal(rb1, self._b1)
+            and np.array_equal(rd1, self._d1)
+            and np.array_equal(rb2, self._b2)
+            and np.array_equal(rd2, self._d2)
+        ):
+            raise RuntimeError("DyeMatchState: el update incremental no coincide con el re-match completo")
+
+    # --------------------------------------------------
+    # API
+    # --------------------------------------------------
+
+    def match2(
+        self,
+        key: Hashable,
+        rgb_linear: np.ndarray,
+        pack: dict,
+        *,
+        stats: Optional[dict] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Top-2 (b1, d1, b2, d2) per pixel of rgb_linear (N,3) for the given pack.
+
+        Same contract as nearest2_bytes_dists_batch_from_pack. rgb_linear must be the
+        same pixels for the same key.
+        """
+        if rgb_linear.ndim != 2 or rgb_linear.shape[1] != 3:
+            raise ValueError("rgb_linear debe ser (N,3)")
+
+        pal_bytes = np.asarray(pack["palette_bytes"], dtype=np.uint8)
+        if pal_bytes.shape[0] == 0:
+            raise ValueError("DyeMatchState: paleta vacía")
+
+        enabled = np.zeros((256,), dtype=bool)
+        enabled[pal_bytes] = True
+        sqrt_w = _default_sqrt_w(pack.get("sqrt_w"))
+
+        n = int(rgb_linear.shape[0])
+        with self._lock:
+            same_pixels = (
+                self._key is not None
+                and self._key == key
+                and self._n == n
+                and self._sqrt_w is not None
+                and np.array_equal(self._sqrt_w, sqrt_w)
+            )
+
+            if not same_pixels:
+                self._key = key
+                self._n = n
+                self._sqrt_w = sqrt_w
+                dd = dedup_rgb24(rgb_linear)
+                if dd is not None:
+                    self._rgb_u, self._inv = dd
+                else:
+                    self._rgb_u = np.array(rgb_linear, dtype=np.float32, order="C")
+                    self._inv = None
+                self._rebuild(pack)
+                path = "state-full"
+            else:
+                self._matched = 0
+                inc0 = self.incremental
+                self._update(pack, enabled)
+                path = "state-incr" if self.incremental != inc0 else "state"
+            _stats_add(stats, pixels=n, matched=self._matched, path=path)
+
+            self._enabled = enabled
+
+            b1, d1, b2, d2 = self._b1, self._d1, self._b2, self._d2
+            if self._inv is not None:
+                b1, d1, b2, d2 = b1[self._inv], d1[self._inv], b2[self._inv], d2[self._inv]
+            else:
+                b1, d1, b2, d2 = b1.copy(), d1.copy(), b2.copy(), d2.copy()
+
+        # Paleta de un solo dye: mismo contrato que el kernel (2nd = 1st).
+        single = ~np.isfinite(d2)
+        if single.any():
+            b2[single] = b1[single]
+            d2[single] = d1[single]
+        return b1, d1, b2, d2
@@ -0,0 +1,161 @@
+"""DyeSelection_v1
+
+Proyecto Canvas — greedy error-minimizing dye subset ("Best N colors").
+
+Ranking dyes by nearest-neighbor votes ignores how much error each dye removes
+(two near-identical popular dyes both rank high). Instead we grow the subset one dye
+at a time, always adding the dye with the largest reduction of the total
+pixel-weighted error:
+
+- keep cur[b] = distance from histogram bin b to its nearest selected dye;
+- a candidate k gives error sum_b w[b] * min(cur[b], D[b, k]);
+- after picking k, cur = min(cur, D[:, k]).
+
+Each step is O(bins × candidates) with no re-match, and one pass yields the whole
+error-vs-N curve (error[n-1] = mean error with the first n dyes), so callers can
+choose N automatically (auto_n).
+
+Metric: same Rec.709-weighted squared distance as the encoder (palette pack).
+Input: the exact RGB24 histogram (ErrorDiffusion_v1.rgb24_histogram). Up to
+_MAX_EXACT_BINS colors the curve is exact. Larger histograms are reduced to 15-bit
+bins with count-weighted centroids, and each bin is matched as a whole: pixels of
+one bin whose nearest dyes differ are all charged to the centroid's dye, so there
+the error curve and auto_n are approximations (the centroid only preserves a bin's
+error up to a constant when all its pixels share a nearest dye).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ErrorDiffusion_v1 import _default_sqrt_w, rgb24_keys_to_linear
+
+
+# Por encima de esto el histograma exacto se agrupa a 5 bits por canal (32768 bins).
+_MAX_EXACT_BINS = 1 << 15
+_COARSE_BITS = 5
+
+# auto_n: menor N cuyo error queda dentro de este porcentaje de la mejora total.
+AUTO_N_TOL = 0.02
+
+
+@dataclass(frozen=True)
+class DyeCurve:
+    """Greedy selection result: dye bytes in pick order + error after each pick."""
+    dyes: Tuple[int, ...]        # dye bytes in pick order
+    error: Tuple[float, ...]     # mean weighted squared distance per pixel, len == len(dyes)
+    auto_n: int
+
+    def select(self, n: Optional[int] = None) -> list[int]:
+        """First n dye bytes (n <= 0 / None -> auto_n)."""
+        if n is None or int(n) <= 0:
+            n = self.auto_n
+        return list(self.dyes[: max(1, int(n))])
+
+
+def reduce_histogram(
+    keys: np.ndarray,
+    counts: np.ndarray,
+    *,
+    max_bins: int = _MAX_EXACT_BINS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(rgb float32 (B,3) u8/255, weights float64 (B,)) from an RGB24 histogram.
+
+    Above max_bins colors, bins are 15-bit centroids: the greedy curve built on them
+    approximates the exact one (see module docstring).
+    """
+    keys = np.asarray(keys, dtype=np.uint32)
+    w = np.asarray(counts, dtype=np.float64)
+    if keys.shape[0] <= int(max_bins):
+        return rgb24_keys_to_linear(keys), w
+
+    rgb = rgb24_keys_to_linear(keys).astype(np.float64)
+    sh = 8 - _COARSE_BITS
+    m = (1 << _COARSE_BITS) - 1
+    coarse = (
+        (((keys >> np.uint32(16 + sh)) & m) << (2 * _COARSE_BITS))
+        | (((keys >> np.uint32(8 + sh)) & m) << _COARSE_BITS)
+        | ((keys >> np.uint32(sh)) & m)
+    ).astype(np.intp)
+
+    uniq, inv = np.unique(coarse, return_inverse=True)
+    wb = np.bincount(inv, weights=w, minlength=uniq.shape[0])
+    cent = np.empty((uniq.shape[0], 3), dtype=np.float64)
+    for ch in range(3):
+        cent[:, ch] = np.bincount(inv, weights=w * rgb[:, ch], minlength=uniq.shape[0]) / wb
+    return cent.astype(np.float32), wb
+
+
+def _distance_matrix(rgb: np.ndarray, pack: dict) -> np.ndarray:
+    """(B,K) float32 weighted squared distances (GEMM form, clamped at 0)."""
+    sw = _default_sqrt_w(pack.get("sqrt_w"))
+    x = np.asarray(rgb, dtype=np.float32) * sw
+    xn = np.einsum("ij,ij->i", x, x)
+    d = x @ np.asarray(pack["palette_w"], dtype=np.float32).T
+    d *= -2.0
+    d += xn[:, None]
+    d += np.asarray(pack["palette_w_norm2"], dtype=np.float32)[None, :]
+    np.maximum(d, 0.0, out=d)
+    return d
+
+
+def auto_n(error, *, tol: float = AUTO_N_TOL) -> int:
+    """Smallest N whose error is within tol of the full improvement (error[0] -> error[-1])."""
+    err = np.asarray(error, dtype=np.float64)
+    if err.shape[0] == 0:
+        return 0
+    lo = float(err[-1])
+    span = float(err[0]) - lo
+    if span <= 0.0:
+        return 1
+    ok = np.nonzero(err <= lo + float(tol) * span)[0]
+    return int(ok[0]) + 1
+
+
+def greedy_dye_curve(
+    rgb: np.ndarray,
+    weights: np.ndarray,
+    pack: dict,
+    *,
+    max_n: Optional[int] = None,
+    tol: float = AUTO_N_TOL,
+) -> DyeCurve:
+    """Greedy forward selection over the pack dyes for histogram bins (rgb, weights)."""
+    pal_bytes = np.asarray(pack["palette_bytes"], dtype=np.uint8)
+    k = int(pal_bytes.shape[0])
+    w = np.asarray(weights, dtype=np.float64)
+    total = float(w.sum())
+    if k == 0 or rgb.shape[0] == 0 or total <= 0.0:
+        return DyeCurve(tuple(int(b) for b in pal_bytes), tuple(0.0 for _ in range(k)), min(1, k))
+
+    n_max = k if max_n is None else max(1, min(k, int(max_n)))
+
+    dist = _distance_matrix(rgb, pack)            # (B,K)
+    wn = (w / total).astype(np.float32)           # error = media por píxel
+
+    cur = np.full((dist.shape[0],), np.inf, dtype=np.float32)
+    remaining = np.ones((k,), dtype=bool)
+    order = []
+    errors = []
+    scratch = np.empty_like(dist)
+
+    for _ in range(n_max):
+        cand = np.nonzero(remaining)[0]
+        s = scratch[:, : cand.shape[0]]
+        np.minimum(cur[:, None], dist[:, cand], out=s)
+        err = wn @ s                               # (R,)
+        j = int(cand[int(np.argmin(err))])
+
+        order.append(j)
+        errors.append(float(err.min()))
+        remaining[j] = False
+        np.minimum(cur, dist[:, j], out=cur)
+
+    return DyeCurve(
+        dyes=tuple(int(pal_bytes[j]) for j in order),
+        error=tuple(errors),
+        auto_n=auto_n(errors, tol=tol),
+    )
@@ -6,7 +6,9 @@ Main entrypoints
 ----------------
 - ed_quantize_to_bytes(): error diffusion (Floyd–Steinberg + extra kernels) -> uint8 bytes map
 - ordered_quantize_to_bytes(): ordered dithering (Bayer 4×4) -> uint8 bytes map
+  (= ordered_analysis() + ordered_select_bytes(); cache the analysis for strength changes)
 - nearest_bytes_batch_from_pack(): nearest (no dither) -> uint8 bytes
+- nearest_idx_batch_from_pack(): nearest (no dither) -> palette indices
 
 Rationale
 ---------
@@ -18,15 +20,37 @@ Notes
 - The project currently uses values called "linear_rgb" in TablaDyes_v1.json but the
   pipeline historically treats image_rgb/255 as "linear". This module follows that
   convention to stay coherent with the existing encoder.
+- Error diffusion engines: Numba when available, otherwise a NumPy engine
+  (scanline-vectorized, bit-compatible with the pixel-by-pixel reference) so the
+  Pyodide runtime does not fall back to the per-dye Python loop.
+- Long-running entrypoints accept cancel= (CancelToken): checked per row inside the
+  diffusion engines (Numba reads the token's flag array) and between phases of
+  ordered dithering; a cancelled call raises RenderCancelled.
+- Scan order: ed_serpentine_for() (dithering config "scan", env PC_ED_SCAN). Large
+  canvases use raster scan so the Numba wavefront kernel runs on all cores.
 """
 
 from __future__ import annotations
 
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Dict, Tuple, Optional
+import os
+import sys
+import threading
 
 import numpy as np
 
+from CancelToken import CancelToken, cancel_flag, check_cancel
+
+try:
+    from numba import njit, prange
+    _HAVE_NUMBA = True
+except Exception:
+    _HAVE_NUMBA = False
+    njit = None
+    prange = range
+
 
 # ==========================================================
 # Kernels registry
@@ -86,10 +110,458 @@ def _clamp01(x: float) -> float:
     return x
 
 
+# ==========================================================
+# Nearest / 2nd nearest kernels (bounded memory)
+# ==========================================================
+#
+# Same weighted metric as always (d^2 = ||x||^2 + ||p||^2 - 2 x·p over sqrt(w)-scaled
+# RGB), but without materializing (chunk, K) temporaries per 64K pixels:
+# - Numba: one pass per pixel over the palette, prange across cores, O(1) scratch.
+#   Large nearest-only batches scan just the candidate dyes of the pixel's grid cell.
+# - NumPy: cache-sized blocks with scratch buffers allocated once per call.
+
+_NEAREST_BLOCK = 4096
+_TWO_F32 = np.float32(2.0)
+
+# Nearest (sin 2nd) con muchos píxeles: rejilla de candidatos en el espacio ponderado
+# (misma que usa la difusión, ver "ED nearest: candidate grid"). El margen cubre el
+# redondeo float32 de la forma GEMM (|d| <= ~3), así el resultado es idéntico.
+_NEAREST_GRID_MIN_PIXELS = 1 << 16
+_NEAREST_GRID_MIN_K = 8
+_NEAREST_GRID_EPS = 1e-4
+
+
+if _HAVE_NUMBA:
+    @njit(cache=True, parallel=True, nogil=True)
+    def _nearest2_numba(
+        rgb: np.ndarray,            # (N,3) float32
+        sqrt_w: np.ndarray,         # (3,) float32
+        pal_w: np.ndarray,          # (K,3) float32
+        pal_norm2: np.ndarray,      # (K,) float32
+        want2: int,
+        i1_out: np.ndarray,         # (N,) int32
+        d1_out: np.ndarray,         # (N,) float32
+        i2_out: np.ndarray,         # (N,) int32 (unused if want2 == 0)
+        d2_out: np.ndarray,         # (N,) float32 (unused if want2 == 0)
+    ) -> None:
+        n = rgb.shape[0]
+        k = pal_w.shape[0]
+        for i in prange(n):
+            xr = rgb[i, 0] * sqrt_w[0]
+            xg = rgb[i, 1] * sqrt_w[1]
+            xb = rgb[i, 2] * sqrt_w[2]
+            xn = xr * xr + xg * xg + xb * xb
+
+            b1 = 0
+            b2 = 0
+            d1 = np.float32(np.inf)
+            d2 = np.float32(np.inf)
+            for j in range(k):
+                dot = xr * pal_w[j, 0] + xg * pal_w[j, 1] + xb * pal_w[j, 2]
+                d = (xn + pal_norm2[j]) - _TWO_F32 * dot
+                if d < d1:
+                    b2 = b1
+                    d2 = d1
+                    b1 = j
+                    d1 = d
+                elif d < d2:
+                    b2 = j
+                    d2 = d
+
+            i1_out[i] = b1
+            d1_out[i] = d1
+            if want2 != 0:
+                if k == 1:
+                    b2 = b1
+                    d2 = d1
+                i2_out[i] = b2
+                d2_out[i] = d2
+
+
+    @njit(cache=True, parallel=True, nogil=True)
+    def _pal_dists_numba(
+        rgb: np.ndarray,            # (N,3) float32
+        sqrt_w: np.ndarray,         # (3,) float32
+        pal_w: np.ndarray,          # (K,3) float32
+        pal_norm2: np.ndarray,      # (K,) float32
+        cols: np.ndarray,           # (C,) int32
+        out: np.ndarray,            # (N,C) float32
+    ) -> None:
+        n = rgb.shape[0]
+        c = cols.shape[0]
+        for i in prange(n):
+            xr = rgb[i, 0] * sqrt_w[0]
+            xg = rgb[i, 1] * sqrt_w[1]
+            xb = rgb[i, 2] * sqrt_w[2]
+            xn = xr * xr + xg * xg + xb * xb
+            for cc in range(c):
+                j = cols[cc]
+                dot = xr * pal_w[j, 0] + xg * pal_w[j, 1] + xb * pal_w[j, 2]
+                out[i, cc] = (xn + pal_norm2[j]) - _TWO_F32 * dot
+
+
+    @njit(cache=True, parallel=True, nogil=True)
+    def _nearest_grid_numba(
+        rgb: np.ndarray,            # (N,3) float32
+        sqrt_w: np.ndarray,         # (3,) float32
+        pal_w: np.ndarray,          # (K,3) float32
+        pal_norm2: np.ndarray,      # (K,) float32
+        cell_start: np.ndarray,     # (G³+1,) int32
+        cell_ids: np.ndarray,       # (M,) int32, ascending per cell
+        grid_n: int,
+        i1_out: np.ndarray,         # (N,) int32
+        d1_out: np.ndarray,         # (N,) float32
+    ) -> None:
+        n = rgb.shape[0]
+        k = pal_w.shape[0]
+        gmax = grid_n - 1
+        for i in prange(n):
+            r = rgb[i, 0]
+            g = rgb[i, 1]
+            b = rgb[i, 2]
+            xr = r * sqrt_w[0]
+            xg = g * sqrt_w[1]
+            xb = b * sqrt_w[2]
+            xn = xr * xr + xg * xg + xb * xb
+
+            if r < 0.0 or r > 1.0 or g < 0.0 or g > 1.0 or b < 0.0 or b > 1.0:
+                j0 = 0
+                j1 = k
+                use_ids = False
+            else:
+                cx = min(int(r * grid_n), gmax)
+                cy = min(int(g * grid_n), gmax)
+                cz = min(int(b * grid_n), gmax)
+                ci = (cx * grid_n + cy) * grid_n + cz
+                j0 = cell_start[ci]
+                j1 = cell_start[ci + 1]
+                use_ids = True
+
+            b1 = 0
+            d1 = np.float32(np.inf)
+            for jj in range(j0, j1):
+                j = cell_ids[jj] if use_ids else jj
+                dot = xr * pal_w[j, 0] + xg * pal_w[j, 1] + xb * pal_w[j, 2]
+                d = (xn + pal_norm2[j]) - _TWO_F32 * dot
+                if d < d1:
+                    b1 = j
+                    d1 = d
+
+            i1_out[i] = b1
+            d1_out[i] = d1
+
+
+def _block_dists_numpy(
+    rgb: np.ndarray,
+    sqrt_w: np.ndarray,
+    pal_wt: np.ndarray,
+    pal_norm2: np.ndarray,
+    c_w: np.ndarray,
+    c_n: np.ndarray,
+    d: np.ndarray,
+    b: np.ndarray,
+) -> None:
+    np.multiply(rgb, sqrt_w, out=c_w)
+    np.einsum("ij,ij->i", c_w, c_w, out=c_n)
+
+    # d = (||x||^2 + ||p||^2) - 2 x·p  (mismo orden de operaciones que antes)
+    np.matmul(c_w, pal_wt, out=d)
+    d *= -2.0
+    np.add(c_n[:, None], pal_norm2[None, :], out=b)
+    d += b
+
+
+def _nearest2_numpy(
+    rgb: np.ndarray,
+    sqrt_w: np.ndarray,
+    pal_w: np.ndarray,
+    pal_norm2: np.ndarray,
+    want2: bool,
+    i1_out: np.ndarray,
+    d1_out: np.ndarray,
+    i2_out: np.ndarray,
+    d2_out: np.ndarray,
+    block: int,
+) -> None:
+    n = int(rgb.shape[0])
+    k = int(pal_w.shape[0])
+    bs = max(1, min(int(block), n))
+
+    pal_wt = np.ascontiguousarray(pal_w.T)
+    cw = np.empty((bs, 3), dtype=np.float32)
+    cwn = np.empty((bs,), dtype=np.float32)
+    dist = np.empty((bs, k), dtype=np.float32)
+    base = np.empty((bs, k), dtype=np.float32)
+    rows = np.arange(bs)
+
+    for i0 in range(0, n, bs):
+        i1 = min(i0 + bs, n)
+        m = i1 - i0
+        c_w = cw[:m]
+        c_n = cwn[:m]
+        d = dist[:m]
+        b = base[:m]
+
+        _block_dists_numpy(rgb[i0:i1], sqrt_w, pal_wt, pal_norm2, c_w, c_n, d, b)
+
+        j1 = np.argmin(d, axis=1)
+        r = rows[:m]
+        i1_out[i0:i1] = j1
+        d1_out[i0:i1] = d[r, j1]
+
+        if want2:
+            if k == 1:
+                i2_out[i0:i1] = j1
+                d2_out[i0:i1] = d1_out[i0:i1]
+                continue
+            d[r, j1] = np.inf
+            j2 = np.argmin(d, axis=1)
+            i2_out[i0:i1] = j2
+            d2_out[i0:i1] = d[r, j2]
+
+
+def _nearest2_idx(
+    rgb_linear: np.ndarray,
+    *,
+    palette_w: np.ndarray,
+    palette_w_norm2: np.ndarray,
+    sqrt_w: Optional[np.ndarray],
+    want2: bool,
+    block: int = _NEAREST_BLOCK,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    """Nearest (and optionally 2nd nearest) palette index + distance, bounded memory."""
+    rgb = np.ascontiguousarray(rgb_linear, dtype=np.float32)
+    pal_w = np.ascontiguousarray(palette_w, dtype=np.float32)
+    pal_norm2 = np.ascontiguousarray(palette_w_norm2, dtype=np.float32)
+    sw = np.ascontiguousarray(_default_sqrt_w(sqrt_w), dtype=np.float32)
+
+    n = int(rgb.shape[0])
+    i1 = np.empty((n,), dtype=np.int32)
+    d1 = np.empty((n,), dtype=np.float32)
+    if want2:
+        i2 = np.empty((n,), dtype=np.int32)
+        d2 = np.empty((n,), dtype=np.float32)
+    else:
+        i2 = np.empty((0,), dtype=np.int32)
+        d2 = np.empty((0,), dtype=np.float32)
+
+    if n == 0:
+        return i1, d1, (i2 if want2 else None), (d2 if want2 else None)
+
+    if _HAVE_NUMBA:
+        k = int(pal_w.shape[0])
+        if not want2 and n >= _NEAREST_GRID_MIN_PIXELS and k >= _NEAREST_GRID_MIN_K:
+            cell_start, cell_ids = _ed_candidate_grid(pal_w, axis_scale=sw, eps=_NEAREST_GRID_EPS).csr()
+            _nearest_grid_numba(rgb, sw, pal_w, pal_norm2, cell_start, cell_ids, _ED_GRID, i1, d1)
+        else:
+            _nearest2_numba(rgb, sw, pal_w, pal_norm2, 1 if want2 else 0, i1, d1, i2, d2)
+    else:
+        _nearest2_numpy(rgb, sw, pal_w, pal_norm2, want2, i1, d1, i2, d2, block)
+
+    return i1, d1, (i2 if want2 else None), (d2 if want2 else None)
+
+
+def _pal_dists_idx(
+    rgb_linear: np.ndarray,
+    *,
+    palette_w: np.ndarray,
+    palette_w_norm2: np.ndarray,
+    sqrt_w: Optional[np.ndarray],
+    cols: np.ndarray,
+    block: int = _NEAREST_BLOCK,
+) -> np.ndarray:
+    """Distances (N, C) float32 to the palette entries cols, bit-identical to _nearest2_idx.
+
+    NumPy computes the full-pack block (GEMM rounding depends on the palette shape,
+    so a one-row palette would not match) and keeps the requested columns.
+    """
+    rgb = np.ascontiguousarray(rgb_linear, dtype=np.float32)
+    pal_w = np.ascontiguousarray(palette_w, dtype=np.float32)
+    pal_norm2 = np.ascontiguousarray(palette_w_norm2, dtype=np.float32)
+    sw = np.ascontiguousarray(_default_sqrt_w(sqrt_w), dtype=np.float32)
+    cols = np.ascontiguousarray(cols, dtype=np.int32)
+
+    n = int(rgb.shape[0])
+    out = np.empty((n, int(cols.shape[0])), dtype=np.float32)
+    if n == 0 or cols.shape[0] == 0:
+        return out
+
+    if _HAVE_NUMBA:
+        _pal_dists_numba(rgb, sw, pal_w, pal_norm2, cols, out)
+        return out
+
+    k = int(pal_w.shape[0])
+    bs = max(1, min(int(block), n))
+    pal_wt = np.ascontiguousarray(pal_w.T)
+    cw = np.empty((bs, 3), dtype=np.float32)
+    cwn = np.empty((bs,), dtype=np.float32)
+    dist = np.empty((bs, k), dtype=np.float32)
+    base = np.empty((bs, k), dtype=np.float32)
+
+    for i0 in range(0, n, bs):
+        i1 = min(i0 + bs, n)
+        m = i1 - i0
+        d = dist[:m]
+        _block_dists_numpy(rgb[i0:i1], sw, pal_wt, pal_norm2, cw[:m], cwn[:m], d, base[:m])
+        out[i0:i1] = d[:, cols]
+
+    return out
+
+
 # ==========================================================
 # Palette helpers (NumPy, chunked)
 # ==========================================================
 
+def _default_sqrt_w(sqrt_w: Optional[np.ndarray]) -> np.ndarray:
+    if sqrt_w is None:
+        return np.array([np.sqrt(0.2126), np.sqrt(0.7152), np.sqrt(0.0722)], dtype=np.float32)
+    return np.asarray(sqrt_w, dtype=np.float32)
+
+
+def rgb24_keys_from_linear(rgb_linear: np.ndarray) -> Optional[np.ndarray]:
+    """Return uint32 RGB24 keys if rgb_linear (N,3) is exactly u8/255, else None.
+
+    The check is strict: a float input that does not round-trip (e.g. after
+    error diffusion or resampling in float) must be matched as-is.
+    """
+    rgb = np.asarray(rgb_linear)
+    if rgb.ndim != 2 or rgb.shape[1] != 3 or rgb.dtype.kind != "f":
+        return None
+
+    q = np.rint(rgb * 255)
+    if not np.array_equal(q / 255, rgb):
+        return None
+    if q.size and (q.min() < 0 or q.max() > 255):
+        return None
+
+    qi = q.astype(np.uint32)
+    return (qi[:, 0] << 16) | (qi[:, 1] << 8) | qi[:, 2]
+
+
+def rgb24_keys_to_linear(keys: np.ndarray) -> np.ndarray:
+    """Inverse of rgb24_keys_from_linear: uint32 keys -> float32 (N,3) u8/255."""
+    keys = np.asarray(keys, dtype=np.uint32)
+    rgb = np.empty((keys.shape[0], 3), dtype=np.float32)
+    rgb[:, 0] = (keys >> 16) & 0xFF
+    rgb[:, 1] = (keys >> 8) & 0xFF
+    rgb[:, 2] = keys & 0xFF
+    rgb /= np.float32(255.0)
+    return rgb
+
+
+# Por debajo de esto np.unique cuesta más de lo que ahorra.
+_DEDUP_MIN_PIXELS = 4096
+
+
+def dedup_rgb24(rgb_linear: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Unique-color stage for 8-bit inputs.
+
+    Returns (rgb_unique float32 (U,3), inverse intp (N,)) so that
+    rgb_unique[inverse] == rgb_linear, or None if the input is not u8/255
+    (or too small to be worth it).
+    """
+    if int(rgb_linear.shape[0]) < _DEDUP_MIN_PIXELS:
+        return None
+
+    keys = rgb24_keys_from_linear(rgb_linear)
+    if keys is None:
+        return None
+
+    uniq, inv = np.unique(keys, return_inverse=True)
+    return rgb24_keys_to_linear(uniq), inv.reshape(-1)
+
+
+# A partir de aquí un bincount sobre las 2^24 claves es más rápido que ordenar.
+_HIST_BINCOUNT_MIN_PIXELS = 1 << 22
+
+
+def rgb24_histogram(rgb_u8: np.ndarray, *, alpha_threshold: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact color histogram of 8-bit pixels: (..., 3) RGB or (..., 4) RGBA uint8.
+
+    For RGBA, only pixels with alpha >= alpha_threshold (default 10, as the encoder)
+    are counted. Returns (keys uint32 (U,), counts int64 (U,)), keys sorted ascending.
+    Small inputs use np.unique; large ones (full-res photos) a dense bincount.
+    """
+    arr = np.asarray(rgb_u8)
+    if arr.dtype != np.uint8 or arr.ndim < 2 or arr.shape[-1] not in (3, 4):
+        raise ValueError("rgb_u8 debe ser uint8 (...,3) o (...,4)")
+
+    thr = 10 if alpha_threshold is None else int(alpha_threshold)
+
+    if arr.shape[-1] == 4 and arr.flags.c_contiguous and sys.byteorder == "little":
+        # RGBA contiguo: un uint32 por píxel (A<<24 | B<<16 | G<<8 | R), sin copias por canal.
+        v = arr.reshape(-1).view(np.uint32)
+        v = v[v >= (np.uint32(thr) << np.uint32(24))]
+        keys = ((v & np.uint32(0xFF)) << np.uint32(16)) | (v & np.uint32(0xFF00)) | ((v >> np.uint32(16)) & np.uint32(0xFF))
+    else:
+        keys = (
+            (arr[..., 0].astype(np.uint32) << 16)
+            | (arr[..., 1].astype(np.uint32) << 8)
+            | arr[..., 2]
+        ).reshape(-1)
+        if arr.shape[-1] == 4:
+            keys = keys[arr[..., 3].reshape(-1) >= thr]
+
+    if keys.shape[0] >= _HIST_BINCOUNT_MIN_PIXELS:
+        counts = np.bincount(keys, minlength=1 << 24)
+        uniq = np.flatnonzero(counts).astype(np.uint32)
+        return uniq, counts[uniq].astype(np.int64, copy=False)
+
+    uniq, counts = np.unique(keys, return_counts=True)
+    return uniq.astype(np.uint32, copy=False), counts.astype(np.int64, copy=False)
+
+
+def _stats_add(stats: Optional[dict], *, pixels: int, matched: int, path: str) -> None:
+    """Accumulate match stats (pixels in, colors actually matched) for perf output."""
+    if stats is None:
+        return
+    stats["pixels"] = int(stats.get("pixels", 0)) + int(pixels)
+    stats["matched"] = int(stats.get("matched", 0)) + int(matched)
+    stats["path"] = path
+
+
+def format_match_stats(stats: Optional[dict]) -> str:
+    if not stats or not stats.get("pixels"):
+        return "match: 0 px"
+    px = int(stats["pixels"])
+    m = int(stats.get("matched", px))
+    return f"match[{stats.get('path', '?')}]: {px} px -> {m} matched (ratio {m / px:.3f})"
+
+
+def nearest_idx_batch_from_pack(
+    rgb_linear: np.ndarray,
+    *,
+    palette_w: np.ndarray,
+    palette_w_norm2: np.ndarray,
+    sqrt_w: Optional[np.ndarray] = None,
+    chunk_size: int = _NEAREST_BLOCK,
+) -> np.ndarray:
+    """Nearest palette *index* (into the pack arrays) for each pixel in rgb_linear (N,3).
+
+    Weighted squared distance (Rec.709), GEMM-friendly:
+
+        d^2 = ||x||^2 + ||p||^2 - 2 x·p
+
+    where x and p are RGB scaled by sqrt(weights). Returns intp (N,).
+    chunk_size is the NumPy block size (the Numba kernel needs no scratch).
+    """
+    if rgb_linear.ndim != 2 or rgb_linear.shape[1] != 3:
+        raise ValueError("rgb_linear debe ser (N,3)")
+
+    if int(rgb_linear.shape[0]) == 0:
+        return np.empty((0,), dtype=np.intp)
+
+    i1, _, _, _ = _nearest2_idx(
+        rgb_linear,
+        palette_w=palette_w,
+        palette_w_norm2=palette_w_norm2,
+        sqrt_w=sqrt_w,
+        want2=False,
+        block=chunk_size,
+    )
+    return i1.astype(np.intp, copy=False)
+
+
 def nearest_bytes_batch_from_pack(
     rgb_linear: np.ndarray,
     *,
@@ -97,44 +569,71 @@ def nearest_bytes_batch_from_pack(
     palette_w_norm2: np.ndarray,
     palette_bytes: np.ndarray,
     sqrt_w: Optional[np.ndarray] = None,
-    chunk_size: int = 65536,
+    chunk_size: int = _NEAREST_BLOCK,
+    use_lut: bool = True,
+    dedup: bool = True,
+    stats: Optional[dict] = None,
 ) -> np.ndarray:
     """Nearest dye byte for each pixel in rgb_linear (N,3).
 
     This mirrors PntColorTranslatorV1.nearest_bytes_batch but receives a palette pack.
+
+    When the input is 8-bit RGB (image_rgb/255, the only thing the encoder and the
+    preview ever pass) the match goes through the exact RGB24 lookup table in
+    PaletteLUT_v1: a single gather, filling only colors not seen before. Without
+    the table, 8-bit inputs are still deduplicated (dedup_rgb24) so only unique
+    colors hit the distance kernel.
+
+    stats (optional dict) accumulates pixels/matched counts for perf output.
     """
     if rgb_linear.ndim != 2 or rgb_linear.shape[1] != 3:
         raise ValueError("rgb_linear debe ser (N,3)")
 
-    rgb = np.asarray(rgb_linear, dtype=np.float32, order="C")
-    n = int(rgb.shape[0])
+    n = int(rgb_linear.shape[0])
     if n == 0:
         return np.empty((0,), dtype=np.uint8)
 
-    pal_w = np.asarray(palette_w, dtype=np.float32, order="C")
-    pal_norm2 = np.asarray(palette_w_norm2, dtype=np.float32, order="C")
     pal_bytes = np.asarray(palette_bytes, dtype=np.uint8, order="C")
 
-    if sqrt_w is None:
-        sqrt_w = np.array([np.sqrt(0.2126), np.sqrt(0.7152), np.sqrt(0.0722)], dtype=np.float32)
-    else:
-        sqrt_w = np.asarray(sqrt_w, dtype=np.float32)
-
-    out = np.empty((n,), dtype=np.uint8)
-    cs = int(chunk_size)
-
-    for i0 in range(0, n, cs):
-        i1 = min(i0 + cs, n)
-        c = rgb[i0:i1]
-
-        cw = c * sqrt_w
-        cw_norm2 = np.sum(cw * cw, axis=1)
+    if use_lut:
+        from PaletteLUT_v1 import get_palette_lut
 
-        dist = cw_norm2[:, None] + pal_norm2[None, :] - 2.0 * (cw @ pal_w.T)
-        idx = np.argmin(dist, axis=1)
-        out[i0:i1] = pal_bytes[idx]
+        lut = get_palette_lut(
+            palette_w=palette_w,
+            palette_w_norm2=palette_w_norm2,
+            palette_bytes=pal_bytes,
+            sqrt_w=sqrt_w,
+        )
+        if lut is not None:
+            keys = rgb24_keys_from_linear(rgb_linear)
+            if keys is not None:
+                filled0 = lut.filled
+                idx = lut.lookup(keys)
+                _stats_add(stats, pixels=n, matched=lut.filled - filled0, path="lut")
+                return pal_bytes[idx]
+
+    dd = dedup_rgb24(rgb_linear) if dedup else None
+    if dd is not None:
+        rgb_u, inv = dd
+        idx_u = nearest_idx_batch_from_pack(
+            rgb_u,
+            palette_w=palette_w,
+            palette_w_norm2=palette_w_norm2,
+            sqrt_w=sqrt_w,
+            chunk_size=chunk_size,
+        )
+        _stats_add(stats, pixels=n, matched=rgb_u.shape[0], path="dedup")
+        return pal_bytes[idx_u][inv]
 
-    return out
+    idx = nearest_idx_batch_from_pack(
+        rgb_linear,
+        palette_w=palette_w,
+        palette_w_norm2=palette_w_norm2,
+        sqrt_w=sqrt_w,
+        chunk_size=chunk_size,
+    )
+    _stats_add(stats, pixels=n, matched=n, path="direct")
+    return pal_bytes[idx]
 
 
 def nearest2_bytes_dists_batch_from_pack(
@@ -144,10 +643,15 @@ def nearest2_bytes_dists_batch_from_pack(
     palette_w_norm2: np.ndarray,
     palette_bytes: np.ndarray,
     sqrt_w: Optional[np.ndarray] = None,
-    chunk_size: int = 65536,
+    chunk_size: int = _NEAREST_BLOCK,
+    dedup: bool = True,
+    stats: Optional[dict] = None,
 ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """Return nearest and second nearest (byte, dist) for each pixel.
 
+    8-bit inputs are deduplicated first (dedup_rgb24): only unique colors are
+    matched and the results are scattered back.
+
     Returns:
         b1: (N,) uint8
         d1: (N,) float32
@@ -164,52 +668,58 @@ def nearest2_bytes_dists_batch_from_pack(
         zf = np.empty((0,), dtype=np.float32)
         return z0, zf, z0.copy(), zf.copy()
 
-    pal_w = np.asarray(palette_w, dtype=np.float32, order="C")
-    pal_norm2 = np.asarray(palette_w_norm2, dtype=np.float32, order="C")
-    pal_bytes = np.asarray(palette_bytes, dtype=np.uint8, order="C")
-
-    if sqrt_w is None:
-        sqrt_w = np.array([np.sqrt(0.2126), np.sqrt(0.7152), np.sqrt(0.0722)], dtype=np.float32)
-    else:
-        sqrt_w = np.asarray(sqrt_w, dtype=np.float32)
-
-    b1 = np.empty((n,), dtype=np.uint8)
-    b2 = np.empty((n,), dtype=np.uint8)
-    d1 = np.empty((n,), dtype=np.float32)
-    d2 = np.empty((n,), dtype=np.float32)
-
-    cs = int(chunk_size)
-    for i0 in range(0, n, cs):
-        i1 = min(i0 + cs, n)
-        c = rgb[i0:i1]
+    dd = dedup_rgb24(rgb_linear) if dedup else None
+    if dd is not None:
+        rgb_u, inv = dd
+        ub1, ud1, ub2, ud2 = nearest2_bytes_dists_batch_from_pack(
+            rgb_u,
+            palette_w=palette_w,
+            palette_w_norm2=palette_w_norm2,
+            palette_bytes=palette_bytes,
+            sqrt_w=sqrt_w,
+            chunk_size=chunk_size,
+            dedup=False,
+        )
+        _stats_add(stats, pixels=n, matched=rgb_u.shape[0], path="dedup")
+        return ub1[inv], ud1[inv], ub2[inv], ud2[inv]
 
-        cw = c * sqrt_w
-        cw_norm2 = np.sum(cw * cw, axis=1)
+    _stats_add(stats, pixels=n, matched=n, path="direct")
 
-        dist = cw_norm2[:, None] + pal_norm2[None, :] - 2.0 * (cw @ pal_w.T)  # (C,K)
+    pal_bytes = np.asarray(palette_bytes, dtype=np.uint8, order="C")
 
-        # top-2 indices (unordered)
-        idx2 = np.argpartition(dist, kth=1, axis=1)[:, :2]  # (C,2)
-        d_a = dist[np.arange(dist.shape[0]), idx2[:, 0]]
-        d_b = dist[np.arange(dist.shape[0]), idx2[:, 1]]
+    i1, d1, i2, d2 = _nearest2_idx(
+        rgb,
+        palette_w=palette_w,
+        palette_w_norm2=palette_w_norm2,
+        sqrt_w=sqrt_w,
+        want2=True,
+        block=chunk_size,
+    )
+    return pal_bytes[i1], d1, pal_bytes[i2], d2
 
-        # order by distance
-        swap = d_b < d_a
-        i_first = np.where(swap, idx2[:, 1], idx2[:, 0])
-        i_second = np.where(swap, idx2[:, 0], idx2[:, 1])
 
-        d_first = np.where(swap, d_b, d_a).astype(np.float32)
-        d_second = np.where(swap, d_a, d_b).astype(np.float32)
+@dataclass(frozen=True)
+class OrderedAnalysis:
+    """Strength-independent half of ordered dithering (the palette search).
 
-        b1[i0:i1] = pal_bytes[i_first]
-        b2[i0:i1] = pal_bytes[i_second]
-        d1[i0:i1] = d_first
-        d2[i0:i1] = d_second
+    Cache it per (image, geometry, palette): changing only the strength then needs
+    just ordered_select_bytes() (a threshold compare).
+    """
+    shape: Tuple[int, int]
+    idx_act: np.ndarray     # (N,) flat indices of active pixels
+    b1: np.ndarray          # (N,) uint8 nearest byte
+    d1: np.ndarray          # (N,) float32
+    b2: np.ndarray          # (N,) uint8 second nearest byte
+    d2: np.ndarray          # (N,) float32
+    w1n: np.ndarray         # (N,) float32 normalized inverse-distance weight of b1
+    t: np.ndarray           # (N,) float32 Bayer threshold
 
-    return b1, d1, b2, d2
+    @property
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for a in (self.idx_act, self.b1, self.d1, self.b2, self.d2, self.w1n, self.t)))
 
 
-def ordered_quantize_to_bytes(
+def ordered_analysis(
     rgb_linear: np.ndarray,
     active_mask: np.ndarray,
     *,
@@ -217,17 +727,15 @@ def ordered_quantize_to_bytes(
     palette_w_norm2: np.ndarray,
     palette_bytes: np.ndarray,
     sqrt_w: Optional[np.ndarray] = None,
-    strength: float = 1.0,
-    out: Optional[np.ndarray] = None,
-) -> np.ndarray:
-    """Ordered dithering (Bayer 4×4) choosing between nearest and 2nd nearest.
-
-    strength:
-        0 -> always choose nearest
-        1 -> choose based on inverse-distance weights
+    stats: Optional[dict] = None,
+    nearest2: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None,
+    cancel: Optional[CancelToken] = None,
+) -> OrderedAnalysis:
+    """Nearest/second nearest + Bayer thresholds for ordered_select_bytes().
+
+    nearest2: optional precomputed (b1, d1, b2, d2) for the active pixels
+    (e.g. DyeMatchState_v1), same contract as nearest2_bytes_dists_batch_from_pack.
     """
-    strength = _clamp01(float(strength))
-
     if rgb_linear.ndim != 3 or rgb_linear.shape[2] != 3:
         raise ValueError("rgb_linear debe ser (H,W,3)")
 
@@ -235,29 +743,31 @@ def ordered_quantize_to_bytes(
     if active_mask.shape != (h, w):
         raise ValueError("active_mask debe ser (H,W)")
 
-    if out is None:
-        out = np.zeros((h, w), dtype=np.uint8)
-    else:
-        if out.shape != (h, w) or out.dtype != np.uint8:
-            raise ValueError("out debe ser uint8 (H,W)")
-        out.fill(0)
-
     # Flatten only active pixels for top2 search
     flat = rgb_linear.reshape(-1, 3)
     act = active_mask.reshape(-1)
-    if not np.any(act):
-        return out
-
     idx_act = np.nonzero(act)[0]
-    pix = flat[idx_act]
 
-    b1, d1, b2, d2 = nearest2_bytes_dists_batch_from_pack(
-        pix,
-        palette_w=palette_w,
-        palette_w_norm2=palette_w_norm2,
-        palette_bytes=palette_bytes,
-        sqrt_w=sqrt_w,
-    )
+    if idx_act.shape[0] == 0:
+        z0 = np.empty((0,), dtype=np.uint8)
+        zf = np.empty((0,), dtype=np.float32)
+        return OrderedAnalysis((h, w), idx_act, z0, zf, z0, zf, zf, zf)
+
+    if nearest2 is not None:
+        b1, d1, b2, d2 = nearest2
+        if b1.shape[0] != idx_act.shape[0]:
+            raise ValueError("nearest2 no corresponde a los píxeles activos")
+    else:
+        check_cancel(cancel)
+        b1, d1, b2, d2 = nearest2_bytes_dists_batch_from_pack(
+            flat[idx_act],
+            palette_w=palette_w,
+            palette_w_norm2=palette_w_norm2,
+            palette_bytes=palette_bytes,
+            sqrt_w=sqrt_w,
+            stats=stats,
+        )
+    check_cancel(cancel)
 
     eps = np.float32(1e-6)
     w1 = 1.0 / (eps + d1)
@@ -265,39 +775,231 @@ def ordered_quantize_to_bytes(
     s = w1 + w2
     w1n = (w1 / s).astype(np.float32)
 
-    # strength modulation: blend towards 1.0 (always choose first)
-    if strength < 1.0:
-        w1n = (1.0 - strength) * 1.0 + strength * w1n
-
     # Bayer threshold t in (0,1)
     ys = (idx_act // w).astype(np.int32)
     xs = (idx_act - ys * w).astype(np.int32)
     b = _BAYER_4x4[ys & 3, xs & 3]
     t = ((b.astype(np.float32) + 0.5) / 16.0)
 
-    choose_second = t >= w1n
-    chosen = np.where(choose_second, b2, b1).astype(np.uint8)
+    arrays = (idx_act, b1, d1, b2, d2, w1n, t)
+    for arr in arrays:
+        arr.setflags(write=False)
+    return OrderedAnalysis((h, w), *arrays)
+
+
+def ordered_select_bytes(
+    analysis: OrderedAnalysis,
+    *,
+    strength: float = 1.0,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Strength-dependent half of ordered dithering: threshold compare only."""
+    strength = _clamp01(float(strength))
+    h, w = analysis.shape
+
+    if out is None:
+        out = np.zeros((h, w), dtype=np.uint8)
+    else:
+        if out.shape != (h, w) or out.dtype != np.uint8:
+            raise ValueError("out debe ser uint8 (H,W)")
+        out.fill(0)
+
+    if analysis.idx_act.shape[0] == 0:
+        return out
+
+    w1n = analysis.w1n
+
+    # strength modulation: blend towards 1.0 (always choose first)
+    if strength < 1.0:
+        w1n = (1.0 - strength) * 1.0 + strength * w1n
+
+    choose_second = analysis.t >= w1n
+    chosen = np.where(choose_second, analysis.b2, analysis.b1).astype(np.uint8)
 
     out_flat = out.reshape(-1)
-    out_flat[idx_act] = chosen
+    out_flat[analysis.idx_act] = chosen
     return out
 
 
+def ordered_quantize_to_bytes(
+    rgb_linear: np.ndarray,
+    active_mask: np.ndarray,
+    *,
+    palette_w: np.ndarray,
+    palette_w_norm2: np.ndarray,
+    palette_bytes: np.ndarray,
+    sqrt_w: Optional[np.ndarray] = None,
+    strength: float = 1.0,
+    out: Optional[np.ndarray] = None,
+    stats: Optional[dict] = None,
+    analysis: Optional[OrderedAnalysis] = None,
+    cancel: Optional[CancelToken] = None,
+) -> np.ndarray:
+    """Ordered dithering (Bayer 4×4) choosing between nearest and 2nd nearest.
+
+    strength:
+        0 -> always choose nearest
+        1 -> choose based on inverse-distance weights
+
+    analysis:
+        optional precomputed ordered_analysis() for the same image/mask/palette.
+
+    cancel:
+        optional CancelToken, checked around the palette search.
+    """
+    if analysis is None:
+        analysis = ordered_analysis(
+            rgb_linear,
+            active_mask,
+            palette_w=palette_w,
+            palette_w_norm2=palette_w_norm2,
+            palette_bytes=palette_bytes,
+            sqrt_w=sqrt_w,
+            stats=stats,
+            cancel=cancel,
+        )
+    elif analysis.shape != tuple(active_mask.shape):
+        raise ValueError("analysis no corresponde a la forma de la imagen")
+
+    check_cancel(cancel)
+    return ordered_select_bytes(analysis, strength=strength, out=out)
+
+
 # ==========================================================
-# Error diffusion core (Numba accelerated if available)
+# ED nearest: candidate grid (shared by the Numba / NumPy engines)
 # ==========================================================
+#
+# El nearest de la difusión es sin pesos (ver _nearest_idx_weighted). Una rejilla 32³
+# sobre [0,1]³ guarda, por celda, los únicos dyes que pueden ganar dentro de ella,
+# así cada píxel compara 1-4 dyes en vez de K, con el mismo resultado.
 
-try:
-    from numba import njit
-    _HAVE_NUMBA = True
-except Exception:
-    _HAVE_NUMBA = False
-    njit = None
+_ED_GRID = 32
+_ED_GRID_EPS = 1e-5
+
+_ED_GRID_LOCK = threading.Lock()
+_ED_GRID_CACHE: "OrderedDict[bytes, _EDCandidateGrid]" = OrderedDict()
+_ED_GRID_CACHE_MAX = 4
+
+
+class _EDCandidateGrid:
+    """Per-cell candidate dyes for the unweighted nearest used by error diffusion.
+
+    A dye is a candidate for a cell if its minimum distance to the cell box can beat
+    the best maximum distance of any dye (plus a margin far above float32 rounding),
+    so the argmin over candidates (in palette order, strict <) equals the reference.
+    """
 
+    def __init__(
+        self,
+        pal_lin: np.ndarray,
+        *,
+        axis_scale: Optional[np.ndarray] = None,
+        eps: float = _ED_GRID_EPS,
+    ):
+        # axis_scale: la rejilla sigue siendo 32³ sobre [0,1]³ del píxel, pero las
+        # distancias se miden con cada eje escalado (métrica ponderada: pal_lin = palette_w,
+        # axis_scale = sqrt_w).
+        g = _ED_GRID
+        pal = np.asarray(pal_lin, dtype=np.float64)
+        scale = np.ones((3,), dtype=np.float64) if axis_scale is None else np.asarray(axis_scale, dtype=np.float64)
+
+        edges = np.arange(g + 1, dtype=np.float64) / g
+
+        # Por eje (G,K): distancia mínima y máxima de la coordenada al intervalo.
+        dmin_ax = []
+        dmax_ax = []
+        for ch in range(3):
+            lo = edges[:-1] * scale[ch]
+            hi = edges[1:] * scale[ch]
+            p = pal[None, :, ch]
+            dmin_ax.append(np.maximum(0.0, np.maximum(lo[:, None] - p, p - hi[:, None])) ** 2)
+            dmax_ax.append(np.maximum(np.abs(lo[:, None] - p), np.abs(hi[:, None] - p)) ** 2)
+
+        dmin = dmin_ax[0][:, None, None, :] + dmin_ax[1][None, :, None, :] + dmin_ax[2][None, None, :, :]
+        dmax = dmax_ax[0][:, None, None, :] + dmax_ax[1][None, :, None, :] + dmax_ax[2][None, None, :, :]
+        bound = dmax.min(axis=3, keepdims=True) + float(eps)
+
+        self._mask = (dmin <= bound).reshape(g * g * g, -1)
+        self._pal32 = np.asarray(pal_lin, dtype=np.float32)
+        self._cells: Dict[int, tuple] = {}
+        self.full = self._pack(np.arange(self._pal32.shape[0]))
+        self._csr: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def _pack(self, ids: np.ndarray) -> tuple:
+        pal = self._pal32
+        return tuple((int(i), pal[i, 0], pal[i, 1], pal[i, 2]) for i in ids)
+
+    def cell(self, ci: int) -> tuple:
+        c = self._cells.get(ci)
+        if c is None:
+            c = self._pack(np.nonzero(self._mask[ci])[0])
+            self._cells[ci] = c
+        return c
+
+    def csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(cell_start (G³+1,), cell_ids) int32 arrays for the Numba kernels."""
+        if self._csr is None:
+            counts = self._mask.sum(axis=1)
+            start = np.zeros((counts.shape[0] + 1,), dtype=np.int32)
+            np.cumsum(counts, out=start[1:])
+            ids = np.nonzero(self._mask)[1].astype(np.int32)
+            self._csr = (start, ids)
+        return self._csr
+
+
+def _ed_candidate_grid(
+    pal_lin: np.ndarray,
+    *,
+    axis_scale: Optional[np.ndarray] = None,
+    eps: float = _ED_GRID_EPS,
+) -> _EDCandidateGrid:
+    key = np.ascontiguousarray(pal_lin, dtype=np.float32).tobytes()
+    if axis_scale is not None:
+        key += np.ascontiguousarray(axis_scale, dtype=np.float32).tobytes()
+    key += np.float64(eps).tobytes()
+    with _ED_GRID_LOCK:
+        hit = _ED_GRID_CACHE.get(key)
+        if hit is not None:
+            _ED_GRID_CACHE.move_to_end(key)
+            return hit
+
+    grid = _EDCandidateGrid(pal_lin, axis_scale=axis_scale, eps=eps)
+
+    with _ED_GRID_LOCK:
+        _ED_GRID_CACHE[key] = grid
+        _ED_GRID_CACHE.move_to_end(key)
+        while len(_ED_GRID_CACHE) > _ED_GRID_CACHE_MAX:
+            _ED_GRID_CACHE.popitem(last=False)
+    return grid
+
+
+# ==========================================================
+# Error diffusion core (Numba accelerated if available)
+# ==========================================================
+#
+# Aritmética float32 estricta (sin fastmath), igual que _ed_core_python: los tres
+# motores (numba secuencial, numba wavefront, numpy) dan exactamente los mismos bytes.
+#
+# - _ed_core_numba: escaneo secuencial (serpentine o no), nogil.
+# - _ed_wavefront_numba: sólo escaneo raster (serpentine=False). La fila y+1 puede
+#   empezar en cuanto la fila y va unos píxeles por delante: se procesan bloques de
+#   columnas en diagonales t = bx + slope*y, en paralelo (prange) dentro de cada t.
+#   Cada píxel *recoge* el error de sus fuentes en el orden secuencial, así el
+#   redondeo es idéntico al del escaneo secuencial.
+#   Con serpentine la fila y+1 empieza justo donde termina la fila y: no hay solape.
+
+_ED_WAVEFRONT_TILE = 32
+_ED_WAVEFRONT_MIN_PIXELS = 256 * 256
+# scan="auto": a partir de aquí se usa escaneo raster (paralelizable) en vez de serpentine.
+_ED_RASTER_SCAN_MIN_PIXELS = 512 * 512
 
 if _HAVE_NUMBA:
-    @njit(cache=True, fastmath=True)
-    def _nearest_idx_weighted(r: float, g: float, b: float, pal_lin: np.ndarray) -> int:
+    _F32_ZERO = np.float32(0.0)
+    _F32_ONE = np.float32(1.0)
+    _F32_BIG = np.float32(1e30)
+
+    @njit(cache=True, nogil=True)
+    def _nearest_idx_weighted(r, g, b, pal_lin: np.ndarray) -> int:
         # IMPORTANT (Proyecto Canvas compatibility)
         # ---------------------------------------
         # Historically, the Preview dithering path used an *unweighted* Euclidean
@@ -309,7 +1011,7 @@ if _HAVE_NUMBA:
         # To restore visual compatibility, we keep the function name (to avoid
         # refactors) but compute the classic Euclidean squared distance.
         best_i = 0
-        best_d = 1e30
+        best_d = _F32_BIG
         k = pal_lin.shape[0]
         for i in range(k):
             dr = r - pal_lin[i, 0]
@@ -322,26 +1024,69 @@ if _HAVE_NUMBA:
         return best_i
 
 
-    @njit(cache=True, fastmath=True)
+    @njit(cache=True, nogil=True)
+    def _nearest_idx_grid(
+        r, g, b,
+        pal_lin: np.ndarray,
+        cell_start: np.ndarray,
+        cell_ids: np.ndarray,
+        grid_n: int,
+    ) -> int:
+        if r < 0.0 or r > 1.0 or g < 0.0 or g > 1.0 or b < 0.0 or b > 1.0:
+            return _nearest_idx_weighted(r, g, b, pal_lin)
+
+        gmax = grid_n - 1
+        cx = min(int(r * grid_n), gmax)
+        cy = min(int(g * grid_n), gmax)
+        cz = min(int(b * grid_n), gmax)
+        ci = (cx * grid_n + cy) * grid_n + cz
+
+        j0 = cell_start[ci]
+        j1 = cell_start[ci + 1]
+        best_i = cell_ids[j0]
+        if j1 - j0 == 1:
+            return best_i
+
+        best_d = _F32_BIG
+        for j in range(j0, j1):
+            i = cell_ids[j]
+            dr = r - pal_lin[i, 0]
+            dg = g - pal_lin[i, 1]
+            db = b - pal_lin[i, 2]
+            d = dr * dr + dg * dg + db * db
+            if d < best_d:
+                best_d = d
+                best_i = i
+        return best_i
+
+
+    @njit(cache=True, nogil=True)
     def _ed_core_numba(
         work: np.ndarray,           # (H,W,3) float32
         active: np.ndarray,         # (H,W) uint8 0/1
         pal_lin: np.ndarray,        # (K,3) float32
         pal_bytes: np.ndarray,      # (K,) uint8
+        cell_start: np.ndarray,     # (G³+1,) int32
+        cell_ids: np.ndarray,       # (nnz,) int32
+        grid_n: int,
         dx: np.ndarray,             # (T,) int32
         dy: np.ndarray,             # (T,) int32
         wt: np.ndarray,             # (T,) float32
-        strength: float,
+        strength: np.float32,
         serpentine: int,
         respect_mask: int,
         clamp01: int,
         out: np.ndarray,            # (H,W) uint8
+        cancel: np.ndarray,         # (1,) uint8, != 0 -> abortar
     ) -> None:
         h = work.shape[0]
         w = work.shape[1]
         tcount = dx.shape[0]
 
         for y in range(h):
+            if cancel[0] != 0:
+                return
+
             rev = 0
             if serpentine != 0 and (y & 1) == 1:
                 rev = 1
@@ -367,19 +1112,19 @@ if _HAVE_NUMBA:
 
                 if clamp01 != 0:
                     if r < 0.0:
-                        r = 0.0
+                        r = _F32_ZERO
                     elif r > 1.0:
-                        r = 1.0
+                        r = _F32_ONE
                     if g < 0.0:
-                        g = 0.0
+                        g = _F32_ZERO
                     elif g > 1.0:
-                        g = 1.0
+                        g = _F32_ONE
                     if b < 0.0:
-                        b = 0.0
+                        b = _F32_ZERO
                     elif b > 1.0:
-                        b = 1.0
+                        b = _F32_ONE
 
-                idx = _nearest_idx_weighted(r, g, b, pal_lin)
+                idx = _nearest_idx_grid(r, g, b, pal_lin, cell_start, cell_ids, grid_n)
                 out[y, x] = pal_bytes[idx]
 
                 pr = pal_lin[idx, 0]
@@ -415,6 +1160,380 @@ if _HAVE_NUMBA:
                 x += step
 
 
+    @njit(cache=True, parallel=True, nogil=True)
+    def _ed_wavefront_numba(
+        src: np.ndarray,            # (H,W,3) float32, solo lectura
+        active: np.ndarray,         # (H,W) uint8 0/1
+        pal_lin: np.ndarray,        # (K,3) float32
+        pal_bytes: np.ndarray,      # (K,) uint8
+        cell_start: np.ndarray,
+        cell_ids: np.ndarray,
+        grid_n: int,
+        pdx: np.ndarray,            # (T,) int32, taps en orden de llegada (dy desc, dx desc)
+        pdy: np.ndarray,            # (T,) int32
+        pwt: np.ndarray,            # (T,) float32
+        strength: np.float32,
+        clamp01: int,
+        slope: int,
+        tile: int,
+        err: np.ndarray,            # (H,W,3) float32 scratch
+        out: np.ndarray,            # (H,W) uint8
+        cancel: np.ndarray,         # (1,) uint8, != 0 -> abortar
+    ) -> None:
+        h = src.shape[0]
+        w = src.shape[1]
+        tcount = pdx.shape[0]
+        nbx = (w + tile - 1) // tile
+        nsteps = (nbx - 1) + slope * (h - 1) + 1
+
+        for t in range(nsteps):
+            if cancel[0] != 0:
+                return
+            y_lo = 0
+            if t > nbx - 1:
+                y_lo = (t - (nbx - 1) + slope - 1) // slope
+            y_hi = min(h - 1, t // slope)
+
+            for y in prange(y_lo, y_hi + 1):
+                bx = t - slope * y
+                xa = bx * tile
+                xb = min(w, xa + tile)
+
+                for x in range(xa, xb):
+                    if active[y, x] == 0:
+                        continue
+
+                    r = src[y, x, 0]
+                    g = src[y, x, 1]
+                    b = src[y, x, 2]
+
+                    # El destino es activo: respect_mask no descarta nada aquí.
+                    for ti in range(tcount):
+                        sy = y - pdy[ti]
+                        sx = x - pdx[ti]
+                        if sy < 0 or sx < 0 or sx >= w:
+                            continue
+                        if active[sy, sx] == 0:
+                            continue
+                        wgt = pwt[ti]
+                        r += err[sy, sx, 0] * wgt
+                        g += err[sy, sx, 1] * wgt
+                        b += err[sy, sx, 2] * wgt
+
+                    if clamp01 != 0:
+                        if r < 0.0:
+                            r = _F32_ZERO
+                        elif r > 1.0:
+                            r = _F32_ONE
+                        if g < 0.0:
+                            g = _F32_ZERO
+                        elif g > 1.0:
+                            g = _F32_ONE
+                        if b < 0.0:
+                            b = _F32_ZERO
+                        elif b > 1.0:
+                            b = _F32_ONE
+
+                    idx = _nearest_idx_grid(r, g, b, pal_lin, cell_start, cell_ids, grid_n)
+                    out[y, x] = pal_bytes[idx]
+
+                    err[y, x, 0] = (r - pal_lin[idx, 0]) * strength
+                    err[y, x, 1] = (g - pal_lin[idx, 1]) * strength
+                    err[y, x, 2] = (b - pal_lin[idx, 2]) * strength
+
+
+def _wavefront_plan(
+    taps: Tuple[Tuple[int, int, float], ...], tile: int
+) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, int]]:
+    """Pull-order taps + diagonal slope for _ed_wavefront_numba, or None if unsupported."""
+    slope = 1
+    for (tx, ty, _) in taps:
+        if ty < 0 or (ty == 0 and tx <= 0):
+            return None
+        if ty > 0:
+            back = max(0, -int(tx))
+            if back > tile:
+                return None
+            shift = 1 if back > 0 else 0
+            slope = max(slope, shift // int(ty) + 1)
+
+    order = sorted(taps, key=lambda t: (-t[1], -t[0]))
+    pdx = np.array([t[0] for t in order], dtype=np.int32)
+    pdy = np.array([t[1] for t in order], dtype=np.int32)
+    pwt = np.array([t[2] for t in order], dtype=np.float32)
+    return pdx, pdy, pwt, slope
+
+
+def ed_serpentine_for(height: int, width: int, scan: Optional[str] = None) -> bool:
+    """Scan order for error diffusion of a (height, width) canvas (True = serpentine).
+
+    scan: "serpentine" | "raster" | "auto"; None reads PC_ED_SCAN (default "auto").
+    auto picks raster scan for canvases >= 512×512, which the wavefront kernel spreads
+    over all cores, and serpentine below. It depends only on the size, never on the
+    core count, so the same canvas dithers identically on every machine.
+    """
+    if scan is None:
+        scan = os.environ.get("PC_ED_SCAN", "auto")
+    scan = str(scan or "auto").strip().lower()
+    if scan == "serpentine":
+        return True
+    if scan == "raster":
+        return False
+    if scan != "auto":
+        raise ValueError(f"scan no soportado: {scan}")
+    return int(height) * int(width) < _ED_RASTER_SCAN_MIN_PIXELS
+
+
+def _numba_threads() -> int:
+    try:
+        import numba
+
+        return int(numba.get_num_threads())
+    except Exception:
+        return 1
+
+
+# ==========================================================
+# Error diffusion core (NumPy, scanline-vectorized)
+# ==========================================================
+#
+# Para runtimes sin Numba (Pyodide). Bit-compatible con _ed_core_python:
+#
+# - Error hacia filas inferiores: al terminar una fila se aplica vectorizado, tap a
+#   tap, en el orden en que el escaneo secuencial lo sumaría (por cada dy, dx
+#   descendente en coordenadas de escaneo). Las filas serpentine se procesan como
+#   vistas invertidas, así los taps quedan siempre "hacia la derecha".
+# - Nearest: rejilla de candidatos (_EDCandidateGrid), normalmente 1-4 dyes en vez de K.
+# - Lo único secuencial es el arrastre dentro de la fila (dy == 0): una recurrencia
+#   que no se puede reasociar sin romper el redondeo float32. Se hace con escalares
+#   float32 (mismas operaciones y en el mismo orden que la referencia).
+# - Todos los operandos son np.float32 explícitos (valores, strength, pesos, límites
+#   del clamp): con NumPy 1.x, mezclar np.float32 con floats de Python promociona a
+#   float64 y el resultado se apartaría del de Numba.
+
+def _ed_row_scalar(
+    vals: list,                  # [[r,g,b]] fila en orden de escaneo (se modifica)
+    acts: list,                  # [bool]
+    grid: _EDCandidateGrid,
+    taps0: tuple,                # ((dx, wgt),) dy == 0, en el orden del kernel
+    strength: float,
+    clamp01: bool,
+    respect_mask: bool,
+) -> Tuple[list, list]:
+    """In-row recurrence with float32 scalars. Returns (idx list, err list)."""
+    f32 = np.float32
+    zero = f32(0.0)
+    one = f32(1.0)
+    strength = f32(strength)
+    w = len(vals)
+    g = _ED_GRID
+    gmax = g - 1
+    full = grid.full
+    cells_get = grid._cells.get
+
+    idx_out = [0] * w
+    err_out = [(0.0, 0.0, 0.0)] * w
+
+    for x in range(w):
+        if not acts[x]:
+            continue
+
+        r, gg, b = vals[x]
+        r, gg, b = f32(r), f32(gg), f32(b)
+        if clamp01:
+            r = zero if r < zero else (one if r > one else r)
+            gg = zero if gg < zero else (one if gg > one else gg)
+            b = zero if b < zero else (one if b > one else b)
+
+        if zero <= r <= one and zero <= gg <= one and zero <= b <= one:
+            cx = int(r * g)
+            cy = int(gg * g)
+            cz = int(b * g)
+            ci = ((cx if cx < gmax else gmax) * g + (cy if cy < gmax else gmax)) * g + (cz if cz < gmax else gmax)
+            cands = cells_get(ci)
+            if cands is None:
+                cands = grid.cell(ci)
+        else:
+            cands = full
+
+        if len(cands) == 1:
+            best_i, pr, pg, pb = cands[0]
+        else:
+            best_d = 1e30
+            for (i, cr, cg, cb) in cands:
+                dr = r - cr
+                dg = gg - cg
+                db = b - cb
+                d = dr * dr + dg * dg + db * db
+                if d < best_d:
+                    best_d = d
+                    best_i, pr, pg, pb = i, cr, cg, cb
+
+        idx_out[x] = best_i
+
+        er = (r - pr) * strength
+        eg = (gg - pg) * strength
+        eb = (b - pb) * strength
+        err_out[x] = (er, eg, eb)
+
+        for (ddx, wgt) in taps0:
+            nx = x + ddx
+            if nx >= w:
+                continue
+            if respect_mask and not acts[nx]:
+                continue
+            v = vals[nx]
+            v[0] = f32(v[0]) + er * wgt
+            v[1] = f32(v[1]) + eg * wgt
+            v[2] = f32(v[2]) + eb * wgt
+
+    return idx_out, err_out
+
+
+def _ed_core_numpy(
+    work: np.ndarray,
+    active: np.ndarray,
+    pal_lin: np.ndarray,
+    pal_bytes: np.ndarray,
+    taps: Tuple[Tuple[int, int, float], ...],
+    strength: float,
+    serpentine: bool,
+    respect_mask: bool,
+    clamp01: bool,
+    out: np.ndarray,
+    cancel: Optional[CancelToken] = None,
+) -> None:
+    h, w, _ = work.shape
+    grid = _ed_candidate_grid(pal_lin)
+
+    taps0 = tuple((int(tx), np.float32(tw)) for (tx, ty, tw) in taps if ty == 0)
+    if any(tx <= 0 for tx, _ in taps0):
+        raise ValueError("kernel no soportado por el motor numpy (tap hacia atrás en la fila)")
+
+    taps_down: Dict[int, list] = {}
+    for (tx, ty, tw) in taps:
+        if ty > 0:
+            taps_down.setdefault(int(ty), []).append((int(tx), np.float32(tw)))
+    for ty in taps_down:
+        # mismo orden de suma que el escaneo secuencial: fuente más temprana primero
+        taps_down[ty].sort(key=lambda t: -t[0])
+
+    fwd = slice(None)
+    bwd = slice(None, None, -1)
+
+    for y in range(h):
+        check_cancel(cancel)
+        sl = bwd if (serpentine and (y & 1) == 1) else fwd
+        act = active[y, sl]
+        if not act.any():
+            continue
+
+        row = work[y, sl]
+        idx_l, err_l = _ed_row_scalar(
+            row.tolist(), act.tolist(), grid, taps0, strength, clamp01, respect_mask
+        )
+
+        idx = np.asarray(idx_l, dtype=np.intp)
+        row_out = out[y, sl]
+        row_out[act] = pal_bytes[idx[act]]
+
+        if not taps_down:
+            continue
+        e = np.asarray(err_l, dtype=np.float32)
+
+        for ty, lst in taps_down.items():
+            ny = y + ty
+            if ny >= h:
+                continue
+            dst = work[ny, sl]
+            dact = active[ny, sl]
+            for tx, tw in lst:
+                # fuente sx -> destino sx + tx
+                s0 = max(0, -tx)
+                s1 = min(w, w - tx)
+                if s1 <= s0:
+                    continue
+                m = act[s0:s1]
+                if respect_mask:
+                    m = m & dact[s0 + tx:s1 + tx]
+                np.add(
+                    dst[s0 + tx:s1 + tx],
+                    e[s0:s1] * tw,
+                    out=dst[s0 + tx:s1 + tx],
+                    where=m[:, None],
+                )
+
+
+def _ed_core_python(
+    work: np.ndarray,
+    active: np.ndarray,
+    pal_lin: np.ndarray,
+    pal_bytes: np.ndarray,
+    taps: Tuple[Tuple[int, int, float], ...],
+    strength: float,
+    serpentine: bool,
+    respect_mask: bool,
+    clamp01: bool,
+    out: np.ndarray,
+    cancel: Optional[CancelToken] = None,
+) -> None:
+    """Reference implementation (pixel by pixel, float32 scalars). Slow, but it defines
+    the exact semantics the other engines must reproduce."""
+    h, w, _ = work.shape
+    zero = np.float32(0.0)
+    one = np.float32(1.0)
+    strength = np.float32(strength)
+    taps = tuple((int(tx), int(ty), np.float32(tw)) for (tx, ty, tw) in taps)
+    for y in range(h):
+        check_cancel(cancel)
+        rev = serpentine and (y & 1) == 1
+        xs = range(w - 1, -1, -1) if rev else range(w)
+        for x in xs:
+            if not active[y, x]:
+                continue
+
+            r, g, b = work[y, x]
+            if clamp01:
+                r = zero if r < zero else (one if r > one else r)
+                g = zero if g < zero else (one if g > one else g)
+                b = zero if b < zero else (one if b > one else b)
+
+            # nearest
+            best_i = 0
+            best_d = 1e30
+            for i in range(pal_lin.shape[0]):
+                dr = r - pal_lin[i, 0]
+                dg = g - pal_lin[i, 1]
+                db = b - pal_lin[i, 2]
+                # See note in _nearest_idx_weighted(): legacy preview used
+                # unweighted Euclidean distance.
+                d = dr * dr + dg * dg + db * db
+                if d < best_d:
+                    best_d = d
+                    best_i = i
+
+            out[y, x] = int(pal_bytes[best_i])
+            pr, pg, pb = pal_lin[best_i]
+            work[y, x] = (pr, pg, pb)
+
+            er = (r - pr) * strength
+            eg = (g - pg) * strength
+            eb = (b - pb) * strength
+
+            for (ddx, ddy, wgt) in taps:
+                if rev:
+                    ddx = -ddx
+                nx = x + ddx
+                ny = y + ddy
+                if ny < 0 or ny >= h or nx < 0 or nx >= w:
+                    continue
+                if respect_mask and not active[ny, nx]:
+                    continue
+                work[ny, nx, 0] += er * wgt
+                work[ny, nx, 1] += eg * wgt
+                work[ny, nx, 2] += eb * wgt
+
+
 def ed_quantize_to_bytes(
     rgb_linear: np.ndarray,
     active_mask: np.ndarray,
@@ -425,10 +1544,13 @@ def ed_quantize_to_bytes(
     *,
     kernel: str = "floyd_steinberg",
     strength: float = 1.0,
-    serpentine: bool = True,
+    serpentine: Optional[bool] = True,
     respect_mask: bool = True,
     clamp01: bool = True,
     out: Optional[np.ndarray] = None,
+    engine: str = "auto",
+    parallel: Optional[bool] = None,
+    cancel: Optional[CancelToken] = None,
 ) -> np.ndarray:
     """Error diffusion quantization to bytes.
 
@@ -443,6 +1565,19 @@ def ed_quantize_to_bytes(
     palette_linear:
         optional float32 (K,3). If omitted, uses palette_w/sqrt_w is not enough for
         diffusion; so this should be provided.
+    serpentine:
+        scan order; None = ed_serpentine_for(H, W) (raster scan on large canvases).
+    engine:
+        "auto" (Numba if available, else NumPy), "numba", "numpy" (scanline-vectorized,
+        bit-compatible with the reference) or "python" (pixel-by-pixel reference).
+        All engines produce identical bytes.
+    parallel:
+        Numba only, raster scans only (serpentine=False): multi-core wavefront.
+        None = auto (large images and more than one Numba thread). Serpentine scans
+        are a single dependency chain and always run sequentially (nogil).
+    cancel:
+        optional CancelToken, checked once per row (per wavefront step). Raises
+        RenderCancelled; `out` is then partially written.
     """
     strength = _clamp01(float(strength))
 
@@ -453,6 +1588,9 @@ def ed_quantize_to_bytes(
     if active_mask.shape != (h, w):
         raise ValueError("active_mask debe ser (H,W)")
 
+    if serpentine is None:
+        serpentine = ed_serpentine_for(h, w)
+
     if palette_linear is None:
         # Fallback: try to reconstruct from palette_w if possible (requires sqrt_w)
         raise ValueError("palette_linear es obligatorio para error diffusion")
@@ -490,72 +1628,86 @@ def ed_quantize_to_bytes(
     # Work buffer (in-place diffusion)
     work = np.asarray(rgb_linear, dtype=np.float32, order="C").copy()
 
-    if _HAVE_NUMBA:
+    eng = (engine or "auto").strip().lower()
+    if eng == "auto":
+        eng = "numba" if _HAVE_NUMBA else "numpy"
+    if eng == "numba" and not _HAVE_NUMBA:
+        raise RuntimeError("engine='numba' pero Numba no está disponible")
+    if eng not in ("numba", "numpy", "python"):
+        raise ValueError(f"engine no soportado: {engine}")
+
+    if eng == "numba":
         active_u8 = np.ascontiguousarray(active_mask.astype(np.uint8))
+        cell_start, cell_ids = _ed_candidate_grid(pal_lin).csr()
+
+        plan = None
+        if not serpentine:
+            if parallel is None:
+                use_wf = (h * w) >= _ED_WAVEFRONT_MIN_PIXELS and _numba_threads() > 1
+            else:
+                use_wf = bool(parallel)
+            if use_wf:
+                plan = _wavefront_plan(k.taps, _ED_WAVEFRONT_TILE)
+
+        if plan is not None:
+            pdx, pdy, pwt, slope = plan
+            err = np.zeros((h, w, 3), dtype=np.float32)
+            _ed_wavefront_numba(
+                work,
+                active_u8,
+                pal_lin,
+                pal_bytes,
+                cell_start,
+                cell_ids,
+                _ED_GRID,
+                pdx,
+                pdy,
+                pwt,
+                np.float32(strength),
+                1 if clamp01 else 0,
+                int(slope),
+                _ED_WAVEFRONT_TILE,
+                err,
+                out,
+                cancel_flag(cancel),
+            )
+            check_cancel(cancel)
+            return out
+
         _ed_core_numba(
             work,
             active_u8,
             pal_lin,
             pal_bytes,
+            cell_start,
+            cell_ids,
+            _ED_GRID,
             dx,
             dy,
             wt,
-            float(strength),
+            np.float32(strength),
             1 if serpentine else 0,
             1 if respect_mask else 0,
             1 if clamp01 else 0,
             out,
+            cancel_flag(cancel),
         )
+        check_cancel(cancel)
         return out
 
-    # Pure-Python fallback (slower, but correct)
-    active = active_mask
-    for y in range(h):
-        rev = serpentine and (y & 1) == 1
-        xs = range(w - 1, -1, -1) if rev else range(w)
-        for x in xs:
-            if not active[y, x]:
-                continue
-
-            r, g, b = work[y, x]
-            if clamp01:
-                r = 0.0 if r < 0.0 else (1.0 if r > 1.0 else r)
-                g = 0.0 if g < 0.0 else (1.0 if g > 1.0 else g)
-                b = 0.0 if b < 0.0 else (1.0 if b > 1.0 else b)
-
-            # nearest
-            best_i = 0
-            best_d = 1e30
-            for i in range(pal_lin.shape[0]):
-                dr = r - pal_lin[i, 0]
-                dg = g - pal_lin[i, 1]
-                db = b - pal_lin[i, 2]
-                # See note in _nearest_idx_weighted(): legacy preview used
-                # unweighted Euclidean distance.
-                d = dr * dr + dg * dg + db * db
-                if d < best_d:
-                    best_d = d
-                    best_i = i
-
-            out[y, x] = int(pal_bytes[best_i])
-            pr, pg, pb = pal_lin[best_i]
-            work[y, x] = (pr, pg, pb)
-
-            er = (r - pr) * strength
-            eg = (g - pg) * strength
-            eb = (b - pb) * strength
-
-            for (ddx, ddy, wgt) in k.taps:
-                if rev:
-                    ddx = -ddx
-                nx = x + ddx
-                ny = y + ddy
-                if ny < 0 or ny >= h or nx < 0 or nx >= w:
-                    continue
-                if respect_mask and not active[ny, nx]:
-                    continue
-                work[ny, nx, 0] += er * wgt
-                work[ny, nx, 1] += eg * wgt
-                work[ny, nx, 2] += eb * wgt
-
+    active = np.ascontiguousarray(active_mask, dtype=bool)
+    core = _ed_core_numpy if eng == "numpy" else _ed_core_python
+    core(
+        work,
+        active,
+        pal_lin,
+        pal_bytes,
+        k.taps,
+        strength,
+        bool(serpentine),
+        bool(respect_mask),
+        bool(clamp01),
+        out,
+        cancel,
+    )
     return out
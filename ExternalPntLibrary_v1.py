@@ -5,11 +5,10 @@ import re
 import time
 import json
 import math
-import struct
 from pathlib import Path
 from typing import Optional, Tuple, List, Dict, Any
 
-from PntIO import peek_pnt_info
+from PntIO import PntFile, peek_pnt_info
 from PntExtGuidExtractor_v1 import extract_guid_from_pnt_tail, extract_guid_with_offset_from_pnt_tail
 
 # ------------------------------------------------------------
@@ -36,7 +35,6 @@ _BP_BYTES_RE = re.compile(rb"|".join(
      rb"(?:[A-Za-z0-9_]+_BP_C)"]
 ))
 
-_GUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
 _HINT_WH_RE = re.compile(r"(\d{2,4})x(\d{2,4})")
 
 def extract_blueprint_from_filename(stem: str) -> Optional[str]:
@@ -113,9 +111,6 @@ def _extract_blueprint_light(p: Path, *, head_bytes: int = 256_000, tail_bytes:
     except Exception:
         return None
 
-def _u32(b: bytes, off: int) -> Tuple[int, int]:
-    return struct.unpack_from("<I", b, off)[0], off + 4
-
 def _parse_hint_wh(name: str) -> Tuple[Optional[int], Optional[int]]:
     if not name:
         return None, None
@@ -155,62 +150,15 @@ def try_parse_asa_guid_header_pnt(p: Path) -> Optional[Dict[str, Any]]:
       u32 a1, a2, a3, raster_len
       raster bytes (raster_len)
       tail (unknown)
-    """
-    try:
-        data = p.read_bytes()
-    except Exception:
-        return None
 
-    nul = data.find(b"\x00")
-    if nul <= 0 or nul > 80:
-        return None
+    Parsing lives in PntIO.parse_asa_guid_header (only the header pages are read).
+    """
     try:
-        guid = data[:nul].decode("ascii", errors="strict")
+        f = PntFile(p)
     except Exception:
         return None
-    if not _GUID_RE.match(guid):
-        return None
-
-    off = nul + 1
-    if off + 4 * 3 > len(data):
-        return None
-
-    version, off = _u32(data, off)
-    name_len, off = _u32(data, off)
-    if name_len < 0 or off + name_len > len(data):
-        return None
-    name = data[off:off + name_len].decode("utf-8", errors="replace").rstrip("\x00").strip()
-    off += name_len
-
-    bp_len, off = _u32(data, off)
-    if bp_len < 0 or off + bp_len > len(data):
-        return None
-    blueprint = data[off:off + bp_len].decode("utf-8", errors="replace").rstrip("\x00").strip()
-    off += bp_len
-
-    if off + 16 > len(data):
-        return None
-    a1, off = _u32(data, off)
-    a2, off = _u32(data, off)
-    a3, off = _u32(data, off)
-    raster_len, off = _u32(data, off)
-
-    if raster_len <= 0 or off + raster_len > len(data):
-        # some files might be truncated; treat as unknown
-        return None
-
-    return {
-        "guid": guid,
-        "version": int(version),
-        "internal_name": name,
-        "blueprint": blueprint,
-        "a1": int(a1),
-        "a2": int(a2),
-        "a3": int(a3),
-        "raster_len": int(raster_len),
-        "raster_off": int(off),
-        "file_size": len(data),
-    }
+    with f:
+        return f.asa_header
 
 # ------------------------------------------------------------
 # Dynamic canvas size filtering (deterministic, no GUI "magic")
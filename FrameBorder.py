@@ -1,5 +1,10 @@
+from dataclasses import dataclass
+import hashlib
+
 import numpy as np
 
+from LRUCache import LRUCache
+
 
 def _lerp(a: np.ndarray, b: np.ndarray, t: float) -> np.ndarray:
     return a * (1.0 - t) + b * t
@@ -9,28 +14,56 @@ def _bilinear_sample(img: np.ndarray, x: float, y: float) -> np.ndarray:
     """
     Muestreo bilineal de una imagen (RGB o RGBA) en coordenadas float.
     """
+    return _bilinear_sample_many(img, np.array([x], dtype=np.float64), np.array([y], dtype=np.float64))[0]
+
+
+def _bilinear_sample_many(img: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Muestreo bilineal vectorizado: x, y (N,) float -> (N, C) float64.
+    Mismas reglas que el muestreo por píxel (clamp a la imagen, vecino +1 recortado).
+    img uint8 se interpreta como [0..1] (u8/255).
+    """
     h, w, _ = img.shape
     x = np.clip(x, 0.0, w - 1.0)
     y = np.clip(y, 0.0, h - 1.0)
 
-    x0 = int(np.floor(x))
-    y0 = int(np.floor(y))
-    x1 = min(x0 + 1, w - 1)
-    y1 = min(y0 + 1, h - 1)
+    x0 = np.floor(x).astype(np.intp)
+    y0 = np.floor(y).astype(np.intp)
+    x1 = np.minimum(x0 + 1, w - 1)
+    y1 = np.minimum(y0 + 1, h - 1)
 
-    dx = x - x0
-    dy = y - y0
+    dx = (x - x0)[:, None]
+    dy = (y - y0)[:, None]
 
     c00 = img[y0, x0]
     c10 = img[y0, x1]
     c01 = img[y1, x0]
     c11 = img[y1, x1]
+    if img.dtype == np.uint8:
+        # Texturas uint8: se normalizan sólo las muestras (mismo valor que normalizar todo).
+        c00, c10, c01, c11 = (c.astype(np.float32) / 255.0 for c in (c00, c10, c01, c11))
 
     c0 = c00 * (1.0 - dx) + c10 * dx
     c1 = c01 * (1.0 - dx) + c11 * dx
     return c0 * (1.0 - dy) + c1 * dy
 
 
+def _border_coords(x0: int, y0: int, x1: int, y1: int, B: int):
+    """
+    Coordenadas (xs, ys) de todos los píxeles del borde, en bloque:
+    franjas top / bottom completas + laterales sin repetir esquinas.
+    """
+    top_y, top_x = np.mgrid[y0 : y0 + B, x0:x1]
+    bot_y, bot_x = np.mgrid[y1 - B : y1, x0:x1]
+    side_rows = np.arange(y0 + B, y1 - B)
+    side_cols = np.concatenate([np.arange(x0, x0 + B), np.arange(x1 - B, x1)])
+    side_y, side_x = np.meshgrid(side_rows, side_cols, indexing="ij")
+
+    xs = np.concatenate([top_x.ravel(), bot_x.ravel(), side_x.ravel()])
+    ys = np.concatenate([top_y.ravel(), bot_y.ravel(), side_y.ravel()])
+    return xs, ys
+
+
 def _normalize_rgb(color) -> np.ndarray:
     """
     Acepta (r,g,b) en [0..1] o [0..255]. Devuelve float32 [0..1].
@@ -41,6 +74,164 @@ def _normalize_rgb(color) -> np.ndarray:
     return np.clip(c, 0.0, 1.0)
 
 
+# ==========================================================
+# Border layer cache (deterministic borders only)
+# ==========================================================
+#
+# El borde no depende de la imagen de debajo (se sobrescribe), sólo de la geometría
+# de la paint_area y de los parámetros: se renderiza una vez como "capa" (píxeles
+# del borde + colores) y se compone. Con ruido, sólo si hay semilla (noise_seed).
+
+_BORDER_CACHE = LRUCache(8, max_bytes=64 * 1024 * 1024)
+
+
+@dataclass(frozen=True)
+class BorderLayer:
+    """Rendered border strips, relative to the paint-area origin."""
+    height: int
+    width: int
+    ys: np.ndarray          # (N,) intp
+    xs: np.ndarray          # (N,) intp
+    colors: np.ndarray      # (N, C) en el dtype de la imagen destino
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.ys.nbytes + self.xs.nbytes + self.colors.nbytes)
+
+    @property
+    def mask(self) -> np.ndarray:
+        """Coverage mask (H, W) bool."""
+        m = np.zeros((self.height, self.width), dtype=bool)
+        m[self.ys, self.xs] = True
+        return m
+
+
+def frame_image_digest(frame_image: np.ndarray | None) -> str | None:
+    if frame_image is None:
+        return None
+    fi = np.ascontiguousarray(frame_image)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((fi.shape, fi.dtype.str)).encode("ascii"))
+    h.update(fi.data)
+    return h.hexdigest()
+
+
+def border_cache_stats() -> dict:
+    return _BORDER_CACHE.stats()
+
+
+def clear_border_cache() -> None:
+    _BORDER_CACHE.clear(reset_stats=True)
+
+
+def _render_border_layer(
+    pa_w: int,
+    pa_h: int,
+    *,
+    B: int,
+    channels: int,
+    out_dtype,
+    style: str,
+    outer_px: np.ndarray,
+    inner_px: np.ndarray | None,
+    fi: np.ndarray | None,
+    noise_strength: float,
+    noise_seed: int | None,
+) -> BorderLayer:
+    """Border pixels + colors for a pa_w × pa_h paint area (gradient / rough / image)."""
+    c = int(channels)
+    x0, y0, x1, y1 = 0, 0, int(pa_w), int(pa_h)
+
+    # Ruido: con semilla es reproducible (cacheable); sin ella, RNG global (compat).
+    if noise_seed is None:
+        _rand = np.random.rand
+    else:
+        _rand = np.random.default_rng(int(noise_seed)).random
+
+    # ---------------------------------------------
+    # Píxeles del borde en bloque (las 4 franjas a la vez)
+    # ---------------------------------------------
+    xs, ys = _border_coords(x0, y0, x1, y1, B)
+    n_px = xs.shape[0]
+
+    # Denominadores seguros
+    denom_u_w = float(max(pa_w - 1, 1))
+    denom_u_h = float(max(pa_h - 1, 1))
+    denom_v = float(max(B - 1, 1))
+    denom_t = float(max(B - 1, 1))
+
+    if style != "image":
+        # Distancia al borde de la PAINT_AREA (no al borde global)
+        d = np.minimum(
+            np.minimum(xs - x0, (x1 - 1) - xs),
+            np.minimum(ys - y0, (y1 - 1) - ys),
+        )
+        t = np.clip(d / denom_t, 0.0, 1.0)[:, None]
+        color = _lerp(outer_px, inner_px, t)
+
+        if style == "rough":
+            n = (_rand(n_px) * 2.0) - 1.0
+            n_eff = n[:, None] * float(noise_strength) * (1.0 - t)
+            color = np.clip(color * (1.0 + n_eff), 0.0, 1.0)
+
+    else:
+        fh, fw, fc = fi.shape
+
+        # Determinar lado + coords normalizadas dentro de paint_area
+        top = ys < y0 + B
+        bottom = ~top & (ys >= y1 - B)
+        left = ~top & ~bottom & (xs < x0 + B)
+
+        horiz = top | bottom
+        u = np.where(horiz, (xs - x0) / denom_u_w, (ys - y0) / denom_u_h)
+        v = np.where(
+            top,
+            (ys - y0) / denom_v,
+            np.where(
+                bottom,
+                ((y1 - 1) - ys) / denom_v,
+                np.where(left, (xs - x0) / denom_v, ((x1 - 1) - xs) / denom_v),
+            ),
+        )
+
+        # Tiling solo a lo largo del borde
+        tile_density = 4.0
+        tu = (u * tile_density) % 1.0
+        tv = v
+
+        color = _bilinear_sample_many(fi, tu * (fw - 1), tv * (fh - 1))
+
+        if c == 4 and fc == 3:
+            color = np.concatenate([color, np.ones((n_px, 1), dtype=color.dtype)], axis=1)
+        elif c == 3 and fc == 4:
+            color = color[:, :3]
+
+        # Gamma suave (solo RGB)
+        gamma = 0.9
+        color[:, :3] = np.clip(color[:, :3], 0.0, 1.0) ** gamma
+
+        # Shading por profundidad
+        shade_strength = 0.15
+        color[:, :3] *= (1.0 - shade_strength * (1.0 - v))[:, None]
+
+        # Ruido opcional
+        ns = float(noise_strength)
+        if ns > 0.0:
+            n = (_rand(n_px) * 2.0) - 1.0
+            color[:, :3] *= (1.0 + n * ns)[:, None]
+
+        color = np.clip(color, 0.0, 1.0)
+
+    # float32 como el buffer del algoritmo original antes de volver a uint8
+    color = color.astype(np.float32)
+    if np.dtype(out_dtype) == np.uint8:
+        color = np.clip(color * 255.0, 0, 255).astype(np.uint8)
+
+    for arr in (xs, ys, color):
+        arr.setflags(write=False)
+    return BorderLayer(int(pa_h), int(pa_w), ys, xs, color)
+
+
 def apply_frame_border(
     image: np.ndarray,
     *,
@@ -51,6 +242,8 @@ def apply_frame_border(
     color_inner=None,
     noise_strength: float = 0.3,
     frame_image: np.ndarray | None = None,
+    noise_seed: int | None = None,
+    frame_key: str | None = None,
 ):
     """
     Aplica un borde tipo cuadro a una imagen RGB o RGBA.
@@ -61,6 +254,15 @@ def apply_frame_border(
     paint_area (opcional):
         dict {offset_x, offset_y, width, height}
         Si se pasa, el borde se aplica solo alrededor de esa región.
+
+    noise_seed (opcional):
+        Semilla del ruido. Con semilla (o sin ruido) el borde es determinista y la
+        capa renderizada se reutiliza desde una caché LRU (clave: hash del frame,
+        tamaño, dims de la paint_area, estilo, colores, ruido, semilla).
+        None = RNG global, distinto en cada llamada (comportamiento histórico).
+
+    frame_key (opcional):
+        Identificador estable del frame_image (evita hashear la textura en cada llamada).
     """
     B = int(border_size)
 
@@ -85,12 +287,14 @@ def apply_frame_border(
 
     original_dtype = image.dtype
 
+    # uint8: sólo se convierten los píxeles del borde (u8 -> /255 -> *255 es exacto,
+    # el interior queda idéntico sin pasar por float).
     if image.dtype == np.uint8:
-        img_f = image.astype(np.float32) / 255.0
+        out = image.copy()
     else:
-        img_f = image.astype(np.float32)
+        out = image.astype(np.float32)
 
-    h, w, c = img_f.shape
+    h, w, c = out.shape
     if c not in (3, 4):
         raise ValueError("image debe ser RGB o RGBA")
 
@@ -125,9 +329,7 @@ def apply_frame_border(
     # ---------------------------------------------
     if style == "image":
         fi = frame_image
-        if fi.dtype == np.uint8:
-            fi = fi.astype(np.float32) / 255.0
-        else:
+        if fi.dtype != np.uint8:
             fi = fi.astype(np.float32)
 
         fh, fw, fc = fi.shape
@@ -135,7 +337,6 @@ def apply_frame_border(
             raise ValueError("frame_image debe ser RGB o RGBA")
     else:
         fi = None
-        fh = fw = fc = 0
 
     # ---------------------------------------------
     # Preparar colores base (float32 [0..1])
@@ -154,117 +355,68 @@ def apply_frame_border(
         outer_px = outer_rgb.astype(np.float32)
         inner_px = inner_rgb.astype(np.float32) if inner_rgb is not None else None
 
-    out = img_f.copy()
-
     # ---------------------------------------------
     # Fast path: SOLID (sin loops)
     # ---------------------------------------------
     if style == "solid":
-        out[y0 : y0 + B, x0:x1] = outer_px
-        out[y1 - B : y1, x0:x1] = outer_px
-        out[y0:y1, x0 : x0 + B] = outer_px
-        out[y0:y1, x1 - B : x1] = outer_px
+        px = np.clip(outer_px * 255.0, 0, 255).astype(np.uint8) if original_dtype == np.uint8 else outer_px
+        out[y0 : y0 + B, x0:x1] = px
+        out[y1 - B : y1, x0:x1] = px
+        out[y0:y1, x0 : x0 + B] = px
+        out[y0:y1, x1 - B : x1] = px
 
         if original_dtype == np.uint8:
-            return np.clip(out * 255.0, 0, 255).astype(np.uint8)
+            return out
         return np.clip(out, 0.0, 1.0)
 
     # ---------------------------------------------
-    # Helper para iterar solo en el borde (evita recorrer toda la imagen)
-    # ---------------------------------------------
-    def _iter_border_pixels():
-        # Top
-        for yy in range(y0, y0 + B):
-            for xx in range(x0, x1):
-                yield xx, yy
-        # Bottom
-        for yy in range(y1 - B, y1):
-            for xx in range(x0, x1):
-                yield xx, yy
-        # Sides (sin repetir esquinas ya cubiertas por top/bottom)
-        for yy in range(y0 + B, y1 - B):
-            for xx in range(x0, x0 + B):
-                yield xx, yy
-            for xx in range(x1 - B, x1):
-                yield xx, yy
-
-    # Denominadores seguros
-    denom_u_w = float(max(pa_w - 1, 1))
-    denom_u_h = float(max(pa_h - 1, 1))
-    denom_v = float(max(B - 1, 1))
-    denom_t = float(max(B - 1, 1))
-
-    # ---------------------------------------------
-    # Apply border (gradient / rough / image)
+    # Apply border (gradient / rough / image) desde la capa (cacheada si es determinista)
     # ---------------------------------------------
-    for x, y in _iter_border_pixels():
-        if style != "image":
-            # Distancia al borde de la PAINT_AREA (no al borde global)
-            d = min(
-                x - x0,
-                (x1 - 1) - x,
-                y - y0,
-                (y1 - 1) - y,
-            )
-            t = np.clip(d / denom_t, 0.0, 1.0)
-            base_color = _lerp(outer_px, inner_px, t)
-
-            if style == "gradient":
-                out[y, x] = base_color
-            else:  # rough
-                n = (np.random.rand() * 2.0) - 1.0
-                n_eff = n * float(noise_strength) * (1.0 - t)
-                rough = base_color * (1.0 + n_eff)
-                out[y, x] = np.clip(rough, 0.0, 1.0)
-
+    ns = float(noise_strength)
+    has_noise = ns > 0.0 and style in ("rough", "image")
+    cacheable = (not has_noise) or (noise_seed is not None)
+
+    key = None
+    layer = None
+    if cacheable:
+        if style == "image":
+            fkey = frame_key if frame_key is not None else frame_image_digest(frame_image)
         else:
-            # Determinar lado + coords normalizadas dentro de paint_area
-            if y < y0 + B:  # TOP
-                u = (x - x0) / denom_u_w
-                v = (y - y0) / denom_v
-            elif y >= y1 - B:  # BOTTOM
-                u = (x - x0) / denom_u_w
-                v = ((y1 - 1) - y) / denom_v
-            elif x < x0 + B:  # LEFT
-                u = (y - y0) / denom_u_h
-                v = (x - x0) / denom_v
-            else:  # RIGHT
-                u = (y - y0) / denom_u_h
-                v = ((x1 - 1) - x) / denom_v
-
-            # Tiling solo a lo largo del borde
-            tile_density = 4.0
-            tu = (u * tile_density) % 1.0
-            tv = v
-
-            fx_f = tu * (fw - 1)
-            fy_f = tv * (fh - 1)
-
-            color = _bilinear_sample(fi, fx_f, fy_f)
-
-            if c == 4 and color.shape[0] == 3:
-                color = np.array([color[0], color[1], color[2], 1.0], dtype=np.float32)
-
-            # Gamma suave (solo RGB)
-            gamma = 0.9
-            color[:3] = np.clip(color[:3], 0.0, 1.0) ** gamma
-
-            # Shading por profundidad
-            shade_strength = 0.15
-            shade = 1.0 - shade_strength * (1.0 - v)
-            color[:3] *= shade
-
-            # Ruido opcional
-            ns = float(noise_strength)
-            if ns > 0.0:
-                n = (np.random.rand() * 2.0) - 1.0
-                color[:3] *= (1.0 + n * ns)
-
-            out[y, x] = np.clip(color, 0.0, 1.0)
+            fkey = None
+        key = (
+            fkey,
+            B,
+            pa_w,
+            pa_h,
+            style,
+            c,
+            out.dtype.str,
+            tuple(float(v) for v in outer_px),
+            None if inner_px is None else tuple(float(v) for v in inner_px),
+            ns if has_noise else 0.0,
+            int(noise_seed) if has_noise else None,
+        )
+        layer = _BORDER_CACHE.get(key)
+
+    if layer is None:
+        layer = _render_border_layer(
+            pa_w,
+            pa_h,
+            B=B,
+            channels=c,
+            out_dtype=out.dtype,
+            style=style,
+            outer_px=outer_px,
+            inner_px=inner_px,
+            fi=fi,
+            noise_strength=ns,
+            noise_seed=noise_seed,
+        )
+        if key is not None:
+            _BORDER_CACHE.put(key, layer)
+
+    out[y0 + layer.ys, x0 + layer.xs] = layer.colors
 
-    # ---------------------------------------------
-    # Restore dtype original
-    # ---------------------------------------------
     if original_dtype == np.uint8:
-        return np.clip(out * 255.0, 0, 255).astype(np.uint8)
+        return out
     return np.clip(out, 0.0, 1.0)
@@ -13,7 +13,8 @@ class GenerationRequest:
 
     - writer_mode='legacy_copy': requiere base_pnt_path (template físico).
     - writer_mode='raster20': base_pnt_path debe ser None; se escribe header20 + raster (width*height).
-    - writer_mode='preserve_source': requiere base_pnt_path header20; copia bytes base y parchea solo el raster (conserva suffix).
+    - writer_mode='preserve_source': requiere base_pnt_path header20 o ASA GUID-header; copia bytes base y parchea solo el raster (conserva suffix).
+      Si output_path es el propio base, se parchea in-place sólo el rango del raster.
     - writer_mode='auto': (compat) se trata como raster20.
     """
 
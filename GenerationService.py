@@ -2,8 +2,10 @@ from __future__ import annotations
 
 from pathlib import Path
 
+from CancelToken import check_cancel
 from GenerationRequest import GenerationRequest
 from RasterCanvasEncoder_v0 import RasterCanvasEncoder
+from ErrorDiffusion_v1 import ed_serpentine_for
 from PntValidator import validate_quick
 
 
@@ -38,12 +40,15 @@ class GenerationService:
 
 
     @staticmethod
-    def run(request: GenerationRequest, *, tabla_dyes_path: Path, header_size: int = 20):
+    def run(request: GenerationRequest, *, tabla_dyes_path: Path, header_size: int = 20, cancel=None):
         """Genera el .pnt.
 
         Nota: el header_size aquí controla el tamaño del prefijo cuando writer_mode='raster20'.
         En legacy_copy, el encoder copia la cabecera del template.
+
+        cancel: CancelToken opcional (ver RasterCanvasEncoder.encode).
         """
+        check_cancel(cancel)
 
         encoder = RasterCanvasEncoder(
             header_size=header_size,
@@ -56,6 +61,8 @@ class GenerationService:
         d_mode = GenerationService._map_dither_mode(dcfg.get("mode", "none"))
         d_strength = float(dcfg.get("strength", 1.0))
         d_strength = max(0.0, min(1.0, d_strength))
+        # Orden de escaneo por tamaño del canvas (mismo criterio que la preview).
+        d_serpentine = ed_serpentine_for(request.height, request.width, dcfg.get("scan"))
 
         writer_mode = GenerationService._resolve_writer_mode(request)
 
@@ -67,11 +74,13 @@ class GenerationService:
             height=request.height,
             dither_mode=d_mode,
             dither_strength=d_strength,
+            dither_serpentine=d_serpentine,
             encode_paint_area=request.encode_paint_area,
             encode_visibility_mask=request.encode_visibility_mask,
             planks=request.planks,
             encode_visible_rows=request.encode_visible_rows,
             writer_mode=writer_mode,
+            cancel=cancel,
         )
 
         r = validate_quick(request.output_path)
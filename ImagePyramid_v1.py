@@ -0,0 +1,140 @@
+"""ImagePyramid_v1
+
+Proyecto Canvas — mip pyramid of the input image.
+
+Every consumer of the loaded image (prepare, multi-canvas preview / generation) needs
+it at a much smaller size than a camera photo. Instead of resizing from the full
+original each time, the image is ingested once into a pyramid:
+
+- Level 0 is the retained base (RGBA). On ingest from a file, images larger than
+  PC_IMAGE_RETAIN_DIM (default 2048, 0 = keep full resolution) are reduced:
+  JPEGs through Image.draft (DCT scaling in the decoder, 1/2..1/8, never below the
+  retained size), other formats with Image.reduce(2) after decoding.
+- Level k+1 = level k .reduce(2) (box filter), built lazily.
+- level_for(w, h) returns the smallest level that is still >= (w, h); consumers then
+  do one small resize from there.
+- A consumer that needs more than the retained base (large multi-canvas generation)
+  gets a transient full decode from the source (path or the compressed bytes).
+
+Levels are shared: callers must not mutate the returned images.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from PIL import Image
+
+
+# Lado mayor mínimo que se conserva al ingerir (>= previews y rasters de 1 canvas).
+def _retain_dim_default() -> int:
+    try:
+        return max(0, int(os.environ.get("PC_IMAGE_RETAIN_DIM", "2048")))
+    except ValueError:
+        return 2048
+
+
+ImageSource = Union[str, Path, bytes, bytearray, memoryview]
+
+
+def _half(size: tuple[int, int]) -> tuple[int, int]:
+    # Image.reduce(2) redondea hacia arriba.
+    return (size[0] + 1) // 2, (size[1] + 1) // 2
+
+
+class ImagePyramid:
+    """Lazily built power-of-two pyramid over an RGBA base image."""
+
+    def __init__(
+        self,
+        base: Image.Image,
+        *,
+        source_size: Optional[tuple[int, int]] = None,
+        reopen: Optional[Callable[[], Image.Image]] = None,
+    ):
+        if base.mode != "RGBA":
+            base = base.convert("RGBA")
+        self._levels: list[Image.Image] = [base]
+        self.source_size = tuple(source_size) if source_size is not None else base.size
+        self._reopen = reopen
+        self._lock = threading.Lock()
+
+    @property
+    def base(self) -> Image.Image:
+        return self._levels[0]
+
+    @property
+    def is_full_resolution(self) -> bool:
+        return self.base.size == self.source_size
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(im.size[0] * im.size[1] * 4 for im in self._levels)
+
+    def level_for(self, width: int, height: int) -> Image.Image:
+        """Smallest level with size >= (width, height) (full decode if the base is too small)."""
+        w, h = max(1, int(width)), max(1, int(height))
+
+        base = self.base
+        if base.size[0] < w or base.size[1] < h:
+            if self._reopen is not None and not self.is_full_resolution:
+                return self._reopen()
+            return base
+
+        with self._lock:
+            i = 0
+            while True:
+                nxt = _half(self._levels[i].size)
+                if nxt[0] < w or nxt[1] < h or nxt == self._levels[i].size:
+                    return self._levels[i]
+                if i + 1 == len(self._levels):
+                    self._levels.append(self._levels[i].reduce(2))
+                i += 1
+
+    def resize(self, width: int, height: int, resample: int = Image.BILINEAR) -> Image.Image:
+        """Image at exactly (width, height), resized from the nearest level."""
+        size = (max(1, int(width)), max(1, int(height)))
+        img = self.level_for(*size)
+        if img.size != size:
+            img = img.resize(size, resample)
+        return img
+
+
+def _open_source(source: ImageSource) -> Image.Image:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(BytesIO(bytes(source)))
+    return Image.open(source)
+
+
+def open_image_pyramid(source: ImageSource, *, retain_dim: Optional[int] = None) -> ImagePyramid:
+    """Decode an image file / bytes into a pyramid, dropping resolution above retain_dim."""
+    if retain_dim is None:
+        retain_dim = _retain_dim_default()
+    if isinstance(source, (bytearray, memoryview)):
+        source = bytes(source)
+
+    with _open_source(source) as im:
+        source_size = im.size
+        if retain_dim > 0 and im.format == "JPEG" and max(source_size) > retain_dim:
+            s = retain_dim / float(max(source_size))
+            # El decoder elige la mayor reducción 1/2^k que sigue siendo >= lo pedido.
+            im.draft("RGB", (math.ceil(source_size[0] * s), math.ceil(source_size[1] * s)))
+        base = im.convert("RGBA")
+
+    if retain_dim > 0:
+        while max(_half(base.size)) >= retain_dim and _half(base.size) != base.size:
+            base = base.reduce(2)
+
+    reopen = None
+    if base.size != source_size:
+        def reopen() -> Image.Image:
+            with _open_source(source) as full:
+                return full.convert("RGBA")
+
+    return ImagePyramid(base, source_size=source_size, reopen=reopen)
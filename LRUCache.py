@@ -0,0 +1,113 @@
+# LRUCache.py
+# Proyecto Canvas — small thread-safe LRU cache (preview / render stages)
+#
+# Same pattern used inline across the project (OrderedDict + Lock), packaged so
+# caches can be handed to background workers inside snapshots.
+
+from __future__ import annotations
+
+from collections import OrderedDict
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+import numpy as np
+
+
+def approx_nbytes(value: Any) -> int:
+    """Best-effort size of a cached value (numpy arrays, PIL images, tuples/dicts of them)."""
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    nb = getattr(value, "nbytes", None)
+    if isinstance(nb, int):
+        return nb
+    size = getattr(value, "size", None)
+    mode = getattr(value, "mode", None)
+    if isinstance(size, tuple) and len(size) == 2 and isinstance(mode, str):
+        # PIL.Image
+        return int(size[0]) * int(size[1]) * max(1, len(mode))
+    if isinstance(value, (tuple, list)):
+        return sum(approx_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(approx_nbytes(v) for v in value.values())
+    return 0
+
+
+class LRUCache:
+    """Thread-safe LRU with optional byte budget and hit/miss counters."""
+
+    def __init__(
+        self,
+        max_items: int = 8,
+        *,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = approx_nbytes,
+    ):
+        self.max_items = max(1, int(max_items))
+        self.max_bytes = None if max_bytes is None else max(0, int(max_bytes))
+        self._sizeof = sizeof
+
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return hit[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        nb = int(self._sizeof(value)) if self.max_bytes is not None else 0
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            # Un valor que por sí solo supera el presupuesto no se guarda.
+            if self.max_bytes is not None and nb > self.max_bytes:
+                return
+
+            self._data[key] = (value, nb)
+            self._bytes += nb
+
+            while len(self._data) > self.max_items or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1
+            ):
+                _, (_, onb) = self._data.popitem(last=False)
+                self._bytes -= onb
+
+    def clear(self, *, reset_stats: bool = False) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            if reset_stats:
+                self.hits = 0
+                self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -10,8 +10,7 @@ import hashlib
 import numpy as np
 from PIL import Image
 
-from PntIO import looks_like_header20, parse_header20
-from ExternalPntLibrary_v1 import try_parse_asa_guid_header_pnt
+from PntIO import PntFile
 
 
 @dataclass(frozen=True)
@@ -53,17 +52,25 @@ def read_pnt_raster_any(
       - ASA GUID-header (MyPaintings/cache)
     Returns (raster2d uint8, meta dict with width/height/kind).
     """
-    data = pnt_path.read_bytes()
+    # Copias: los arrays no deben retener el mapa del fichero.
+    with PntFile(pnt_path) as f:
+        return _read_pnt_raster_mapped(f, width=width, height=height)
 
+
+def _read_pnt_raster_mapped(
+    f: PntFile,
+    *,
+    width: Optional[int],
+    height: Optional[int],
+) -> Tuple[np.ndarray, Dict[str, Any]]:
     # header20
-    if looks_like_header20(data):
-        h = parse_header20(data[:20])
-        off = 20
-        raster = np.frombuffer(data[off:off + h.paint_data_size], dtype=np.uint8).reshape((h.height, h.width))
+    h = f.header20
+    if h is not None:
+        raster = f.raster().copy()
         return raster, {"kind": "raster20", "width": h.width, "height": h.height}
 
     # ASA GUID
-    meta = try_parse_asa_guid_header_pnt(pnt_path)
+    meta = f.asa_header
     if meta:
         off = int(meta["raster_off"])
         raster_len = int(meta["raster_len"])
@@ -72,16 +79,16 @@ def read_pnt_raster_any(
 
         # Explicit override (from scan hint / UI) wins if consistent.
         if isinstance(width, int) and isinstance(height, int) and width > 0 and height > 0 and width * height == raster_len:
-            raster = np.frombuffer(data[off:off + raster_len], dtype=np.uint8).reshape((height, width))
+            raster = f.raster_at(off, height, width).copy()
             return raster, {"kind": "asa_guid_override", "width": width, "height": height, "blueprint": meta.get("blueprint", ""), "guid": meta.get("guid", "")}
         if w > 0 and h > 0 and w * h == raster_len:
-            raster = np.frombuffer(data[off:off + raster_len], dtype=np.uint8).reshape((h, w))
+            raster = f.raster_at(off, h, w).copy()
             return raster, {"kind": "asa_guid", "width": w, "height": h, "blueprint": meta.get("blueprint", ""), "guid": meta.get("guid", "")}
 
         # fallback: attempt square, then factorize (deterministic, bounded)
         sq = int(round(raster_len ** 0.5))
         if sq * sq == raster_len:
-            raster = np.frombuffer(data[off:off + raster_len], dtype=np.uint8).reshape((sq, sq))
+            raster = f.raster_at(off, sq, sq).copy()
             return raster, {"kind": "asa_guid_guess", "width": sq, "height": sq, "blueprint": meta.get("blueprint", ""), "guid": meta.get("guid", "")}
 
         # factorize bounded (prefer near-square if ambiguous). If a single dimension is provided,
@@ -110,7 +117,7 @@ def read_pnt_raster_any(
 
         pairs.sort(key=_pair_score)
         w, h = pairs[0]
-        raster = np.frombuffer(data[off:off + raster_len], dtype=np.uint8).reshape((h, w))
+        raster = f.raster_at(off, h, w).copy()
         return raster, {"kind": "asa_guid_factor", "width": w, "height": h, "blueprint": meta.get("blueprint", ""), "guid": meta.get("guid", "")}
 
     raise ValueError("Unknown .pnt format (not header20, not ASA GUID).")
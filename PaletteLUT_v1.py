@@ -0,0 +1,325 @@
+"""PaletteLUT_v1
+
+Proyecto Canvas — exact RGB24 -> palette index lookup table.
+
+The encoder and the preview always feed 8-bit RGB (image_rgb/255) to the nearest-dye
+match, and the active palette is tiny (<= 127 dyes). So instead of recomputing the
+N×K distance matrix on every call, we keep a lazily filled table of 2^24 entries:
+
+- lookup(keys): one gather; only colors never seen before go through the GEMM kernel
+  (ErrorDiffusion_v1.nearest_idx_batch_from_pack) and are written back.
+- The table is exact (same metric as the kernel), not a coarse grid.
+- Tables persist to get_user_cache_dir("palette_lut") so repeat palettes are a single
+  gather across sessions and processes. Live tables are written at exit or by
+  clear_palette_luts(), never from lookup(): the match path stays memory-only.
+
+Key
+---
+The table stores *indices into the pack*, so it is keyed by the pack content
+(palette_w + palette_bytes + sqrt_w). That is the TablaDyes content plus the
+enabled-dye set, without depending on file paths.
+
+Env
+---
+- PC_PALETTE_LUT=0          disable the table (always use the kernel)
+- PC_PALETTE_LUT_PERSIST=0  keep tables in memory only
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ErrorDiffusion_v1 import nearest_idx_batch_from_pack, rgb24_keys_to_linear
+
+
+_LUT_VERSION = b"pc-palette-lut-v1"
+_LUT_SIZE = 1 << 24
+_LUT_EMPTY = 255  # índice reservado: "aún no calculado"
+
+# Dedup de claves nuevas: a partir de aquí, array de marcas en vez de np.unique.
+_UNIQUE_MARK_MIN = 1 << 16
+# Ficheros en disco: cada tabla ocupa 16 MiB, conservamos sólo las más recientes.
+_DISK_MAX_FILES = 8
+
+
+def lut_enabled() -> bool:
+    return os.environ.get("PC_PALETTE_LUT", "1") != "0"
+
+
+def _persist_enabled() -> bool:
+    # Pyodide: el FS es memoria, persistir no aporta nada.
+    if sys.platform == "emscripten":
+        return False
+    return os.environ.get("PC_PALETTE_LUT_PERSIST", "1") != "0"
+
+
+def _lut_dir() -> Path:
+    from paths import get_user_cache_dir
+
+    return get_user_cache_dir("palette_lut")
+
+
+def palette_digest(
+    *,
+    palette_w: np.ndarray,
+    palette_bytes: np.ndarray,
+    sqrt_w: Optional[np.ndarray] = None,
+) -> str:
+    """Stable key for a palette pack (TablaDyes content + enabled dyes)."""
+    h = hashlib.blake2b(_LUT_VERSION, digest_size=16)
+    h.update(np.ascontiguousarray(palette_w, dtype=np.float32).tobytes())
+    h.update(np.ascontiguousarray(palette_bytes, dtype=np.uint8).tobytes())
+    if sqrt_w is not None:
+        h.update(np.ascontiguousarray(sqrt_w, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+class PaletteLUT:
+    """Lazy exact RGB24 -> palette index table (uint8, 16 MiB)."""
+
+    def __init__(
+        self,
+        digest: str,
+        *,
+        palette_w: np.ndarray,
+        palette_w_norm2: np.ndarray,
+        sqrt_w: Optional[np.ndarray],
+        persist: bool = True,
+    ):
+        k = int(np.asarray(palette_w).shape[0])
+        if k <= 0 or k >= _LUT_EMPTY:
+            raise ValueError(f"PaletteLUT: tamaño de paleta no soportado ({k})")
+
+        self.digest = str(digest)
+        self._palette_w = np.array(palette_w, dtype=np.float32, order="C")
+        self._palette_w_norm2 = np.array(palette_w_norm2, dtype=np.float32, order="C")
+        self._sqrt_w = None if sqrt_w is None else np.array(sqrt_w, dtype=np.float32)
+
+        self._lock = threading.Lock()
+        self._table = np.full((_LUT_SIZE,), _LUT_EMPTY, dtype=np.uint8)
+
+        self._persist = bool(persist)
+        self._path: Optional[Path] = None
+        self._disk_mtime_ns = 0
+        self._dirty = 0
+
+        # Stats (debug)
+        self.hits = 0
+        self.filled = 0
+
+        if self._persist:
+            self._path = _lut_dir() / f"lut_{self.digest}.u8"
+            self._load()
+
+    # --------------------------------------------------
+    # Disk
+    # --------------------------------------------------
+
+    def _read_disk(self) -> Optional[np.ndarray]:
+        p = self._path
+        if p is None:
+            return None
+        try:
+            st = p.stat()
+            if st.st_size != _LUT_SIZE:
+                return None
+            data = np.fromfile(str(p), dtype=np.uint8)
+        except OSError:
+            return None
+        if data.shape[0] != _LUT_SIZE:
+            return None
+        self._disk_mtime_ns = int(st.st_mtime_ns)
+        return data
+
+    def _load(self) -> None:
+        data = self._read_disk()
+        if data is None:
+            return
+        # Defensa: un fichero con índices fuera de paleta no se usa.
+        k = int(self._palette_w.shape[0])
+        valid = (data < k) | (data == _LUT_EMPTY)
+        if not bool(np.all(valid)):
+            return
+        self._table = data
+
+    def flush(self) -> None:
+        """Write the table to disk (atomic replace), merging entries other processes added.
+
+        Only called at exit / from clear_palette_luts(): never on the lookup path.
+        """
+        if not self._persist or self._path is None:
+            return
+
+        with self._lock:
+            if self._dirty <= 0:
+                return
+
+            p = self._path
+            try:
+                p.parent.mkdir(parents=True, exist_ok=True)
+
+                # Otro proceso pudo escribir la misma paleta: fusionar antes de reemplazar.
+                try:
+                    mtime = int(p.stat().st_mtime_ns)
+                except OSError:
+                    mtime = 0
+                if mtime and mtime != self._disk_mtime_ns:
+                    other = self._read_disk()
+                    if other is not None:
+                        k = int(self._palette_w.shape[0])
+                        take = (self._table == _LUT_EMPTY) & (other < k)
+                        self._table[take] = other[take]
+
+                tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+                self._table.tofile(str(tmp))
+                os.replace(str(tmp), str(p))
+                self._disk_mtime_ns = int(p.stat().st_mtime_ns)
+            except OSError:
+                # Caché best-effort: sin disco seguimos en memoria.
+                self._persist = False
+                return
+
+            self._dirty = 0
+
+        _prune_disk(keep=p)
+
+    # --------------------------------------------------
+    # Lookup
+    # --------------------------------------------------
+
+    def _fill(self, keys: np.ndarray) -> None:
+        with self._lock:
+            # Otro hilo pudo rellenarlas mientras esperábamos el lock.
+            keys = keys[self._table[keys] == _LUT_EMPTY]
+            if keys.size == 0:
+                return
+
+            idx = nearest_idx_batch_from_pack(
+                rgb24_keys_to_linear(keys),
+                palette_w=self._palette_w,
+                palette_w_norm2=self._palette_w_norm2,
+                sqrt_w=self._sqrt_w,
+            )
+            self._table[keys] = idx.astype(np.uint8)
+            self._dirty += int(keys.shape[0])
+            self.filled += int(keys.shape[0])
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Palette indices (intp) for uint32 RGB24 keys."""
+        keys = np.asarray(keys, dtype=np.uint32)
+        out = self._table[keys]
+
+        miss = out == _LUT_EMPTY
+        if bool(miss.any()):
+            self._fill(_unique_keys(keys[miss]))
+            out[miss] = self._table[keys[miss]]
+        else:
+            self.hits += int(keys.shape[0])
+
+        return out.astype(np.intp, copy=False)
+
+
+def _unique_keys(keys: np.ndarray) -> np.ndarray:
+    """Sorted unique RGB24 keys. Large inputs use a 2^24 mark array (O(N)),
+    far cheaper than np.unique for millions of fresh colors."""
+    if keys.shape[0] < _UNIQUE_MARK_MIN:
+        return np.unique(keys)
+    mark = np.zeros((_LUT_SIZE,), dtype=bool)
+    mark[keys] = True
+    return np.flatnonzero(mark).astype(np.uint32)
+
+
+# ==========================================================
+# Registry (in-process LRU)
+# ==========================================================
+
+_LUT_LOCK = threading.Lock()
+_LUT_CACHE: "OrderedDict[str, PaletteLUT]" = OrderedDict()
+_LUT_CACHE_MAX = 3
+
+
+def get_palette_lut(
+    *,
+    palette_w: np.ndarray,
+    palette_w_norm2: np.ndarray,
+    palette_bytes: np.ndarray,
+    sqrt_w: Optional[np.ndarray] = None,
+) -> Optional[PaletteLUT]:
+    """Shared PaletteLUT for a palette pack, or None if disabled/unsupported."""
+    if not lut_enabled():
+        return None
+
+    k = int(np.asarray(palette_bytes).shape[0])
+    if k <= 0 or k >= _LUT_EMPTY:
+        return None
+
+    digest = palette_digest(palette_w=palette_w, palette_bytes=palette_bytes, sqrt_w=sqrt_w)
+
+    with _LUT_LOCK:
+        lut = _LUT_CACHE.get(digest)
+        if lut is not None:
+            _LUT_CACHE.move_to_end(digest)
+            return lut
+
+    lut = PaletteLUT(
+        digest,
+        palette_w=palette_w,
+        palette_w_norm2=palette_w_norm2,
+        sqrt_w=sqrt_w,
+        persist=_persist_enabled(),
+    )
+
+    with _LUT_LOCK:
+        cur = _LUT_CACHE.get(digest)
+        if cur is not None:
+            _LUT_CACHE.move_to_end(digest)
+            return cur
+        _LUT_CACHE[digest] = lut
+        # Sin escritura a disco aquí (camino de preview / encode): las entradas nuevas
+        # de una tabla expulsada se pierden y se recalculan si la paleta vuelve.
+        while len(_LUT_CACHE) > _LUT_CACHE_MAX:
+            _LUT_CACHE.popitem(last=False)
+
+    return lut
+
+
+def clear_palette_luts() -> None:
+    with _LUT_LOCK:
+        luts = list(_LUT_CACHE.values())
+        _LUT_CACHE.clear()
+    for lut in luts:
+        lut.flush()
+
+
+def _prune_disk(*, keep: Optional[Path] = None) -> None:
+    try:
+        files = sorted(_lut_dir().glob("lut_*.u8"), key=lambda f: f.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for f in files[_DISK_MAX_FILES:]:
+        if keep is not None and f == keep:
+            continue
+        try:
+            f.unlink()
+        except OSError:
+            pass
+
+
+@atexit.register
+def _flush_all_at_exit() -> None:
+    with _LUT_LOCK:
+        luts = list(_LUT_CACHE.values())
+    for lut in luts:
+        try:
+            lut.flush()
+        except Exception:
+            pass
@@ -0,0 +1,100 @@
+"""PaletteRegistry_v1
+
+Proyecto Canvas — process-wide registry of dye translators.
+
+TablaDyes_v1.json used to be parsed by every PntColorTranslatorV1: once per
+generation request (RasterCanvasEncoder), i.e. 16 times for a 4x4 multi-canvas job,
+plus separate copies for the preview controller and the web runtime.
+
+get_translator(path, enabled_dyes) hands out shared, immutable translators:
+
+- the table is parsed once per (resolved path, mtime_ns, size); editing the file
+  invalidates it on the next call;
+- filtered translators (enabled-dye signature) are derived from the parsed table
+  without touching the disk;
+- translators memoize their palette packs / byte->RGB tables (read-only arrays) and
+  the RGB24 LUT is shared by palette digest (PaletteLUT_v1), so encoders and previews
+  borrowing the same translator reuse all of it.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+from PntColorTranslator_v0 import PntColorTranslatorV1
+
+
+# Traductores vivos (tabla × conjunto de dyes); los packs pesan pocos KB.
+_MAX_TRANSLATORS = 16
+
+_LOCK = threading.Lock()
+_TABLES: dict[tuple, PntColorTranslatorV1] = {}           # table key -> unfiltered translator
+_TRANSLATORS: "OrderedDict[tuple, PntColorTranslatorV1]" = OrderedDict()
+_STATS = {"parses": 0, "hits": 0, "misses": 0}
+
+
+def _table_key(tabla_path: Union[str, Path]) -> tuple:
+    p = Path(tabla_path).resolve()
+    st = os.stat(p)
+    return (str(p), int(st.st_mtime_ns), int(st.st_size))
+
+
+def _dyes_signature(enabled_dyes) -> Optional[frozenset]:
+    return None if enabled_dyes is None else frozenset(int(b) for b in enabled_dyes)
+
+
+def get_translator(
+    tabla_path: Union[str, Path],
+    *,
+    enabled_dyes: Optional[set[int]] = None,
+) -> PntColorTranslatorV1:
+    """Shared translator for (table file, enabled dyes). Do not mutate it."""
+    tkey = _table_key(tabla_path)
+    sig = _dyes_signature(enabled_dyes)
+    key = (tkey, sig)
+
+    with _LOCK:
+        hit = _TRANSLATORS.get(key)
+        if hit is not None:
+            _TRANSLATORS.move_to_end(key)
+            _STATS["hits"] += 1
+            return hit
+        _STATS["misses"] += 1
+        base = _TABLES.get(tkey)
+
+    if base is None:
+        base = PntColorTranslatorV1(tkey[0])
+        with _LOCK:
+            _STATS["parses"] += 1
+            # Tabla editada en disco: descartar las versiones anteriores del mismo fichero.
+            for old in [k for k in _TABLES if k[0] == tkey[0] and k != tkey]:
+                del _TABLES[old]
+            for old in [k for k in _TRANSLATORS if k[0][0] == tkey[0] and k[0] != tkey]:
+                del _TRANSLATORS[old]
+            base = _TABLES.setdefault(tkey, base)
+
+    # Errores de enabled_dyes (vacío / sin coincidencias) se propagan igual que antes.
+    translator = base if sig is None else base.with_enabled_dyes(sig)
+
+    with _LOCK:
+        translator = _TRANSLATORS.setdefault(key, translator)
+        _TRANSLATORS.move_to_end(key)
+        while len(_TRANSLATORS) > _MAX_TRANSLATORS:
+            _TRANSLATORS.popitem(last=False)
+    return translator
+
+
+def clear_palette_registry() -> None:
+    with _LOCK:
+        _TABLES.clear()
+        _TRANSLATORS.clear()
+
+
+def palette_registry_stats() -> dict:
+    """{"parses", "hits", "misses", "translators"} (debug / perf)."""
+    with _LOCK:
+        return dict(_STATS, translators=len(_TRANSLATORS))
@@ -2,11 +2,16 @@
 
 import json
 import math
+import threading
 from typing import Tuple, Optional, List, Dict
 
 import numpy as np
 
 
+# Máximo de conjuntos de dyes memoizados (palette_pack / byte_to_rgb_u8).
+_MEMO_MAX = 64
+
+
 class DyeEntry:
     def __init__(self, name: str, observed_byte: int, linear_rgb: Tuple[float, float, float]):
         self.name = name
@@ -53,6 +58,27 @@ class PntColorTranslatorV1:
         if not all_dyes:
             raise RuntimeError("No se han cargado dyes válidos desde TablaDyes_v1.json")
 
+        self._init_palette(all_dyes, enabled_dyes)
+
+    @classmethod
+    def from_dyes(
+        cls,
+        tabla_path: str,
+        all_dyes: List[DyeEntry],
+        *,
+        enabled_dyes: Optional[set[int]] = None,
+    ) -> "PntColorTranslatorV1":
+        """Translator over an already parsed dye list (no JSON read)."""
+        self = cls.__new__(cls)
+        self._tabla_path = str(tabla_path)
+        self._init_palette(all_dyes, enabled_dyes)
+        return self
+
+    def with_enabled_dyes(self, enabled_dyes: Optional[set[int]]) -> "PntColorTranslatorV1":
+        """Same table, different active dyes (shares the parsed DyeEntry list)."""
+        return PntColorTranslatorV1.from_dyes(self._tabla_path, self._all_dyes, enabled_dyes=enabled_dyes)
+
+    def _init_palette(self, all_dyes: List[DyeEntry], enabled_dyes: Optional[set[int]]) -> None:
         # Keep a canonical list to build filtered packs without reloading JSON.
         self._all_dyes = list(all_dyes)
 
@@ -60,12 +86,12 @@ class PntColorTranslatorV1:
         # Active dyes filter (used by nearest_bytes_batch)
         # --------------------------------------------
         if enabled_dyes is None:
-            self.dyes = all_dyes
+            self.dyes = self._all_dyes
         else:
             if not enabled_dyes:
                 raise RuntimeError("enabled_dyes está vacío: no hay dyes activos")
 
-            self.dyes = [d for d in all_dyes if d.observed_byte in enabled_dyes]
+            self.dyes = [d for d in self._all_dyes if d.observed_byte in enabled_dyes]
 
             if not self.dyes:
                 raise RuntimeError("enabled_dyes no coincide con ningún dye válido")
@@ -86,6 +112,48 @@ class PntColorTranslatorV1:
         self._palette_w = self._palette_linear * self._sqrt_w
         self._palette_w_norm2 = np.sum(self._palette_w * self._palette_w, axis=1)
 
+        # Instances are shared (PaletteRegistry_v1): the active arrays are read-only.
+        for arr in (self._palette_linear, self._palette_bytes, self._sqrt_w, self._palette_w, self._palette_w_norm2):
+            arr.flags.writeable = False
+
+        # Memo of palette_pack() / byte_to_rgb_u8() per enabled-dye signature.
+        # Arrays are read-only so they can be shared by preview threads and caches.
+        self._memo_lock = threading.Lock()
+        self._pack_memo: Dict[Optional[frozenset], Dict[str, np.ndarray]] = {}
+        self._b2rgb_memo: Dict[Optional[frozenset], np.ndarray] = {}
+
+    # --------------------------------------------------
+    # Memo helpers
+    # --------------------------------------------------
+
+    @staticmethod
+    def _dyes_signature(enabled_dyes: Optional[set[int]]) -> Optional[frozenset]:
+        return None if enabled_dyes is None else frozenset(int(b) for b in enabled_dyes)
+
+    def _select_dyes(self, enabled_dyes: Optional[set[int]]) -> List[DyeEntry]:
+        if enabled_dyes is None:
+            return self.dyes
+        if not enabled_dyes:
+            return []
+        return [d for d in self._all_dyes if d.observed_byte in enabled_dyes]
+
+    @staticmethod
+    def _freeze(arr: np.ndarray) -> np.ndarray:
+        arr.flags.writeable = False
+        return arr
+
+    def _memo_get(self, memo: dict, sig: Optional[frozenset], build):
+        with self._memo_lock:
+            hit = memo.get(sig)
+        if hit is not None:
+            return hit
+        value = build()
+        with self._memo_lock:
+            hit = memo.setdefault(sig, value)
+            while len(memo) > _MEMO_MAX:
+                memo.pop(next(iter(memo)))
+        return hit
+
     # --------------------------------------------------
     # NEW: palette pack for bytes-first render/encode
     # --------------------------------------------------
@@ -102,23 +170,27 @@ class PntColorTranslatorV1:
         - palette_w: float32 (K,3)
         - palette_w_norm2: float32 (K,)
         - sqrt_w: float32 (3,)
+
+        Packs are memoized per enabled-dye set; arrays are shared and read-only
+        (the dict itself is a fresh copy).
         """
 
-        if enabled_dyes is None:
-            dyes = self.dyes
-        else:
-            if not enabled_dyes:
-                dyes = []
-            else:
-                dyes = [d for d in self._all_dyes if d.observed_byte in enabled_dyes]
+        sig = self._dyes_signature(enabled_dyes)
+        pack = self._memo_get(
+            self._pack_memo,
+            sig,
+            lambda: {k: self._freeze(v) for k, v in self._build_palette_pack(self._select_dyes(sig)).items()},
+        )
+        return dict(pack)
 
+    def _build_palette_pack(self, dyes: List[DyeEntry]) -> Dict[str, np.ndarray]:
         if not dyes:
             return {
                 "palette_linear": np.zeros((0, 3), dtype=np.float32),
                 "palette_bytes": np.zeros((0,), dtype=np.uint8),
                 "palette_w": np.zeros((0, 3), dtype=np.float32),
                 "palette_w_norm2": np.zeros((0,), dtype=np.float32),
-                "sqrt_w": self._sqrt_w.astype(np.float32, copy=False),
+                "sqrt_w": self._sqrt_w.astype(np.float32, copy=True),
             }
 
         palette_linear = np.array([d.linear_rgb for d in dyes], dtype=np.float32)
@@ -132,7 +204,7 @@ class PntColorTranslatorV1:
             "palette_bytes": palette_bytes,
             "palette_w": palette_w,
             "palette_w_norm2": palette_w_norm2,
-            "sqrt_w": self._sqrt_w.astype(np.float32, copy=False),
+            "sqrt_w": self._sqrt_w.astype(np.float32, copy=True),
         }
 
     def byte_to_rgb_u8(self, *, enabled_dyes: Optional[set[int]] = None) -> np.ndarray:
@@ -142,16 +214,17 @@ class PntColorTranslatorV1:
         - IMPORTANT: In TablaDyes_v1.json the field is named `linear_rgb` but, in this
           project build, values are already stored as *sRGB normalized* (0..1).
           Therefore we map them directly to uint8 without gamma conversion.
+        - Memoized per enabled-dye set: the returned array is shared and read-only.
         """
 
-        if enabled_dyes is None:
-            dyes = self.dyes
-        else:
-            if not enabled_dyes:
-                dyes = []
-            else:
-                dyes = [d for d in self._all_dyes if d.observed_byte in enabled_dyes]
+        sig = self._dyes_signature(enabled_dyes)
+        return self._memo_get(
+            self._b2rgb_memo,
+            sig,
+            lambda: self._freeze(self._build_byte_to_rgb_u8(self._select_dyes(sig))),
+        )
 
+    def _build_byte_to_rgb_u8(self, dyes: List[DyeEntry]) -> np.ndarray:
         out = np.zeros((256, 3), dtype=np.uint8)
         for d in dyes:
             b = int(d.observed_byte) & 0xFF
@@ -223,7 +296,8 @@ class PntColorTranslatorV1:
         self,
         rgb_linear: np.ndarray,
         *,
-        chunk_size: int = 65536,
+        chunk_size: int = 4096,
+        stats: Optional[dict] = None,
     ) -> np.ndarray:
         """Return nearest dye observed_byte for each pixel.
 
@@ -232,41 +306,27 @@ class PntColorTranslatorV1:
 
             d^2 = ||x||^2 + ||p||^2 - 2 x·p
 
-        where x and p are RGB scaled by sqrt(weights).
+        where x and p are RGB scaled by sqrt(weights). 8-bit inputs (image/255)
+        are answered from the persistent RGB24 table in PaletteLUT_v1.
 
         Parameters
         ----------
         rgb_linear: (N,3) float array in [0,1]
-        chunk_size: pixels per chunk (controls memory)
+        chunk_size: pixels per block in the NumPy kernel (bounds scratch memory)
+        stats: optional dict, accumulates pixels/matched counts (PC_PERF)
         """
-        if rgb_linear.ndim != 2 or rgb_linear.shape[1] != 3:
-            raise ValueError("rgb_linear debe ser (N,3)")
-
-        rgb = np.asarray(rgb_linear, dtype=np.float32, order="C")
-        n = int(rgb.shape[0])
-        if n == 0:
-            return np.empty((0,), dtype=np.uint8)
-
-        pal_w = self._palette_w  # (K,3)
-        pal_norm2 = self._palette_w_norm2  # (K,)
-        pal_bytes = self._palette_bytes
-
-        out = np.empty((n,), dtype=np.uint8)
-        sw = self._sqrt_w
-
-        cs = int(chunk_size)
-        for i0 in range(0, n, cs):
-            i1 = min(i0 + cs, n)
-            c = rgb[i0:i1]
-
-            cw = c * sw
-            cw_norm2 = np.sum(cw * cw, axis=1)
-
-            dist = cw_norm2[:, None] + pal_norm2[None, :] - 2.0 * (cw @ pal_w.T)
-            idx = np.argmin(dist, axis=1)
-            out[i0:i1] = pal_bytes[idx]
-
-        return out
+        from ErrorDiffusion_v1 import nearest_bytes_batch_from_pack
+
+        # Same kernel as the bytes-first pipeline (uses the RGB24 LUT for u8/255 inputs).
+        return nearest_bytes_batch_from_pack(
+            rgb_linear,
+            palette_w=self._palette_w,
+            palette_w_norm2=self._palette_w_norm2,
+            palette_bytes=self._palette_bytes,
+            sqrt_w=self._sqrt_w,
+            chunk_size=chunk_size,
+            stats=stats,
+        )
 
     # --------------------------------------------------
 
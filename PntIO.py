@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+import os
+import re
+import shutil
 import struct
-from dataclasses import dataclass
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, Optional, Tuple, Union
 
 import numpy as np
 
+try:
+    import mmap
+except ImportError:  # pragma: no cover - runtimes sin mmap
+    mmap = None
+
 from RasterLayoutExtractor_v0 import RasterLayoutExtractor, RasterLayoutInfoV2
 
 
@@ -44,9 +54,231 @@ def looks_like_header20(pnt_bytes: bytes) -> bool:
     return True
 
 
+# ==========================================================
+# ASA (UE5 / Ascended) GUID-header
+# ==========================================================
+
+_ASA_GUID_RE = re.compile(rb"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def parse_asa_guid_header(buf) -> Optional[Dict[str, Any]]:
+    """Parsea la cabecera ASA GUID-header de un buffer (bytes o mmap).
+
+    ASA .pnt files (cache/MyPaintings 'EXT...') often start with:
+      GUID_ASCII + \\0
+      u32 version
+      u32 name_len + name (utf-8)
+      u32 blueprint_len + blueprint (utf-8)   # can be 0 in numeric cache
+      u32 a1, a2, a3, raster_len
+      raster bytes (raster_len)
+      tail (unknown)
+
+    Sólo lee la cabecera; None si el buffer no encaja.
+    """
+    size = len(buf)
+
+    nul = buf.find(b"\x00", 0, 81)
+    if nul <= 0:
+        return None
+    guid_raw = bytes(buf[:nul])
+    if not _ASA_GUID_RE.match(guid_raw):
+        return None
+    guid = guid_raw.decode("ascii")
+
+    off = nul + 1
+    if off + 4 * 3 > size:
+        return None
+
+    version, name_len = struct.unpack_from("<II", buf, off)
+    off += 8
+    if off + name_len > size:
+        return None
+    name = bytes(buf[off:off + name_len]).decode("utf-8", errors="replace").rstrip("\x00").strip()
+    off += name_len
+
+    (bp_len,) = struct.unpack_from("<I", buf, off)
+    off += 4
+    if off + bp_len > size:
+        return None
+    blueprint = bytes(buf[off:off + bp_len]).decode("utf-8", errors="replace").rstrip("\x00").strip()
+    off += bp_len
+
+    if off + 16 > size:
+        return None
+    a1, a2, a3, raster_len = struct.unpack_from("<IIII", buf, off)
+    off += 16
+
+    if raster_len <= 0 or off + raster_len > size:
+        # some files might be truncated; treat as unknown
+        return None
+
+    return {
+        "guid": guid,
+        "version": int(version),
+        "internal_name": name,
+        "blueprint": blueprint,
+        "a1": int(a1),
+        "a2": int(a2),
+        "a3": int(a3),
+        "raster_len": int(raster_len),
+        "raster_off": int(off),
+        "file_size": size,
+    }
+
+
+# ==========================================================
+# PntFile: vista perezosa de un .pnt sobre mmap
+# ==========================================================
+
+_UNPARSED = object()
+
+class PntFile:
+    """Read-only, lazily parsed view of a .pnt file.
+
+    The file is memory-mapped (plain read as fallback, e.g. empty files or runtimes
+    without mmap), so header parsing only touches the first pages and the raster is
+    a zero-copy NumPy view. Use it as a context manager; arrays / memoryviews taken
+    from it must not outlive close() (copy them if they need to).
+
+    Layouts, detected in this order:
+      - header20 ('raster20'): 20-byte header + w*h raster + optional suffix
+      - ASA GUID-header ('asa_guid')
+      - anything else: 'unknown' (legacy layouts go through RasterLayoutExtractor)
+    """
+
+    def __init__(self, pnt_path: Union[str, Path], *, data: Optional[bytes] = None):
+        self.path = Path(pnt_path)
+        self._mmap = None
+        if data is None:
+            data = self._map(self.path)
+        self._buf = data
+        self.file_size = len(data)
+        self._header20 = _UNPARSED
+        self._asa = _UNPARSED
+
+    @staticmethod
+    def _map(path: Path):
+        with path.open("rb") as f:
+            if mmap is not None:
+                try:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # Fichero vacío / FS sin soporte de mmap.
+                    pass
+            return f.read()
+
+    # ------------------------------------------------------
+
+    def close(self) -> None:
+        buf, self._buf = self._buf, b""
+        if mmap is not None and isinstance(buf, mmap.mmap):
+            try:
+                buf.close()
+            except BufferError:
+                # Aún hay vistas exportadas: el mapa se libera con la última.
+                pass
+
+    def __enter__(self) -> "PntFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ------------------------------------------------------
+    # Cabeceras (perezosas)
+    # ------------------------------------------------------
+
+    def head(self, n: int) -> bytes:
+        return bytes(self._buf[:max(0, int(n))])
+
+    @property
+    def info(self) -> dict:
+        """peek_pnt_info() dict for this file."""
+        return _pnt_info(self.head(20), self.file_size)
+
+    @property
+    def header20(self) -> Optional[Header20]:
+        """Header20 if the file is a canonical raster20 (with or without suffix)."""
+        if self._header20 is _UNPARSED:
+            self._header20 = self.info.get("header")
+        return self._header20
+
+    @property
+    def asa_header(self) -> Optional[Dict[str, Any]]:
+        """parse_asa_guid_header() result (None if not an ASA GUID-header file)."""
+        if self._asa is _UNPARSED:
+            self._asa = parse_asa_guid_header(self._buf)
+        return self._asa
+
+    @property
+    def kind(self) -> str:
+        if self.header20 is not None:
+            return "raster20"
+        if self.asa_header is not None:
+            return "asa_guid"
+        return "unknown"
+
+    @property
+    def raster_offset(self) -> Optional[int]:
+        if self.header20 is not None:
+            return 20
+        if self.asa_header is not None:
+            return int(self.asa_header["raster_off"])
+        return None
+
+    @property
+    def raster_len(self) -> Optional[int]:
+        if self.header20 is not None:
+            return int(self.header20.paint_data_size)
+        if self.asa_header is not None:
+            return int(self.asa_header["raster_len"])
+        return None
+
+    # ------------------------------------------------------
+    # Vistas (sin copia)
+    # ------------------------------------------------------
+
+    def view(self, offset: int = 0, length: Optional[int] = None) -> memoryview:
+        """memoryview over [offset, offset+length) (to the end if length is None)."""
+        mv = memoryview(self._buf)
+        end = self.file_size if length is None else offset + int(length)
+        return mv[int(offset):end]
+
+    def raster_at(self, offset: int, row_count: int, row_length: int) -> np.ndarray:
+        """uint8 view of shape (row_count, row_length) starting at offset."""
+        n = int(row_count) * int(row_length)
+        if int(offset) + n > self.file_size:
+            raise ValueError("raster fuera del archivo")
+        return np.frombuffer(self._buf, dtype=np.uint8, count=n, offset=int(offset)).reshape(
+            (int(row_count), int(row_length))
+        )
+
+    def raster(self, width: Optional[int] = None, height: Optional[int] = None) -> np.ndarray:
+        """Raster view (height, width). Defaults to the header20 / ASA (a1, a2) dimensions."""
+        off, n = self.raster_offset, self.raster_len
+        if off is None:
+            raise ValueError("Formato .pnt desconocido (ni header20 ni ASA GUID)")
+        if width is None or height is None:
+            if self.header20 is not None:
+                width, height = self.header20.width, self.header20.height
+            else:
+                width, height = int(self.asa_header.get("a1", 0)), int(self.asa_header.get("a2", 0))
+        if int(width) * int(height) != n:
+            raise ValueError(f"{width}x{height} no encaja con raster_len={n}")
+        return self.raster_at(off, int(height), int(width))
+
+    @property
+    def suffix(self) -> memoryview:
+        """Bytes after the raster (MyPaintings / LocalSaved metadata, ASA tail)."""
+        off, n = self.raster_offset, self.raster_len
+        if off is None:
+            return memoryview(b"")
+        return self.view(off + n)
+
+
 def read_header20(pnt_path: Path) -> Header20:
-    data = pnt_path.read_bytes()
-    return parse_header20(data[:20])
+    with PntFile(pnt_path) as f:
+        return parse_header20(f.head(20))
 
 
 def read_raster20(pnt_path: Path) -> np.ndarray:
@@ -54,12 +286,11 @@ def read_raster20(pnt_path: Path) -> np.ndarray:
 
     Devuelve un array uint8 de forma (height, width).
     """
-    data = pnt_path.read_bytes()
-    if not looks_like_header20(data):
-        raise ValueError("El archivo no parece ser un raster20 (header20 contiguo)")
-    h = parse_header20(data[:20])
-    raster = np.frombuffer(data[20:20 + h.paint_data_size], dtype=np.uint8).reshape((h.height, h.width))
-    return raster
+    with PntFile(pnt_path) as f:
+        if f.header20 is None:
+            raise ValueError("El archivo no parece ser un raster20 (header20 contiguo)")
+        # Copia: el array no debe retener el mapa del fichero.
+        return f.raster().copy()
 
 
 def peek_pnt_info(pnt_path: Path) -> dict:
@@ -74,15 +305,15 @@ def peek_pnt_info(pnt_path: Path) -> dict:
       - has_suffix, suffix_len
       - file_size
     """
-    p = Path(pnt_path)
-    st = p.stat()
-    size = int(st.st_size)
+    with PntFile(pnt_path) as f:
+        return f.info
+
+
+def _pnt_info(head: bytes, size: int) -> dict:
+    """peek_pnt_info() a partir de los 20 primeros bytes y el tamaño del fichero."""
     if size < 20:
         return {"is_header20": False, "file_size": size}
 
-    with p.open("rb") as f:
-        head = f.read(20)
-
     try:
         h = parse_header20(head)
     except Exception:
@@ -121,9 +352,9 @@ def read_legacy_raster(pnt_path: Path, *, header_size: int = 20) -> Tuple[np.nda
       - layout info
     """
     ext = RasterLayoutExtractor(header_size=header_size)
-    layout = ext.extract(pnt_path)
-    data = pnt_path.read_bytes()
-    raster = np.frombuffer(data[layout.header_size:], dtype=np.uint8).reshape((layout.row_count, layout.row_length))
+    with PntFile(pnt_path) as f:
+        layout = ext.extract_bytes(f.view())
+        raster = f.raster_at(layout.header_size, layout.row_count, layout.row_length).copy()
     return raster, layout
 
 
@@ -137,21 +368,21 @@ def read_best_effort(pnt_path: Path, *, header_size: int = 20) -> Tuple[np.ndarr
     Retorna:
       (raster2d, meta)
     """
-    data = pnt_path.read_bytes()
-    if looks_like_header20(data):
-        h = parse_header20(data[:20])
-        raster = np.frombuffer(data[20:20 + h.paint_data_size], dtype=np.uint8).reshape((h.height, h.width))
-        expected = 20 + int(h.paint_data_size)
-        return raster, {
-            "kind": "raster20",
-            "header_size": 20,
-            "row_length": h.width,
-            "row_count": h.height,
-            "width": h.width,
-            "height": h.height,
-            "has_suffix": len(data) > expected,
-            "suffix_len": max(0, len(data) - expected),
-        }
+    with PntFile(pnt_path) as f:
+        h = f.header20
+        if h is not None:
+            raster = f.raster().copy()
+            expected = 20 + int(h.paint_data_size)
+            return raster, {
+                "kind": "raster20",
+                "header_size": 20,
+                "row_length": h.width,
+                "row_count": h.height,
+                "width": h.width,
+                "height": h.height,
+                "has_suffix": f.file_size > expected,
+                "suffix_len": max(0, f.file_size - expected),
+            }
 
     raster, layout = read_legacy_raster(pnt_path, header_size=header_size)
     return raster, {
@@ -160,3 +391,163 @@ def read_best_effort(pnt_path: Path, *, header_size: int = 20) -> Tuple[np.ndarr
         "row_length": layout.row_length,
         "row_count": layout.row_count,
     }
+
+
+# ==========================================================
+# Base asset cache (templates / external .pnt used as writer base)
+# ==========================================================
+
+@dataclass(frozen=True)
+class PntBaseAsset:
+    """Immutable content of a base .pnt + its header20 peek + detected layouts.
+
+    Shared between encodes: never mutate data (copy it into a bytearray to write).
+    """
+
+    path: str
+    file_size: int
+    mtime_ns: int
+    data: bytes
+    info: dict
+    _layouts: dict = field(default_factory=dict, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def layout(self, extractor: RasterLayoutExtractor) -> RasterLayoutInfoV2:
+        """RasterLayoutExtractor result for this file (computed once per extractor config)."""
+        key = (extractor.header_size, extractor.min_row_length, extractor.max_row_length)
+        with self._lock:
+            hit = self._layouts.get(key)
+        if hit is not None:
+            return hit
+        layout = extractor.extract_bytes(self.data)
+        with self._lock:
+            return self._layouts.setdefault(key, layout)
+
+
+_BASE_ASSET_CACHE: "OrderedDict[str, PntBaseAsset]" = OrderedDict()
+_BASE_ASSET_CACHE_MAX = 16
+_BASE_ASSET_LOCK = threading.Lock()
+
+
+def get_pnt_base_asset(pnt_path: Path) -> PntBaseAsset:
+    """Cached PntBaseAsset, validated by path + size + mtime (re-read if the file changed)."""
+    p = Path(pnt_path)
+    key = os.path.abspath(p)
+    st = p.stat()
+    size, mtime_ns = int(st.st_size), int(st.st_mtime_ns)
+
+    with _BASE_ASSET_LOCK:
+        hit = _BASE_ASSET_CACHE.get(key)
+        if hit is not None and hit.file_size == size and hit.mtime_ns == mtime_ns:
+            _BASE_ASSET_CACHE.move_to_end(key)
+            return hit
+
+    data = p.read_bytes()
+    asset = PntBaseAsset(
+        path=key,
+        file_size=len(data),
+        mtime_ns=mtime_ns,
+        data=data,
+        info=_pnt_info(data[:20], len(data)),
+    )
+
+    # Escritura concurrente del fichero entre stat() y read(): no cachear.
+    if len(data) != size:
+        return asset
+
+    with _BASE_ASSET_LOCK:
+        _BASE_ASSET_CACHE[key] = asset
+        _BASE_ASSET_CACHE.move_to_end(key)
+        while len(_BASE_ASSET_CACHE) > _BASE_ASSET_CACHE_MAX:
+            _BASE_ASSET_CACHE.popitem(last=False)
+    return asset
+
+
+def clear_pnt_base_assets() -> None:
+    with _BASE_ASSET_LOCK:
+        _BASE_ASSET_CACHE.clear()
+
+
+def _forget_pnt_base_asset(pnt_path: Path) -> None:
+    with _BASE_ASSET_LOCK:
+        _BASE_ASSET_CACHE.pop(os.path.abspath(pnt_path), None)
+
+
+# ==========================================================
+# Parcheo in-place del raster (re-export sobre un .pnt existente)
+# ==========================================================
+
+def _patch_atomic_default() -> bool:
+    return os.environ.get("PC_PNT_PATCH_ATOMIC", "0") == "1"
+
+
+def _write_region(f, offset: int, data: memoryview) -> None:
+    """Write data at offset of an open r+b file through mmap (seek/write as fallback)."""
+    mm = None
+    if mmap is not None:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+        except (OSError, ValueError):
+            mm = None
+    if mm is None:
+        f.seek(offset)
+        f.write(data)
+        return
+    try:
+        mm[offset:offset + len(data)] = data
+        mm.flush()
+    finally:
+        mm.close()
+
+
+def patch_pnt_raster(
+    pnt_path: Path,
+    raster_offset: int,
+    raster,
+    *,
+    head: Optional[bytes] = None,
+    atomic: Optional[bool] = None,
+) -> None:
+    """Overwrite only the raster byte range of an existing .pnt (header and suffix untouched).
+
+    - raster: bytes-like / C-contiguous uint8 array written at raster_offset.
+    - head: expected file content before raster_offset; if the file changed since it
+      was read, nothing is written (RuntimeError).
+    - atomic: patch a temporary copy and os.replace it over the target, so a crash
+      never leaves a half-written raster (costs a full file copy).
+      Default: PC_PNT_PATCH_ATOMIC=1.
+    """
+    p = Path(pnt_path)
+    off = int(raster_offset)
+    data = memoryview(raster).cast("B")
+    if atomic is None:
+        atomic = _patch_atomic_default()
+
+    target = p
+    tmp = None
+    if atomic:
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        shutil.copyfile(p, tmp)
+        target = tmp
+
+    try:
+        with target.open("r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            if off < 0 or off + len(data) > size:
+                raise RuntimeError(
+                    f"raster fuera del archivo destino (offset={off}, len={len(data)}, size={size})"
+                )
+            if head is not None and f.read(off) != bytes(head):
+                raise RuntimeError("El .pnt destino cambió desde que se leyó (cabecera distinta)")
+            _write_region(f, off, data)
+
+        if tmp is not None:
+            os.replace(str(tmp), str(p))
+            tmp = None
+    finally:
+        if tmp is not None:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+        _forget_pnt_base_asset(p)
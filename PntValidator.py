@@ -3,7 +3,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
 
-from PntIO import parse_header20
+from PntIO import PntFile, parse_header20
 
 
 @dataclass(frozen=True)
@@ -14,20 +14,22 @@ class ValidationResult:
 
 
 def validate_raster20(pnt_path: Path) -> ValidationResult:
-    data = pnt_path.read_bytes()
-    if len(data) < 20:
+    with PntFile(pnt_path) as f:
+        size = f.file_size
+        head = f.head(20)
+    if size < 20:
         return ValidationResult(False, "raster20", "archivo < 20 bytes")
 
-    h = parse_header20(data[:20])
+    h = parse_header20(head)
     expected = 20 + h.width * h.height
     if h.paint_data_size != h.width * h.height:
         return ValidationResult(False, "raster20", "paint_data_size != w*h")
-    if len(data) < expected:
-        return ValidationResult(False, "raster20", f"archivo truncado (len={len(data)}, mínimo={expected})")
+    if size < expected:
+        return ValidationResult(False, "raster20", f"archivo truncado (len={size}, mínimo={expected})")
 
-    if len(data) != expected:
+    if size != expected:
         # Header20 con suffix/metadata (MyPaintings / LocalSaved)
-        suffix_len = len(data) - expected
+        suffix_len = size - expected
         return ValidationResult(True, "raster20_suffix", f"ok (suffix_len={suffix_len})")
 
     return ValidationResult(True, "raster20", "ok")
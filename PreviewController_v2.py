@@ -15,11 +15,16 @@ from collections import OrderedDict
 import numpy as np
 from PIL import Image
 
-from FrameBorder import apply_frame_border
+from FrameBorder import apply_frame_border, frame_image_digest
 from GenerationRequest import GenerationRequest
+from DyeMatchState_v1 import DyeMatchState
 from GenerationService import GenerationService
-from PntColorTranslator_v0 import PntColorTranslatorV1
+from LRUCache import LRUCache
+from PaletteRegistry_v1 import get_translator
+from PaletteLUT_v1 import palette_digest
 from PntIO import peek_pnt_info
+from ImagePyramid_v1 import ImagePyramid, open_image_pyramid
+from PreviewRender_v1 import PreviewStageCache
 from TemplateDescriptorLoader import TemplateDescriptorLoader
 from paths import get_app_root
 
@@ -70,7 +75,7 @@ class AppState:
     # Options
     enabled_dyes: Optional[set[int]] = None
     dithering_config: dict = field(default_factory=lambda: {"mode": "none", "strength": 0.5})
-    border_config: dict = field(default_factory=lambda: {"style": "none", "size": 0, "frame_image": None, "frame_image_np": None})
+    border_config: dict = field(default_factory=lambda: {"style": "none", "size": 0, "frame_image": None, "frame_image_np": None, "frame_key": None, "noise_seed": 0})
     border_frame_image_key: Optional[str] = None
     game_object_type: Optional[str] = None
     show_game_object: bool = False
@@ -94,6 +99,7 @@ class PreviewController:
     - NO hidden side-effects (e.g., generation must not mutate current template selection).
     - Thread-safe snapshot-based preview rendering for background worker.
     - Multi-canvas preview cache (LRU) keyed by (image_rev + parameters).
+    - Single-canvas preview cache (byte-bounded LRU) keyed by (image_rev + geometry + parameters).
     """
 
     def __init__(self, *, templates_root: Path):
@@ -115,22 +121,46 @@ class PreviewController:
             self.preview_max_dim = 512
         self.preview_max_dim = max(64, min(self.preview_max_dim, 2048))
 
+        # Progressive preview: a quick first pass (reduced resolution, nearest-only)
+        # is shown while the full-quality pass renders. PC_PREVIEW_QUICK_DIM=0 disables it.
+        try:
+            self.preview_quick_max_dim = int(os.getenv("PC_PREVIEW_QUICK_DIM", "192"))
+        except Exception:
+            self.preview_quick_max_dim = 192
+        self.preview_quick_max_dim = max(0, min(self.preview_quick_max_dim, 1024))
+
         # Generation-time extras (kept for future; do not auto-derive here)
         self._planks_override: Optional[list[dict]] = None
 
         # Prepared image cache for generation (depends on image+canvas+border)
         self._prepared_image_rgba: Optional[np.ndarray] = None
 
+        # Source image reuse across prepares: mip pyramid of the original (per image,
+        # see ImagePyramid_v1) + resized copies keyed by (image_rev, size, resample).
+        # Template / border / writer changes with the same visible size skip the resize.
+        self._source_lock = threading.Lock()
+        self._image_pyramid: Optional[ImagePyramid] = None
+        self._image_pyramid_src: Optional[Image.Image] = None
+        self._resize_cache = LRUCache(4, max_bytes=256 * 1024 * 1024)
+
         # Translator (ARK dyes)
         tabla_path = get_app_root() / "TablaDyes_v1.json"
-        self._ark_translator = PntColorTranslatorV1(str(tabla_path)) if tabla_path.exists() else None
+        self._ark_translator = get_translator(tabla_path) if tabla_path.exists() else None
+
+        # Palette objects (quantize_fn + pack + byte->rgb) per enabled-dye signature.
+        # Treated as immutable and shared by every snapshot with the same dyes.
+        self._palette_objects = LRUCache(8)
 
         # --------------------------------------------------
         # Best dyes ranking cache (per image revision)
         # --------------------------------------------------
         self._best_dyes_lock = threading.Lock()
-        self._best_dyes_rank_rev: Optional[int] = None
+        self._best_dyes_rank_key: Optional[tuple] = None
         self._best_dyes_rank: Optional[list[int]] = None
+        self._best_dyes_hist_key: Optional[tuple] = None
+        self._best_dyes_hist: Optional[tuple[np.ndarray, np.ndarray]] = None
+        self._best_dyes_curve_key: Optional[tuple] = None
+        self._best_dyes_curve = None
 
         # --------------------------------------------------
         # Multi-canvas preview cache (LRU) + image revision
@@ -142,6 +172,33 @@ class PreviewController:
         self._mc_cache_hits = 0
         self._mc_cache_misses = 0
 
+        # Single-canvas preview results (final pass), byte-bounded.
+        # Flipping back to recent settings is a hit. PC_PREVIEW_CACHE_MB overrides the budget.
+        try:
+            single_mb = int(os.getenv("PC_PREVIEW_CACHE_MB", "64"))
+        except Exception:
+            single_mb = 64
+        self._single_preview_cache = LRUCache(16, max_bytes=max(0, single_mb) * 1024 * 1024)
+
+        # --------------------------------------------------
+        # Ordered dithering analysis cache (nearest/2nd-nearest per pixel)
+        # - keyed by image/prepared revision + geometry + enabled dyes, NOT strength
+        # - strength slider changes only redo the Bayer threshold compare
+        # --------------------------------------------------
+        self._prepared_rev = 0
+        self._ordered_analysis_cache = LRUCache(4)
+
+        # Per-image top-2 dye match, updated incrementally by set_enabled_dyes()
+        self._dye_match_state = DyeMatchState()
+
+        # Per-stage preview caches (resize / border / quantize / overlay):
+        # toggling the overlay or the strength only re-runs the later stages.
+        self._preview_stage_cache = PreviewStageCache()
+
+        # Optional process-pool backend for snapshot renders (PC_PREVIEW_BACKEND=process).
+        self._preview_backend = None
+        self._preview_backend_lock = threading.Lock()
+
         # Last generation target (optional, used by GUI)
         self._last_generated_path: Optional[Path] = None
         self._border_np_convert_count = 0
@@ -180,7 +237,23 @@ class PreviewController:
     # Setters (state mutation is explicit and minimal)
     # ==================================================
 
-    def set_image(self, image: Optional[Image.Image], image_name: Optional[str] = None) -> None:
+    def set_image_file(self, source, image_name: Optional[str] = None) -> None:
+        """
+        Load the input image from a path or encoded bytes.
+
+        Large images are decoded reduced (JPEG draft / power-of-two reduce) into a
+        pyramid; state.image_original is the retained base level.
+        """
+        pyramid = open_image_pyramid(source)
+        self.set_image(pyramid.base, image_name=image_name, pyramid=pyramid)
+
+    def set_image(
+        self,
+        image: Optional[Image.Image],
+        image_name: Optional[str] = None,
+        *,
+        pyramid: Optional[ImagePyramid] = None,
+    ) -> None:
         self.state.image_original = image
         if image_name is not None:
             self.state.image_name = str(image_name).strip() or None
@@ -188,10 +261,22 @@ class PreviewController:
 
         self._image_rev += 1
         self._invalidate_multicanvas_cache()
+        self._ordered_analysis_cache.clear()
+        self._dye_match_state.clear()
+        self._preview_stage_cache.clear()
+        self._single_preview_cache.clear()
+        with self._source_lock:
+            self._image_pyramid = pyramid
+            self._image_pyramid_src = image if pyramid is not None else None
+        self._resize_cache.clear()
 
         with self._best_dyes_lock:
-            self._best_dyes_rank_rev = None
+            self._best_dyes_rank_key = None
             self._best_dyes_rank = None
+            self._best_dyes_hist_key = None
+            self._best_dyes_hist = None
+            self._best_dyes_curve_key = None
+            self._best_dyes_curve = None
 
         self._refresh()
 
@@ -520,8 +605,9 @@ class PreviewController:
         self._refresh()
 
     def set_enabled_dyes(self, enabled: Optional[set[int]]) -> None:
+        # La imagen preparada no depende de los dyes: se conserva para que el
+        # preview sólo re-evalúe los colores afectados (DyeMatchState).
         self.state.enabled_dyes = enabled
-        self._prepared_image_rgba = None
 
         if self.state.preview_mode == "ark_simulation":
             self.state.palette = self._build_palette_object()
@@ -543,9 +629,12 @@ class PreviewController:
         self.state.border_config["frame_image"] = image
         if image is None:
             self.state.border_config["frame_image_np"] = None
+            self.state.border_config["frame_key"] = None
         else:
             self._debug_note_border_np_conversion()
-            self.state.border_config["frame_image_np"] = np.array(image.convert("RGBA"), dtype=np.uint8)
+            frame_np = np.array(image.convert("RGBA"), dtype=np.uint8)
+            self.state.border_config["frame_image_np"] = frame_np
+            self.state.border_config["frame_key"] = frame_image_digest(frame_np)
         self._prepared_image_rgba = None
         self._refresh()
 
@@ -586,10 +675,13 @@ class PreviewController:
         self.state.canvas_resolved = {"width": int(width), "height": int(height), "paint_area": "full_raster", "meta": {}}
         self._evaluate_preview_ready()
 
-    def render_preview_if_possible(self) -> Optional[Image.Image]:
+    def render_preview_if_possible(self, *, quick: bool = False) -> Optional[Image.Image]:
         """
         Render a preview for physical (single) canvas.
         For multi-canvas, use render_preview_multicanvas_cached().
+
+        quick=True: first pass of a progressive preview (see quick_preview_snapshot).
+        Same output size, rendered at reduced resolution without dithering.
         """
         if not self.state.preview_ready:
             return None
@@ -646,19 +738,238 @@ class PreviewController:
             img_np = self._prepared_image_rgba.copy()
 
         prepared_img = Image.fromarray(img_np, mode="RGBA")
+        full_w, full_h = int(prepared_img.size[0]), int(prepared_img.size[1])
+        palette = self.state.palette if self.state.preview_mode == "ark_simulation" else None
+
+        if quick:
+            quick_size = self._quick_preview_size(full_w, full_h)
+            if quick_size is not None and self._quick_preview_worthwhile(self.state.dithering_config):
+                img = render_preview(
+                    prepared_img,
+                    template_id=None,
+                    target_width=quick_size[0],
+                    target_height=quick_size[1],
+                    border=None,
+                    dithering={"mode": "none"},
+                    palette=palette,
+                    preview_mode=self.state.preview_mode,
+                    game_object_type=self.state.game_object_type,
+                    overlay_def=overlay_def,
+                    stage_cache=self._preview_stage_cache,
+                    source_key=self._preview_source_key(),
+                )
+                return img.resize((full_w, full_h), Image.NEAREST)
+
+        cache_key = self._single_cache_key(
+            target_w=full_w,
+            target_h=full_h,
+            preview_mode=self.state.preview_mode,
+            dithering=self.state.dithering_config,
+            palette=palette,
+            overlay_sig=None if overlay_def is None else (
+                "encode_mask", str(overlay_def.get("image")), "mask_alpha" in overlay_def
+            ),
+        )
+        hit = self._single_preview_cache.get(cache_key)
+        if hit is not None:
+            return hit
 
         # Border is already applied inside _prepare_base_image_rgba() only within paint_area.
-        return render_preview(
+        img = render_preview(
             prepared_img,
             template_id=None,
-            target_width=int(prepared_img.size[0]),
-            target_height=int(prepared_img.size[1]),
+            target_width=full_w,
+            target_height=full_h,
             border=None,
             dithering=self.state.dithering_config,
-            palette=self.state.palette if self.state.preview_mode == "ark_simulation" else None,
+            palette=palette,
             preview_mode=self.state.preview_mode,
             game_object_type=self.state.game_object_type,
             overlay_def=overlay_def,
+            analysis_cache=self._ordered_analysis_cache,
+            analysis_key=self._ordered_analysis_key(full_w, full_h),
+            match_state=self._dye_match_state,
+            match_key=self._match_key(full_w, full_h),
+            stage_cache=self._preview_stage_cache,
+            source_key=self._preview_source_key(),
+        )
+        self._single_preview_cache.put(cache_key, img)
+        return img
+
+    # ==================================================
+    # Progressive preview (quick pass -> final pass)
+    # ==================================================
+
+    def _quick_preview_size(self, width: int, height: int) -> Optional[tuple[int, int]]:
+        """Reduced render size for the quick pass, or None if the full size is already small."""
+        qdim = int(getattr(self, "preview_quick_max_dim", 0) or 0)
+        m = max(int(width), int(height))
+        if qdim <= 0 or m <= qdim:
+            return None
+        s = qdim / float(m)
+        return max(1, int(round(width * s))), max(1, int(round(height * s)))
+
+    @staticmethod
+    def _quick_preview_worthwhile(dithering: Optional[dict]) -> bool:
+        # Sin dither el pase final ya es nearest (LUT/top-2 incremental): no compensa.
+        return str((dithering or {}).get("mode", "none")) != "none"
+
+    def quick_preview_snapshot(self, snapshot: dict) -> Optional[dict]:
+        """
+        Quick first-pass variant of a preview snapshot, or None when the full pass is cheap.
+
+        The quick pass renders at preview_quick_max_dim with dithering off (nearest-only)
+        and is upscaled (NEAREST) to the final size so the GUI can show it in place.
+        It does not touch the incremental match state nor the multi-canvas result cache.
+        """
+        kind = snapshot.get("kind")
+        if kind not in ("single", "multi_canvas"):
+            return None
+        if not self._quick_preview_worthwhile(snapshot.get("dithering")):
+            return None
+
+        quick = dict(snapshot)
+        quick["dithering"] = {"mode": "none"}
+        quick["analysis_cache"] = None
+        quick["analysis_key"] = None
+        quick["match_state"] = None
+        quick["match_key"] = None
+
+        if kind == "single":
+            full_w, full_h = int(snapshot["target_w"]), int(snapshot["target_h"])
+            size = self._quick_preview_size(full_w, full_h)
+            if size is None:
+                return None
+            quick["target_w"], quick["target_h"] = size
+        else:
+            if snapshot.get("preview_mode") != "ark_simulation":
+                return None
+            rows, cols = int(snapshot["rows"]), int(snapshot["cols"])
+            tile_w = int(snapshot.get("tile_draw_w", snapshot["tile_w"]))
+            tile_h = int(snapshot.get("tile_draw_h", snapshot["tile_h"]))
+            full_w = int(snapshot.get("preview_w", tile_w * cols))
+            full_h = int(snapshot.get("preview_h", tile_h * rows))
+            size = self._quick_preview_size(full_w, full_h)
+            if size is None:
+                return None
+            s = size[0] / float(full_w)
+            quick["preview_w"], quick["preview_h"] = size
+            quick["tile_draw_w"] = max(1, int(round(tile_w * s)))
+            quick["tile_draw_h"] = max(1, int(round(tile_h * s)))
+
+        quick["cache_key"] = None
+        quick["display_size"] = (full_w, full_h)
+        quick["pass"] = "quick"
+        return quick
+
+    def _match_key(self, width: int, height: int, *, multi: bool = False) -> tuple:
+        """Identifies the preview pixels (not the palette)."""
+        return (
+            "mc" if multi else "single",
+            self._image_rev,
+            None if multi else self._prepared_rev,
+            int(width),
+            int(height),
+        )
+
+    def _ordered_analysis_key(self, width: int, height: int, *, multi: bool = False) -> tuple:
+        return self._match_key(width, height, multi=multi) + (self._enabled_dyes_signature(),)
+
+    def _preview_source_key(self, *, multi: bool = False) -> tuple:
+        """Identifies the image handed to render_preview (original or prepared canvas)."""
+        if multi:
+            return ("original", self._image_rev)
+        return ("prepared", self._image_rev, self._prepared_rev)
+
+    def preview_stage_stats(self) -> dict:
+        """Per-stage hit/miss counters of the preview pipeline (debug / perf)."""
+        return self._preview_stage_cache.stats()
+
+    def preview_cache_stats(self) -> dict:
+        """Hit/miss counters of the preview result caches (single-canvas and multi-canvas)."""
+        with self._mc_cache_lock:
+            multi = {
+                "items": len(self._mc_preview_cache),
+                "hits": self._mc_cache_hits,
+                "misses": self._mc_cache_misses,
+            }
+        return {"single": self._single_preview_cache.stats(), "multi": multi}
+
+    def _snapshot_render_fn(self):
+        """render_preview for background snapshots: process pool if enabled, else in-thread."""
+        from PreviewProcessBackend_v1 import ProcessPreviewBackend, process_backend_requested
+        from PreviewRender_v1 import render_preview
+
+        if not process_backend_requested():
+            return render_preview
+
+        with self._preview_backend_lock:
+            if self._preview_backend is None:
+                try:
+                    self._preview_backend = ProcessPreviewBackend()
+                except Exception as e:
+                    print(f"[WARN] Preview process backend unavailable: {e}")
+                    self._preview_backend = False
+            backend = self._preview_backend
+
+        if not backend or not backend.available:
+            return render_preview
+        return backend.render_preview
+
+    def shutdown_preview_backend(self) -> None:
+        with self._preview_backend_lock:
+            backend, self._preview_backend = self._preview_backend, None
+        if backend:
+            backend.shutdown()
+
+    # ==================================================
+    # Single-canvas preview cache
+    # ==================================================
+
+    def _prepared_geometry_signature(self) -> tuple:
+        """What the prepared canvas depends on besides the image (template, canvas, border, writer)."""
+        canvas = self.state.canvas_resolved or {}
+        border = self.state.border_config or {}
+        descriptor = self.state.preview_descriptor or self.state.template
+        ext = self.state.external_pnt_path
+        return (
+            self.state.selected_template_id,
+            None if ext is None else str(ext),
+            int(canvas.get("width", 0) or 0),
+            int(canvas.get("height", 0) or 0),
+            repr(canvas.get("paint_area")),
+            str(self.state.paint_area_profile),
+            self.get_effective_writer_mode(descriptor),
+            str(border.get("style", "none")),
+            int(border.get("size", 0)),
+            border.get("frame_key"),
+            border.get("noise_seed", 0),
+        )
+
+    def _single_cache_key(
+        self,
+        *,
+        target_w: int,
+        target_h: int,
+        preview_mode: str,
+        dithering: dict,
+        palette: Optional[dict],
+        overlay_sig,
+    ) -> tuple:
+        d_mode = (dithering or {}).get("mode", "none")
+        d_strength = round(float((dithering or {}).get("strength", 0.5)), 4)
+        pal_sig = self._enabled_dyes_signature() if (preview_mode == "ark_simulation" and palette is not None) else None
+        return (
+            "single",
+            self._image_rev,
+            self._prepared_geometry_signature(),
+            int(target_w),
+            int(target_h),
+            str(preview_mode),
+            str(d_mode),
+            d_strength,
+            pal_sig,
+            overlay_sig,
         )
 
     # ==================================================
@@ -751,7 +1062,7 @@ class PreviewController:
                 return hit
 
         img = self._render_multicanvas_core(
-            img_src=img_src,
+            img_src=self._source_pyramid(),
             descriptor=descriptor,
             rows=rows,
             cols=cols,
@@ -779,7 +1090,7 @@ class PreviewController:
     def _render_multicanvas_core(
         self,
         *,
-        img_src: Image.Image,
+        img_src: Image.Image | ImagePyramid,
         descriptor: dict,
         rows: int,
         cols: int,
@@ -789,6 +1100,7 @@ class PreviewController:
     ) -> Optional[Image.Image]:
         """
         Core multi-canvas preview renderer (stateless).
+        img_src may be an ImagePyramid: the nearest level >= preview size is used.
         """
         from PreviewRender_v1 import render_preview
 
@@ -808,6 +1120,9 @@ class PreviewController:
         preview_w = tile_w * int(cols)
         preview_h = tile_h * int(rows)
 
+        if isinstance(img_src, ImagePyramid):
+            img_src = img_src.level_for(preview_w, preview_h)
+
         if preview_mode == "ark_simulation":
             img = render_preview(
                 img_src,
@@ -915,10 +1230,13 @@ class PreviewController:
                 image_rev=self._image_rev,
             )
 
+            # Nearest pyramid level >= preview size (not the full-resolution original).
+            level = self._source_pyramid().level_for(preview_w, preview_h)
+
             return {
                 "kind": "multi_canvas",
                 "image_rev": self._image_rev,
-                "img": img,
+                "img": level,
                 "descriptor": copy.deepcopy(descriptor),
                 "rows": rows,
                 "cols": cols,
@@ -932,6 +1250,12 @@ class PreviewController:
                 "dithering": dithering,
                 "palette": palette,
                 "cache_key": cache_key,
+                "analysis_cache": self._ordered_analysis_cache,
+                "analysis_key": self._ordered_analysis_key(preview_w, preview_h, multi=True),
+                "match_state": self._dye_match_state,
+                "match_key": self._match_key(preview_w, preview_h, multi=True),
+                "stage_cache": self._preview_stage_cache,
+                "source_key": self._preview_source_key(multi=True) + (level.size,),
             }
 
         # Single canvas (requires physical raster)
@@ -973,6 +1297,17 @@ class PreviewController:
                 "mask": (self.template_assets_root / overlay_dir / f"{base_name}_mask.png"),
             }
 
+        cache_key = self._single_cache_key(
+            target_w=target_w,
+            target_h=target_h,
+            preview_mode=preview_mode,
+            dithering=dithering,
+            palette=palette,
+            overlay_sig=None if overlay_def is None else (
+                "file", str(overlay_def["image"]), str(overlay_def["mask"])
+            ),
+        )
+
         return {
             "kind": "single",
             "image_rev": self._image_rev,
@@ -987,18 +1322,40 @@ class PreviewController:
             "preview_mode": preview_mode,
             "game_object_type": game_object_type,
             "overlay_def": overlay_def,
+            "cache_key": cache_key,
+            "analysis_cache": self._ordered_analysis_cache,
+            "analysis_key": self._ordered_analysis_key(target_w, target_h),
+            "match_state": self._dye_match_state,
+            "match_key": self._match_key(target_w, target_h),
+            "stage_cache": self._preview_stage_cache,
+            "source_key": self._preview_source_key(),
         }
 
     def render_preview_from_snapshot(self, snapshot: dict) -> Optional[Image.Image]:
+        img = self._render_preview_from_snapshot(snapshot)
+
+        # Quick pass: se muestra en el sitio del resultado final.
+        display_size = snapshot.get("display_size")
+        if img is not None and display_size is not None and img.size != tuple(display_size):
+            img = img.resize(tuple(display_size), Image.NEAREST)
+        return img
+
+    def _render_preview_from_snapshot(self, snapshot: dict) -> Optional[Image.Image]:
         kind = snapshot.get("kind")
         if kind == "none":
             return None
         if kind == "multi_canvas":
             return self._render_multicanvas_from_snapshot(snapshot)
 
-        from PreviewRender_v1 import render_preview
+        key = snapshot.get("cache_key")
+        if key is not None:
+            hit = self._single_preview_cache.get(key)
+            if hit is not None:
+                return hit
 
-        return render_preview(
+        render_preview = self._snapshot_render_fn()
+
+        img = render_preview(
             snapshot["img"],
             template_id=None,
             target_width=int(snapshot["target_w"]),
@@ -1009,7 +1366,17 @@ class PreviewController:
             preview_mode=snapshot["preview_mode"],
             game_object_type=snapshot.get("game_object_type"),
             overlay_def=snapshot.get("overlay_def"),
+            analysis_cache=snapshot.get("analysis_cache"),
+            analysis_key=snapshot.get("analysis_key"),
+            match_state=snapshot.get("match_state"),
+            match_key=snapshot.get("match_key"),
+            stage_cache=snapshot.get("stage_cache"),
+            source_key=snapshot.get("source_key"),
+            cancel=snapshot.get("cancel"),
         )
+        if key is not None:
+            self._single_preview_cache.put(key, img)
+        return img
 
     def _render_multicanvas_from_snapshot(self, snap: dict) -> Optional[Image.Image]:
         key = snap.get("cache_key")
@@ -1022,7 +1389,7 @@ class PreviewController:
                     self._mc_preview_cache.move_to_end(key)
                     return hit
 
-        from PreviewRender_v1 import render_preview
+        render_preview = self._snapshot_render_fn()
 
         rows = int(snap["rows"])
         cols = int(snap["cols"])
@@ -1043,6 +1410,13 @@ class PreviewController:
                 palette=snap.get("palette"),
                 preview_mode="ark_simulation",
                 overlay_def=None,
+                analysis_cache=snap.get("analysis_cache"),
+                analysis_key=snap.get("analysis_key"),
+                match_state=snap.get("match_state"),
+                match_key=snap.get("match_key"),
+                stage_cache=snap.get("stage_cache"),
+                source_key=snap.get("source_key"),
+                cancel=snap.get("cancel"),
             )
         else:
             img = snap["img"].convert("RGBA")
@@ -1131,22 +1505,34 @@ class PreviewController:
 
         Includes:
         - quantize_fn (compat)
-        - pack (numpy arrays)
-        - byte_to_rgb_u8 (256x3)
+        - pack (numpy arrays, read-only) + its palette digest (LUT key)
+        - byte_to_rgb_u8 (256x3, read-only)
+
+        Memoized per enabled-dye signature: the returned dict is shared, do not mutate.
         """
         translator = self._ark_translator
         if translator is None:
             return None
 
+        sig = self._enabled_dyes_signature()
+        hit = self._palette_objects.get(sig)
+        if hit is not None:
+            return hit
+
         qfn = self._build_palette_quantize_fn()
         if qfn is None:
             return None
 
-        enabled = self.state.enabled_dyes
+        enabled = None if self.state.enabled_dyes is None else frozenset(self.state.enabled_dyes)
         pack = translator.palette_pack(enabled_dyes=enabled)
+        pack["digest"] = palette_digest(
+            palette_w=pack["palette_w"],
+            palette_bytes=pack["palette_bytes"],
+            sqrt_w=pack.get("sqrt_w"),
+        )
         b2rgb = translator.byte_to_rgb_u8(enabled_dyes=enabled)
 
-        return {
+        palette = {
             'mode': 'palette',
             'quantize_fn': qfn,
             'translator': translator,
@@ -1155,9 +1541,11 @@ class PreviewController:
             'enabled_dyes': enabled,
             'alpha_threshold': 10,
         }
+        self._palette_objects.put(sig, palette)
+        return palette
 
     # ==================================================
-    # Best dyes (fast, size-independent)
+    # Best dyes (exact color histogram)
     # ==================================================
 
     @staticmethod
@@ -1168,81 +1556,172 @@ class PreviewController:
         """
         return np.where(arr <= 0.04045, arr / 12.92, ((arr + 0.055) / 1.055) ** 2.4)
 
+    def _best_dyes_source_key(self) -> Optional[tuple]:
+        """
+        Pixels the encoder will actually see: the prepared canvas for single canvases
+        once the preview is ready, otherwise the retained original (pyramid base,
+        longest side capped at PC_IMAGE_RETAIN_DIM, default 2048; 0 = full resolution).
+        """
+        if self.state.image_original is None:
+            return None
+
+        if self.state.canvas_resolved is not None and self.state.preview_ready:
+            descriptor = self.state.preview_descriptor
+            if not (descriptor and descriptor.get("identity", {}).get("type") == "multi_canvas"):
+                if self._prepared_image_rgba is None:
+                    eff_writer = self.get_effective_writer_mode(descriptor or self.state.template)
+                    self._prepared_image_rgba = self._prepare_base_image_rgba(eff_writer=eff_writer)
+                return ("prepared", self._image_rev, self._prepared_rev)
+
+        return ("original", self._image_rev)
+
+    def _best_dyes_histogram(self) -> tuple[Optional[tuple], Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Exact color histogram of the source pixels (alpha >= 10, same as the encoder).
+        Without a prepared canvas the source is the retained pyramid base, so very large
+        images are counted at PC_IMAGE_RETAIN_DIM, not at full resolution.
+        Returns (key, rgb24 keys uint32 (U,), counts int64 (U,)).
+        """
+        from ErrorDiffusion_v1 import rgb24_histogram
+
+        key = self._best_dyes_source_key()
+        if key is None:
+            return None, None, None
+
+        with self._best_dyes_lock:
+            if self._best_dyes_hist_key == key and self._best_dyes_hist is not None:
+                return (key,) + self._best_dyes_hist
+
+        if key[0] == "prepared":
+            rgba = self._prepared_image_rgba
+        else:
+            rgba = np.asarray(self._original_rgba_image(), dtype=np.uint8)
+        keys, counts = rgb24_histogram(rgba, alpha_threshold=10)
+
+        with self._best_dyes_lock:
+            self._best_dyes_hist_key = key
+            self._best_dyes_hist = (keys, counts)
+
+        return key, keys, counts
+
     def _compute_best_dyes_ranking_cached(
         self,
         *,
-        sample_side: int = 256,
-        max_pixels: int = 65536,
+        sample_side: int = 256,      # kept for compatibility (exact histogram now)
+        max_pixels: int = 65536,     # kept for compatibility (exact histogram now)
     ) -> list[int]:
+        """
+        Dye bytes ranked by how many pixels pick them as nearest.
+        Exact: every pixel counted (via its color bin), same weighted metric as the encoder.
+        """
         translator = self._ark_translator
-        img0 = self.state.image_original
-        if translator is None or img0 is None:
+        if translator is None or self.state.image_original is None:
+            return []
+
+        key, keys, counts = self._best_dyes_histogram()
+        if keys is None:
             return []
 
         with self._best_dyes_lock:
-            if self._best_dyes_rank_rev == self._image_rev and self._best_dyes_rank is not None:
+            if self._best_dyes_rank_key == key and self._best_dyes_rank is not None:
                 return list(self._best_dyes_rank)
 
-        img = img0.convert("RGB")
-        w, h = img.size
-        if max(w, h) > sample_side:
-            scale = sample_side / float(max(w, h))
-            nw = max(1, int(w * scale))
-            nh = max(1, int(h * scale))
-            img = img.resize((nw, nh), Image.BILINEAR)
+        from ErrorDiffusion_v1 import nearest_idx_batch_from_pack, rgb24_keys_to_linear
+        from PaletteLUT_v1 import get_palette_lut
 
-        # IMPORTANT:
-        # TablaDyes_v1.json 'linear_rgb' values in this build are historically
-        # treated in the same space as image_rgb/255 (see ErrorDiffusion_v1 notes).
-        # The earlier patch converted the image to true linear here, which skewed
-        # the "best dyes" ranking and could lead to obviously wrong palettes.
-        rgb = np.asarray(img, dtype=np.float32) / 255.0
-        pixels = rgb.reshape(-1, 3)
-
-        n = pixels.shape[0]
-        if n > max_pixels:
-            stride = max(1, n // max_pixels)
-            pixels = pixels[::stride]
-
-        palette = np.array([d.linear_rgb for d in translator.dyes], dtype=np.float32)  # Kx3
-        bytes_arr = np.array([d.observed_byte for d in translator.dyes], dtype=np.int32)
-
-        K = palette.shape[0]
-        counts = np.zeros(K, dtype=np.int64)
-
-        chunk = 8192
-        for i in range(0, pixels.shape[0], chunk):
-            p = pixels[i : i + chunk]
-            d2 = np.sum((p[:, None, :] - palette[None, :, :]) ** 2, axis=2)  # chunk x K
-            idx = np.argmin(d2, axis=1)
-            counts += np.bincount(idx, minlength=K)
-
-        order = np.argsort(-counts)
+        pack = translator.palette_pack(enabled_dyes=None)
+        bytes_arr = pack["palette_bytes"].astype(np.int32)
+        K = bytes_arr.shape[0]
+        if K == 0:
+            return []
+
+        votes = np.zeros(K, dtype=np.int64)
+        if keys.shape[0]:
+            # Histogram bins are exact RGB24 colors: the persistent LUT answers them.
+            lut = get_palette_lut(
+                palette_w=pack["palette_w"],
+                palette_w_norm2=pack["palette_w_norm2"],
+                palette_bytes=pack["palette_bytes"],
+                sqrt_w=pack.get("sqrt_w"),
+            )
+            if lut is not None:
+                idx = lut.lookup(keys)
+            else:
+                # IMPORTANT:
+                # TablaDyes_v1.json 'linear_rgb' values in this build are historically
+                # treated in the same space as image_rgb/255 (see ErrorDiffusion_v1 notes).
+                # Do NOT convert to true linear here (skews the ranking).
+                idx = nearest_idx_batch_from_pack(
+                    rgb24_keys_to_linear(keys),
+                    palette_w=pack["palette_w"],
+                    palette_w_norm2=pack["palette_w_norm2"],
+                    sqrt_w=pack.get("sqrt_w"),
+                )
+            votes = np.bincount(idx, weights=counts, minlength=K).astype(np.int64)
+
+        order = np.argsort(-votes, kind="stable")
         ranking = bytes_arr[order].tolist()
 
         with self._best_dyes_lock:
-            self._best_dyes_rank_rev = self._image_rev
+            self._best_dyes_rank_key = key
             self._best_dyes_rank = ranking
 
         return ranking
 
+    def best_dyes_curve(self):
+        """
+        Greedy error-minimizing dye order + error-vs-N curve (DyeSelection_v1.DyeCurve),
+        from the same exact histogram as the ranking. Cached per image/prepared revision.
+        """
+        translator = self._ark_translator
+        if translator is None or self.state.image_original is None:
+            return None
+
+        key, keys, counts = self._best_dyes_histogram()
+        if keys is None:
+            return None
+
+        with self._best_dyes_lock:
+            if self._best_dyes_curve_key == key and self._best_dyes_curve is not None:
+                return self._best_dyes_curve
+
+        from DyeSelection_v1 import greedy_dye_curve, reduce_histogram
+
+        rgb, weights = reduce_histogram(keys, counts)
+        curve = greedy_dye_curve(rgb, weights, translator.palette_pack(enabled_dyes=None))
+
+        with self._best_dyes_lock:
+            self._best_dyes_curve_key = key
+            self._best_dyes_curve = curve
+
+        return curve
+
     def calculate_best_dyes(
         self,
-        X: int,
+        X: Optional[int],
         *,
         sample_side: int = 256,
         max_pixels: int = 65536,
+        method: str = "greedy",
     ) -> list[int]:
         """
-        Returns the selected dye bytes (top-X) and updates enabled_dyes accordingly.
-        Designed to be fast and independent of the original image size.
+        Returns the selected dye bytes and updates enabled_dyes accordingly.
+
+        - method="greedy": dyes added by largest error reduction (best_dyes_curve()).
+          X <= 0 / None -> automatic N (knee of the error curve).
+        - method="votes": top-X by nearest-neighbor votes (exact histogram ranking).
         """
-        ranking = self._compute_best_dyes_ranking_cached(sample_side=sample_side, max_pixels=max_pixels)
-        if not ranking:
-            return []
+        if method == "votes":
+            ranking = self._compute_best_dyes_ranking_cached(sample_side=sample_side, max_pixels=max_pixels)
+            if not ranking:
+                return []
+            selected = ranking[: max(1, int(X or 0))]
+        else:
+            curve = self.best_dyes_curve()
+            if curve is None or not curve.dyes:
+                return []
+            selected = curve.select(X)
 
-        X = max(1, int(X))
-        selected = ranking[:X]
         self.set_enabled_dyes(set(selected))
         return selected
 
@@ -1498,7 +1977,9 @@ class PreviewController:
         if self.state.image_original is None:
             raise RuntimeError("No hay imagen cargada para multi-canvas")
 
-        full_img = np.array(self.state.image_original.convert("RGBA"), dtype=np.uint8)
+        full_img = np.array(
+            self._source_pyramid().level_for(canvas_w * cols, canvas_h * rows), dtype=np.uint8
+        )
 
         expected_w = canvas_w * cols
         expected_h = canvas_h * rows
@@ -1571,25 +2052,28 @@ class PreviewController:
 
         return requests
 
-    def request_generation(self, *, output_path: Path, tabla_dyes_path: Path) -> None:
+    def request_generation(self, *, output_path: Path, tabla_dyes_path: Path, cancel=None) -> None:
         """
         Entry point used by GUI.
         Routes to single-canvas or multi-canvas generation.
+
+        cancel: optional CancelToken (raises RenderCancelled, nothing is written).
         """
         descriptor = self.state.preview_descriptor
         tpl_type = descriptor.get("identity", {}).get("type") if descriptor else None
 
         if tpl_type == "multi_canvas":
-            self.requests_generation(output_path=output_path, tabla_dyes_path=tabla_dyes_path)
+            self.requests_generation(output_path=output_path, tabla_dyes_path=tabla_dyes_path, cancel=cancel)
             return
 
         req = self.build_generation_request(output_path=output_path)
-        GenerationService.run(req, tabla_dyes_path=tabla_dyes_path)
+        GenerationService.run(req, tabla_dyes_path=tabla_dyes_path, cancel=cancel)
         self._last_generated_path = output_path
 
-    def requests_generation(self, *, output_path: Path, tabla_dyes_path: Path) -> None:
+    def requests_generation(self, *, output_path: Path, tabla_dyes_path: Path, cancel=None) -> None:
         """
         Multi-canvas generation entry: builds N requests and executes them.
+        Cancelling stops before the next tile (tiles already written are kept).
         """
         descriptor = self.state.preview_descriptor
         identity = descriptor.get("identity", {}) if descriptor else {}
@@ -1599,7 +2083,7 @@ class PreviewController:
 
         requests = self.build_generation_requests_multi(output_path=output_path)
         for req in requests:
-            GenerationService.run(req, tabla_dyes_path=tabla_dyes_path)
+            GenerationService.run(req, tabla_dyes_path=tabla_dyes_path, cancel=cancel)
 
         # For multi-canvas, output is a directory
         out_dir = output_path.with_suffix("") if output_path.suffix.lower() == ".pnt" else output_path
@@ -1609,6 +2093,41 @@ class PreviewController:
     # Image preparation (generation)
     # ==================================================
 
+    def _source_pyramid(self) -> ImagePyramid:
+        """Pyramid of the current image, built on first use (do not mutate its levels)."""
+        img = self.state.image_original
+        if img is None:
+            raise RuntimeError("No hay imagen cargada")
+        with self._source_lock:
+            # state.image_original may be replaced directly (web runtime): rebuild then.
+            if self._image_pyramid is None or self._image_pyramid_src is not img:
+                self._image_pyramid = ImagePyramid(img)
+                self._image_pyramid_src = img
+            return self._image_pyramid
+
+    def image_source_size(self) -> Optional[tuple[int, int]]:
+        """Size of the loaded image as decoded from its source (before any ingest reduction)."""
+        if self.state.image_original is None:
+            return None
+        return tuple(self._source_pyramid().source_size)
+
+    def _original_rgba_image(self) -> Image.Image:
+        """RGBA version of the retained original image (do not mutate)."""
+        return self._source_pyramid().base
+
+    def _resized_original_np(self, width: int, height: int, resample: int = Image.BILINEAR) -> np.ndarray:
+        """Original resized to (width, height) as read-only uint8 RGBA, cached per image revision."""
+        key = (self._image_rev, int(width), int(height), int(resample))
+        hit = self._resize_cache.get(key)
+        if hit is not None:
+            return hit
+
+        img = self._source_pyramid().resize(width, height, resample)
+        out = np.array(img, dtype=np.uint8)
+        out.flags.writeable = False
+        self._resize_cache.put(key, out)
+        return out
+
     def _prepare_base_image_rgba(self, *, eff_writer: str = 'legacy_copy') -> np.ndarray:
         """
         Prepares RGBA image for generation:
@@ -1619,6 +2138,9 @@ class PreviewController:
         if self.state.canvas_resolved is None or self.state.image_original is None:
             raise RuntimeError("_prepare_base_image_rgba requiere canvas_resolved e image_original")
 
+        # Nueva imagen preparada (border/noise/paint_area): invalida análisis cacheados.
+        self._prepared_rev += 1
+
         eff_writer = (eff_writer or 'legacy_copy').strip().lower()
         if eff_writer not in ('legacy_copy', 'raster20', 'preserve_source'):
             eff_writer = 'legacy_copy'
@@ -1669,8 +2191,7 @@ class PreviewController:
         # -----------------------------------------------
         # Insertar imagen reescalada en el área visible
         # -----------------------------------------------
-        img = self.state.image_original.convert("RGBA").resize((visible_w, visible_h), Image.BILINEAR)
-        img_np = np.array(img, dtype=np.uint8)
+        img_np = self._resized_original_np(visible_w, visible_h, Image.BILINEAR)
 
         y1 = off_y + visible_h
         x1 = off_x + visible_w
@@ -1693,15 +2214,24 @@ class PreviewController:
                     self._debug_note_border_np_conversion()
                     frame_image_np = np.array(frame_img.convert("RGBA"), dtype=np.uint8)
                     border["frame_image_np"] = frame_image_np
+                    border["frame_key"] = frame_image_digest(frame_image_np)
                 if frame_image_np is not None:
+                    # Semilla fija: borde determinista -> capa reutilizada (caché de FrameBorder)
                     canvas_visible = apply_frame_border(
                         canvas_visible,
                         border_size=size,
                         style="image",
                         frame_image=frame_image_np,
+                        noise_seed=int(border.get("noise_seed", 0)),
+                        frame_key=border.get("frame_key"),
                     )
             else:
-                canvas_visible = apply_frame_border(canvas_visible, border_size=size, style=style)
+                canvas_visible = apply_frame_border(
+                    canvas_visible,
+                    border_size=size,
+                    style=style,
+                    noise_seed=int(border.get("noise_seed", 0)),
+                )
 
             canvas[off_y:y1, off_x:x1] = canvas_visible
 
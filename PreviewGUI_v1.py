@@ -5,6 +5,7 @@ import os
 import threading
 from pathlib import Path
 from PreviewController_v2 import PreviewController
+from CancelToken import CancelToken, RenderCancelled
 from paths import get_app_root
 import json
 import queue
@@ -201,6 +202,10 @@ class PreviewGUI(tk.Tk):
 
         self._preview_seq = 0
         self._preview_last_applied_seq = 0
+        # Último seq cuyo pase final terminó (el quick pass llega antes por la misma cola)
+        self._preview_done_seq = 0
+        # Token del último snapshot encolado: una request nueva cancela el render en curso
+        self._preview_cancel = None
         self._preview_poll_job = None
 
         self._preview_thread = threading.Thread(
@@ -216,6 +221,7 @@ class PreviewGUI(tk.Tk):
         self._gen_res_q = queue.Queue()
         self._gen_job_seq = 0
         self._gen_active_job_id = 0
+        self._gen_cancel = None
         self._gen_modal = None
         self._gen_progress = None
         self._gen_poll_job = None
@@ -293,6 +299,12 @@ class PreviewGUI(tk.Tk):
             self._gen_req_q.put(None)  # sentinel
         except Exception:
             pass
+        try:
+            if self._preview_cancel is not None:
+                self._preview_cancel.cancel()
+            self.controller.shutdown_preview_backend()
+        except Exception:
+            pass
         self.destroy()
 
         
@@ -934,9 +946,10 @@ class PreviewGUI(tk.Tk):
 
         self.best_dyes_var = tk.IntVar(value=40)
 
+        # 0 = automático (curva error-vs-N de la selección greedy)
         best_spin = ttk.Spinbox(
             best_frame,
-            from_=1,
+            from_=0,
             to=len(self.dye_vars) if self.dye_vars else 255,
             textvariable=self.best_dyes_var,
             width=5
@@ -2518,7 +2531,13 @@ class PreviewGUI(tk.Tk):
         self._preview_seq += 1
         seq = self._preview_seq
 
+        # El render en curso (si lo hay) ya es obsoleto: abortarlo cuanto antes.
+        if self._preview_cancel is not None:
+            self._preview_cancel.cancel()
+        self._preview_cancel = CancelToken()
+
         snapshot = self.controller.build_preview_snapshot()
+        snapshot["cancel"] = self._preview_cancel
         self._preview_req_q.put((seq, snapshot))
 
         self._ensure_preview_polling()
@@ -2530,6 +2549,9 @@ class PreviewGUI(tk.Tk):
     def _poll_preview_results(self):
         self._preview_poll_job = None
 
+        # Leer antes de vaciar la cola: el worker publica el resultado final y después done_seq.
+        done_seq = self._preview_done_seq
+
         latest = None
         try:
             while True:
@@ -2546,8 +2568,8 @@ class PreviewGUI(tk.Tk):
                 self._render_native = img
                 self._schedule_draw()
 
-        # Mientras haya una request más nueva pendiente, seguimos poll
-        if self._preview_last_applied_seq < self._preview_seq:
+        # Mientras haya una request más nueva o un pase final pendiente, seguimos poll
+        if self._preview_last_applied_seq < self._preview_seq or done_seq < self._preview_seq:
             self._ensure_preview_polling()
 
     def _preview_worker_loop(self):
@@ -2568,13 +2590,39 @@ class PreviewGUI(tk.Tk):
             except queue.Empty:
                 pass
 
+            # Pase rápido (resolución reducida, sin dither) antes del final
+            quick = None
+            try:
+                quick = self.controller.quick_preview_snapshot(snapshot)
+            except Exception:
+                quick = None
+
+            if quick is not None:
+                img = None
+                try:
+                    img = self.controller.render_preview_from_snapshot(quick)
+                except RenderCancelled:
+                    continue
+                except Exception:
+                    img = None
+                if img is not None:
+                    self._preview_res_q.put((seq, img))
+
+                # Si ya hay un snapshot más nuevo, el pase final de éste se descarta
+                if not self._preview_req_q.empty():
+                    continue
+
             img = None
             try:
                 img = self.controller.render_preview_from_snapshot(snapshot)
+            except RenderCancelled:
+                # Superado por un snapshot más nuevo (ya en la cola)
+                continue
             except Exception:
                 img = None
 
             self._preview_res_q.put((seq, img))
+            self._preview_done_seq = seq
 
 
             
@@ -2606,7 +2654,7 @@ class PreviewGUI(tk.Tk):
             X = int(self.best_dyes_var.get())
         except Exception:
             return
-        if X <= 0:
+        if X < 0:
             return
         if self.controller.state.image_original is None:
             return
@@ -2625,7 +2673,7 @@ class PreviewGUI(tk.Tk):
 
     def _best_dyes_worker(self, X: int):
         try:
-            selected = self.controller.calculate_best_dyes(X, sample_side=256, max_pixels=65536)
+            selected = self.controller.calculate_best_dyes(X if X > 0 else None, sample_side=256, max_pixels=65536)
         except Exception:
             selected = []
         self.after(0, lambda: self._apply_best_dyes_result(selected))
@@ -2728,8 +2776,8 @@ class PreviewGUI(tk.Tk):
         except Exception:
             pass
 
-        img = Image.open(path).convert("RGBA")
-        self.controller.set_image(img, image_name=Path(path).name)
+        # Ingest reducido (JPEG draft / pirámide): no se retiene el original a resolución completa.
+        self.controller.set_image_file(path, image_name=Path(path).name)
         self.image_label.config(text=os.path.basename(path))
         self._schedule_redraw()
 
@@ -3402,6 +3450,7 @@ class PreviewGUI(tk.Tk):
         # Encolar generación (1 job máximo)
         self._gen_job_seq += 1
         self._gen_active_job_id = self._gen_job_seq
+        self._gen_cancel = CancelToken()
 
         # Pausar preview durante export para evitar concurrencia con controller
         self._async_preview_enabled = False
@@ -3410,7 +3459,7 @@ class PreviewGUI(tk.Tk):
         self._show_generation_modal(f"Generando…\n{output_path.name}")
 
         kind = "multi" if tpl_type == "multi_canvas" else "single"
-        self._gen_req_q.put((self._gen_active_job_id, kind, output_path, self.tabla_dyes_path))
+        self._gen_req_q.put((self._gen_active_job_id, kind, output_path, self.tabla_dyes_path, self._gen_cancel))
         self._ensure_gen_polling()
 
     def _show_generation_modal(self, title: str = "Generando…"):
@@ -3436,9 +3485,18 @@ class PreviewGUI(tk.Tk):
         lbl.pack(padx=12, pady=(14, 8), fill="x")
 
         pb = ttk.Progressbar(win, mode="indeterminate")
-        pb.pack(padx=14, pady=(0, 12), fill="x")
+        pb.pack(padx=14, pady=(0, 8), fill="x")
         pb.start(10)
 
+        def _cancel():
+            if self._gen_cancel is not None:
+                self._gen_cancel.cancel()
+            btn.config(state="disabled")
+
+        btn = ttk.Button(win, text=self.t("btn.cancel"), command=_cancel)
+        btn.pack(pady=(0, 10))
+        win.protocol("WM_DELETE_WINDOW", _cancel)
+
         self._gen_modal = win
         self._gen_progress = pb
 
@@ -3490,6 +3548,9 @@ class PreviewGUI(tk.Tk):
             if ok:
                 # Feedback mínimo (sin modal extra)
                 self.gen_status.config(text="Generación completada")
+            elif payload is None:
+                # Cancelada por el usuario
+                self.gen_status.config(text=self.t("status.generation_cancelled"))
             else:
                 err_msg, tb = payload
                 print(tb)
@@ -3506,21 +3567,27 @@ class PreviewGUI(tk.Tk):
             if job is None:
                 break
 
-            job_id, kind, output_path, tabla_dyes_path = job
+            job_id, kind, output_path, tabla_dyes_path, cancel = job
             try:
                 if kind == "multi":
                     self.controller.requests_generation(
                         output_path=output_path,
                         tabla_dyes_path=tabla_dyes_path,
+                        cancel=cancel,
                     )
                 else:
                     self.controller.request_generation(
                         output_path=output_path,
                         tabla_dyes_path=tabla_dyes_path,
+                        cancel=cancel,
                     )
                 self._gen_res_q.put((job_id, True, None))
+            except RenderCancelled:
+                self._gen_res_q.put((job_id, False, None))
             except Exception as e:
                 tb = traceback.format_exc()
                 self._gen_res_q.put((job_id, False, (str(e), tb)))
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # preview process backend in frozen builds
     PreviewGUI().mainloop()
@@ -0,0 +1,296 @@
+"""PreviewProcessBackend_v1
+
+Proyecto Canvas — optional process-pool backend for background preview renders.
+
+The desktop preview worker is a thread: the pure-Python paths (legacy visual
+dithering, FrameBorder, overlay composition) hold the GIL and compete with the Tk
+main loop. With PC_PREVIEW_BACKEND=process the render_preview() calls of the
+snapshot path run in warm worker processes instead:
+
+- Pixels travel through multiprocessing.shared_memory (source image in, RGBA result
+  out) instead of pickled PIL images; only small metadata (palette pack, keys,
+  settings) is pickled.
+- Workers are long-lived and keep their own caches (stage cache, ordered analysis,
+  incremental dye match, palette LUTs). Cache keys are the controller's revision
+  keys, scoped per backend instance.
+- Cancellation: the parent mirrors its CancelToken into a 1-byte shared flag that
+  the worker's kernels poll, so superseded renders still abort within milliseconds.
+
+If the pool cannot start or breaks, renders fall back to the calling thread.
+
+Env
+---
+- PC_PREVIEW_BACKEND=process   enable (default: thread)
+- PC_PREVIEW_PROCESSES=N       worker processes (default 1: best cache locality)
+"""
+
+from __future__ import annotations
+
+import concurrent.futures as cf
+import multiprocessing
+import os
+import sys
+import threading
+import uuid
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from CancelToken import CancelToken
+
+
+# Espera del resultado en trozos cortos para propagar la cancelación al worker.
+_POLL_S = 0.004
+
+
+def process_backend_requested() -> bool:
+    if sys.platform == "emscripten":
+        return False
+    return os.environ.get("PC_PREVIEW_BACKEND", "thread").strip().lower() == "process"
+
+
+def _process_count() -> int:
+    try:
+        n = int(os.environ.get("PC_PREVIEW_PROCESSES", "1"))
+    except ValueError:
+        n = 1
+    return max(1, min(n, os.cpu_count() or 1))
+
+
+# ==========================================================
+# Worker side (runs in the child processes)
+# ==========================================================
+
+_W_LOCK = threading.Lock()
+_W_STATE: Optional[dict] = None
+
+
+def _worker_state() -> dict:
+    global _W_STATE
+    with _W_LOCK:
+        if _W_STATE is None:
+            from DyeMatchState_v1 import DyeMatchState
+            from LRUCache import LRUCache
+            from PreviewRender_v1 import PreviewStageCache
+
+            _W_STATE = {
+                "stage": PreviewStageCache(),
+                "analysis": LRUCache(4),
+                "match": DyeMatchState(),
+            }
+        return _W_STATE
+
+
+def _worker_init() -> None:
+    """Import the render stack and load the Numba kernels once per process."""
+    from ErrorDiffusion_v1 import ed_quantize_to_bytes
+
+    _worker_state()
+
+    pal = np.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]], dtype=np.float32)
+    ed_quantize_to_bytes(
+        np.full((2, 2, 3), 0.5, dtype=np.float32),
+        np.ones((2, 2), dtype=bool),
+        pal,
+        np.einsum("ij,ij->i", pal, pal),
+        np.array([1, 2], dtype=np.uint8),
+        pal,
+    )
+
+
+def _worker_ping() -> int:
+    return os.getpid()
+
+
+def _worker_render(job: dict) -> tuple:
+    from PreviewRender_v1 import render_preview
+
+    src = shared_memory.SharedMemory(name=job["src"])
+    dst = shared_memory.SharedMemory(name=job["dst"])
+    flag = shared_memory.SharedMemory(name=job["flag"])
+    token = CancelToken()
+    try:
+        # Copia local: el Image no debe retener el buffer compartido.
+        arr = np.array(np.ndarray(job["src_shape"], dtype=np.uint8, buffer=src.buf))
+        image = Image.fromarray(arr, mode=job["src_mode"])
+
+        token.flag = np.ndarray((1,), dtype=np.uint8, buffer=flag.buf)
+        state = _worker_state()
+
+        kw = dict(job["kwargs"])
+        if kw.get("analysis_key") is not None:
+            kw["analysis_cache"] = state["analysis"]
+        if kw.get("match_key") is not None:
+            kw["match_state"] = state["match"]
+        kw["stage_cache"] = state["stage"]
+
+        out = render_preview(image, template_id=None, cancel=token, **kw)
+
+        out_arr = np.asarray(out.convert("RGBA"), dtype=np.uint8)
+        h, w = int(out_arr.shape[0]), int(out_arr.shape[1])
+        if h * w * 4 > dst.size:
+            return (w, h, out_arr.tobytes())
+        view = np.ndarray((h, w, 4), dtype=np.uint8, buffer=dst.buf)
+        view[...] = out_arr
+        del view
+        return (w, h, None)
+    finally:
+        token.flag = np.zeros((1,), dtype=np.uint8)
+        src.close()
+        dst.close()
+        flag.close()
+
+
+# ==========================================================
+# Parent side
+# ==========================================================
+
+def _scoped(scope: str, key):
+    return None if key is None else (scope, key)
+
+
+def _portable_palette(palette: Optional[dict]) -> Optional[dict]:
+    """Palette dict without closures / translator (pack + byte->rgb are enough to render)."""
+    if not palette:
+        return palette
+    if palette.get("mode") != "palette":
+        return {"mode": palette.get("mode")}
+
+    pack = palette.get("pack")
+    b2rgb = palette.get("byte_to_rgb_u8")
+    translator = palette.get("translator")
+    enabled = palette.get("enabled_dyes")
+    if pack is None and translator is not None:
+        pack = translator.palette_pack(enabled_dyes=enabled)
+    if b2rgb is None and translator is not None:
+        b2rgb = translator.byte_to_rgb_u8(enabled_dyes=enabled)
+
+    return {
+        "mode": "palette",
+        "pack": pack,
+        "byte_to_rgb_u8": b2rgb,
+        "enabled_dyes": enabled,
+        "alpha_threshold": palette.get("alpha_threshold", 10),
+    }
+
+
+def _share_image(image: Image.Image) -> tuple:
+    if image.mode not in ("RGBA", "RGB", "L"):
+        image = image.convert("RGBA")
+    arr = np.asarray(image, dtype=np.uint8)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(arr.nbytes)))
+    np.ndarray(arr.shape, dtype=np.uint8, buffer=shm.buf)[...] = arr
+    return shm, tuple(arr.shape), image.mode
+
+
+def _release(shm: Optional[shared_memory.SharedMemory]) -> None:
+    if shm is None:
+        return
+    try:
+        shm.close()
+    finally:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ProcessPreviewBackend:
+    """Drop-in render_preview() running in a warm process pool."""
+
+    def __init__(self, *, processes: Optional[int] = None):
+        n = _process_count() if processes is None else max(1, int(processes))
+        # spawn: seguro con hilos + Tk en todas las plataformas.
+        ctx = multiprocessing.get_context("spawn")
+        self._pool = cf.ProcessPoolExecutor(max_workers=n, mp_context=ctx, initializer=_worker_init)
+        self._scope = uuid.uuid4().hex
+        self._broken = False
+
+        # Arranque en segundo plano: el primer render no paga import + Numba.
+        for _ in range(n):
+            self._pool.submit(_worker_ping)
+
+    @property
+    def available(self) -> bool:
+        return not self._broken
+
+    def shutdown(self) -> None:
+        self._broken = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def render_preview(
+        self,
+        image: Image.Image,
+        *,
+        target_width: int,
+        target_height: int,
+        cancel: Optional[CancelToken] = None,
+        **kwargs,
+    ) -> Image.Image:
+        from PreviewRender_v1 import render_preview
+
+        if self._broken or target_width <= 0 or target_height <= 0:
+            return render_preview(
+                image, target_width=target_width, target_height=target_height, cancel=cancel, **kwargs
+            )
+
+        # Objetos del proceso padre (locks, cachés, closures) se quedan aquí.
+        local_kwargs = dict(kwargs)
+        for k in ("template_id", "analysis_cache", "match_state", "stage_cache"):
+            kwargs.pop(k, None)
+        kwargs["palette"] = _portable_palette(kwargs.get("palette"))
+        for k in ("analysis_key", "match_key", "source_key"):
+            kwargs[k] = _scoped(self._scope, kwargs.get(k))
+        kwargs["target_width"] = int(target_width)
+        kwargs["target_height"] = int(target_height)
+
+        src = dst = flag = None
+        try:
+            src, src_shape, src_mode = _share_image(image)
+            dst = shared_memory.SharedMemory(create=True, size=int(target_width) * int(target_height) * 4)
+            flag = shared_memory.SharedMemory(create=True, size=1)
+            flag_view = np.ndarray((1,), dtype=np.uint8, buffer=flag.buf)
+            flag_view[0] = 1 if (cancel is not None and cancel.cancelled) else 0
+
+            job = {
+                "src": src.name,
+                "src_shape": src_shape,
+                "src_mode": src_mode,
+                "dst": dst.name,
+                "flag": flag.name,
+                "kwargs": kwargs,
+            }
+            try:
+                fut = self._pool.submit(_worker_render, job)
+            except Exception:
+                # Pool roto o cerrado: seguir en el hilo actual.
+                self._broken = True
+                return render_preview(
+                    image, target_width=target_width, target_height=target_height, cancel=cancel, **local_kwargs
+                )
+
+            while True:
+                try:
+                    w, h, data = fut.result(timeout=_POLL_S)
+                    break
+                except cf.TimeoutError:
+                    if cancel is not None and cancel.cancelled:
+                        flag_view[0] = 1
+                except cf.process.BrokenProcessPool:
+                    self._broken = True
+                    return render_preview(
+                        image, target_width=target_width, target_height=target_height, cancel=cancel, **local_kwargs
+                    )
+            del flag_view
+
+            if data is not None:
+                arr = np.frombuffer(data, dtype=np.uint8).reshape((h, w, 4))
+            else:
+                arr = np.array(np.ndarray((h, w, 4), dtype=np.uint8, buffer=dst.buf))
+            return Image.fromarray(arr, mode="RGBA")
+        finally:
+            _release(src)
+            _release(dst)
+            _release(flag)
@@ -6,19 +6,32 @@
 # - Safe palette-aware dithering in ark_simulation
 # - Optional legacy dithering for visual mode
 # - Thread-safe small cache for overlay/mask IO (PyInstaller-friendly)
+# - Stage-level memoization (resize / border / quantize / overlay)
 
 from __future__ import annotations
 
 from pathlib import Path
 from collections import OrderedDict
+import hashlib
+import os
 import threading
 
 import numpy as np
 from PIL import Image
 
+from CancelToken import CancelToken, check_cancel
 from FrameBorder import apply_frame_border
 from Dithering import floyd_steinberg_dither, ordered_dither
-from ErrorDiffusion_v1 import ed_quantize_to_bytes, ordered_quantize_to_bytes, nearest_bytes_batch_from_pack
+from ErrorDiffusion_v1 import (
+    ed_quantize_to_bytes,
+    ordered_quantize_to_bytes,
+    ordered_analysis,
+    nearest_bytes_batch_from_pack,
+    format_match_stats,
+    ed_serpentine_for,
+)
+from LRUCache import LRUCache
+from PaletteLUT_v1 import palette_digest
 
 
 # ==========================================================
@@ -77,6 +90,391 @@ def _srgb01_to_linear01(arr: np.ndarray) -> np.ndarray:
     return np.where(arr <= 0.04045, arr / 12.92, ((arr + 0.055) / 1.055) ** 2.4)
 
 
+# ==========================================================
+# Pipeline stages: resize -> border -> quantize -> overlay
+# ==========================================================
+#
+# Cada etapa tiene una clave derivada de su entrada (clave de la etapa anterior +
+# sus propios parámetros) y una LRU acotada. Cambiar un parámetro sólo re-ejecuta
+# esa etapa y las siguientes: mostrar/ocultar el overlay reutiliza la cuantización,
+# mover el strength reutiliza resize + border.
+#
+# Clave None = etapa no cacheable (p.ej. ruido de borde sin semilla); arrastra a
+# las etapas siguientes. Los arrays cacheados se marcan read-only.
+
+PREVIEW_STAGES = ("resize", "border", "quantize", "overlay")
+
+
+class PreviewStageCache:
+    """Bounded per-stage caches for render_preview, with hit/miss counters."""
+
+    def __init__(self, *, max_items: int = 4, max_bytes: int = 96 * 1024 * 1024):
+        self._caches = {name: LRUCache(max_items, max_bytes=max_bytes) for name in PREVIEW_STAGES}
+
+    def get(self, stage: str, key) -> np.ndarray | None:
+        return self._caches[stage].get(key)
+
+    def put(self, stage: str, key, value: np.ndarray) -> None:
+        value.flags.writeable = False
+        self._caches[stage].put(key, value)
+
+    def clear(self, *, reset_stats: bool = False) -> None:
+        for c in self._caches.values():
+            c.clear(reset_stats=reset_stats)
+
+    def stats(self) -> dict:
+        """{stage: {"items", "bytes", "hits", "misses"}}"""
+        return {name: c.stats() for name, c in self._caches.items()}
+
+
+def _run_stage(stages: PreviewStageCache | None, name: str, key, fn, trace: dict | None):
+    if stages is None or key is None:
+        if trace is not None:
+            trace[name] = "run"
+        return fn()
+
+    hit = stages.get(name, key)
+    if hit is not None:
+        if trace is not None:
+            trace[name] = "hit"
+        return hit
+
+    out = fn()
+    stages.put(name, key, out)
+    if trace is not None:
+        trace[name] = "miss"
+    return out
+
+
+def _image_digest(image: Image.Image) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode("ascii"))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def _array_digest(arr: np.ndarray) -> str:
+    a = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((a.shape, a.dtype.str)).encode("ascii"))
+    h.update(a.data)
+    return h.hexdigest()
+
+
+# --------------------------------------------------
+# Stage: resize (uint8 RGBA)
+# --------------------------------------------------
+
+def _stage_resize(image: Image.Image, target_width: int, target_height: int) -> np.ndarray:
+    img = image.convert("RGBA")
+    if img.size != (target_width, target_height):
+        img = img.resize((target_width, target_height), Image.BILINEAR)
+    return np.array(img, dtype=np.uint8)
+
+
+# --------------------------------------------------
+# Stage: border (uint8 RGBA -> uint8 RGBA)
+# --------------------------------------------------
+
+def _border_active(border: dict | None) -> bool:
+    if not border:
+        return False
+    style = border.get("style", "none")
+    size = int(border.get("size", 0))
+    if style == "none" or size <= 0:
+        return False
+    # Sólo el estilo "image" se aplica aquí; sin frame cargado es no-op.
+    return style == "image" and border.get("frame_image") is not None
+
+
+def _border_stage_key(border: dict) -> tuple | None:
+    noise = float(border.get("noise", 0.0))
+    seed = border.get("noise_seed", 0)
+    if noise > 0.0 and seed is None:
+        return None
+
+    frame_key = border.get("frame_key")
+    if frame_key is None:
+        frame_key = _array_digest(np.asarray(border["frame_image"].convert("RGBA")))
+    return ("image", int(border.get("size", 0)), noise, seed, frame_key)
+
+
+def _stage_border(img_np: np.ndarray, border: dict) -> np.ndarray:
+    frame_np = np.array(border["frame_image"].convert("RGBA"), dtype=np.uint8)
+    return apply_frame_border(
+        img_np,
+        border_size=int(border.get("size", 0)),
+        style="image",
+        frame_image=frame_np,
+        noise_strength=float(border.get("noise", 0.0)),
+        noise_seed=border.get("noise_seed", 0),
+        frame_key=border.get("frame_key"),
+    )
+
+
+# --------------------------------------------------
+# Stage: quantize / dither (uint8 RGBA -> uint8 RGBA)
+# --------------------------------------------------
+
+def _resolve_palette(palette: dict | None):
+    """(pack, byte_to_rgb_u8) for a palette-mode dict, or (None, None)."""
+    if not (palette and palette.get("mode") == "palette"):
+        return None, None
+
+    translator = palette.get("translator")
+    enabled = palette.get("enabled_dyes", None)
+    # NOTE: palette fields like byte_to_rgb_u8 are numpy arrays.
+    # Never use `or` with numpy arrays (truth-value is ambiguous).
+    pack = palette.get("pack")
+    if pack is None and translator is not None:
+        pack = translator.palette_pack(enabled_dyes=enabled)
+
+    b2rgb = palette.get("byte_to_rgb_u8")
+    if b2rgb is None and translator is not None:
+        b2rgb = translator.byte_to_rgb_u8(enabled_dyes=enabled)
+
+    if pack is None or b2rgb is None:
+        return None, None
+    return pack, b2rgb
+
+
+def _quantize_stage_key(
+    preview_mode: str,
+    d_mode: str,
+    d_strength: float,
+    d_serpentine: bool,
+    palette: dict | None,
+    pack: dict | None,
+    b2rgb: np.ndarray | None,
+) -> tuple:
+    if preview_mode != "ark_simulation":
+        if d_mode not in ("fs", "ordered"):
+            return ("visual", "none")
+        return ("visual", d_mode, d_strength)
+
+    if pack is None:
+        return ("ark", None)
+
+    if d_mode in ("palette_fs", "fs"):
+        dk = ("fs", d_strength, bool(d_serpentine))
+    elif d_mode in ("palette_ordered", "ordered"):
+        dk = ("ordered", d_strength)
+    else:
+        dk = ("none",)
+
+    pal_key = pack.get("digest")
+    if pal_key is None:
+        pal_key = palette_digest(
+            palette_w=pack["palette_w"],
+            palette_bytes=pack["palette_bytes"],
+            sqrt_w=pack.get("sqrt_w"),
+        )
+    return ("ark", dk, pal_key, _array_digest(b2rgb), int(palette.get("alpha_threshold", 10)))
+
+
+def _stage_quantize(
+    img_np: np.ndarray,
+    *,
+    target_width: int,
+    target_height: int,
+    preview_mode: str,
+    d_mode: str,
+    d_strength: float,
+    d_serpentine: bool,
+    palette: dict | None,
+    pack: dict | None,
+    b2rgb: np.ndarray | None,
+    analysis_cache,
+    analysis_key: tuple | None,
+    match_state,
+    match_key: tuple | None,
+    cancel: CancelToken | None,
+) -> np.ndarray:
+    rgb_u8_in = img_np[..., :3]
+    a_u8_in = img_np[..., 3]
+
+    if preview_mode == "ark_simulation":
+        if pack is None:
+            return np.zeros((target_height, target_width, 4), dtype=np.uint8)
+
+        alpha_threshold = int(palette.get("alpha_threshold", 10))
+        active = a_u8_in >= alpha_threshold
+        # PERF (debug): PC_PERF=1 reporta el ratio de dedup del match
+        match_stats = {} if os.environ.get("PC_PERF", "0") == "1" else None
+
+        # Quantization/dithering must use the same RGB space as the dye table.
+        # In this project build, TablaDyes_v1.json stores dye "linear_rgb" values
+        # already in *sRGB normalized* (0..1). Historical pipeline therefore treats
+        # image_rgb/255 as that same space (no sRGB->linear transform).
+        rgb_lin = rgb_u8_in.astype(np.float32) / 255.0
+
+        # Top-2 incremental por dyes (sin dither / ordered)
+        def _state_nearest2():
+            if match_state is None or match_key is None or pack["palette_bytes"].shape[0] == 0:
+                return None
+            pix = rgb_lin.reshape(-1, 3)[active.reshape(-1)]
+            if pix.shape[0] == 0:
+                return None
+            return match_state.match2(
+                ("preview", match_key, alpha_threshold, target_width, target_height),
+                pix,
+                pack,
+                stats=match_stats,
+            )
+
+        if d_mode in ("palette_fs", "fs"):
+            bytes_map = ed_quantize_to_bytes(
+                rgb_lin,
+                active,
+                pack["palette_w"],
+                pack["palette_w_norm2"],
+                pack["palette_bytes"],
+                pack["palette_linear"],
+                kernel="floyd_steinberg",
+                strength=d_strength,
+                serpentine=d_serpentine,
+                respect_mask=True,
+                clamp01=True,
+                cancel=cancel,
+            )
+
+        elif d_mode in ("palette_ordered", "ordered"):
+            analysis = None
+            cache_key = None
+            if analysis_cache is not None and analysis_key is not None:
+                cache_key = ("ordered", analysis_key, alpha_threshold)
+                analysis = analysis_cache.get(cache_key)
+                if analysis is not None and analysis.shape != (target_height, target_width):
+                    analysis = None
+
+            if analysis is None:
+                analysis = ordered_analysis(
+                    rgb_lin,
+                    active,
+                    palette_w=pack["palette_w"],
+                    palette_w_norm2=pack["palette_w_norm2"],
+                    palette_bytes=pack["palette_bytes"],
+                    sqrt_w=pack.get("sqrt_w"),
+                    stats=match_stats,
+                    nearest2=_state_nearest2(),
+                    cancel=cancel,
+                )
+                if cache_key is not None:
+                    analysis_cache.put(cache_key, analysis)
+
+            bytes_map = ordered_quantize_to_bytes(
+                rgb_lin,
+                active,
+                palette_w=pack["palette_w"],
+                palette_w_norm2=pack["palette_w_norm2"],
+                palette_bytes=pack["palette_bytes"],
+                sqrt_w=pack.get("sqrt_w"),
+                strength=d_strength,
+                analysis=analysis,
+                cancel=cancel,
+            )
+
+        else:
+            bytes_map = np.zeros((target_height, target_width), dtype=np.uint8)
+            top2 = _state_nearest2()
+            if top2 is not None:
+                bytes_map[active] = top2[0]
+            elif np.any(active):
+                flat = rgb_lin.reshape(-1, 3)
+                act = active.reshape(-1)
+                idx = np.nonzero(act)[0]
+                bytes_sel = nearest_bytes_batch_from_pack(
+                    flat[idx],
+                    palette_w=pack["palette_w"],
+                    palette_w_norm2=pack["palette_w_norm2"],
+                    palette_bytes=pack["palette_bytes"],
+                    sqrt_w=pack.get("sqrt_w"),
+                    stats=match_stats,
+                )
+                bytes_map.reshape(-1)[idx] = bytes_sel
+
+        if match_stats:
+            print(f"[PERF] preview {target_width}x{target_height} {format_match_stats(match_stats)}")
+
+        rgb_out = b2rgb[bytes_map]
+        a_out = a_u8_in.copy()
+        a_out[~active] = 0
+        return np.dstack([rgb_out, a_out])
+
+    # visual mode: optional legacy dithering on float RGB
+    rgb = rgb_u8_in.astype(np.float32) / 255.0
+    alpha = a_u8_in.astype(np.float32) / 255.0
+
+    def _identity_quantize(rgb_arr):
+        return rgb_arr
+
+    if d_mode == "fs":
+        rgb = floyd_steinberg_dither(rgb, quantize_fn=_identity_quantize, strength=d_strength, cancel=cancel)
+
+    elif d_mode == "ordered":
+        rgb = ordered_dither(rgb, quantize_fn=_identity_quantize, strength=d_strength, cancel=cancel)
+
+    rgb_u8 = np.clip(rgb * 255.0, 0, 255).astype(np.uint8)
+    a_u8 = np.clip(alpha * 255.0, 0, 255).astype(np.uint8)
+    return np.dstack([rgb_u8, a_u8])
+
+
+# --------------------------------------------------
+# Stage: overlay / mask (uint8 RGBA -> uint8 RGBA)
+# --------------------------------------------------
+
+def _overlay_stage_key(overlay_def: dict) -> tuple:
+    mask_alpha = overlay_def.get("mask_alpha")
+    if isinstance(mask_alpha, np.ndarray):
+        mk = ("alpha", _array_digest(mask_alpha))
+    else:
+        mp = overlay_def.get("mask")
+        mk = ("file", None if mp is None else str(mp))
+    ip = overlay_def.get("image")
+    return (mk, None if ip is None else str(ip))
+
+
+def _stage_overlay(out: np.ndarray, overlay_def: dict, target_width: int, target_height: int) -> np.ndarray:
+    out = out.copy()
+    size = (target_width, target_height)
+
+    # Mask as alpha (real cut)
+    mask_alpha = overlay_def.get("mask_alpha")
+    if isinstance(mask_alpha, np.ndarray):
+        alpha2 = mask_alpha
+        if alpha2.dtype == np.bool_:
+            alpha2 = alpha2.astype(np.uint8) * 255
+        elif alpha2.dtype != np.uint8:
+            alpha2 = alpha2.astype(np.uint8)
+        # Ensure shape (H,W) and resize if needed
+        if alpha2.ndim == 3:
+            alpha2 = alpha2[..., 0]
+        if alpha2.shape != (target_height, target_width):
+            try:
+                alpha_img = Image.fromarray(alpha2, mode="L")
+                alpha_img = alpha_img.resize((target_width, target_height), Image.NEAREST)
+                alpha2 = np.array(alpha_img, dtype=np.uint8)
+            except Exception:
+                alpha2 = None
+        if alpha2 is not None:
+            out[..., 3] = alpha2
+    else:
+        mask_path = overlay_def.get("mask")
+        if mask_path is not None:
+            mask_np = _load_rgba_resized_cached(Path(mask_path), size=size, nearest=True)
+            if mask_np is not None:
+                out[..., 3] = mask_np[..., 3]
+
+    # Overlay RGB (decorative, respects overlay alpha>0)
+    overlay_path = overlay_def.get("image")
+    if overlay_path is not None:
+        overlay_np = _load_rgba_resized_cached(Path(overlay_path), size=size, nearest=True)
+        if overlay_np is not None:
+            mask_overlay = overlay_np[..., 3] > 0
+            out[..., :3][mask_overlay] = overlay_np[..., :3][mask_overlay]
+    return out
+
+
 # ==========================================================
 # Preview Renderer
 # ==========================================================
@@ -94,6 +492,13 @@ def render_preview(
     game_object_type=None,         # kept for compatibility (not used here)
     show_game_object: bool = False,  # kept for compatibility (not used here)
     overlay_def: dict | None = None,
+    analysis_cache=None,
+    analysis_key: tuple | None = None,
+    match_state=None,
+    match_key: tuple | None = None,
+    stage_cache: PreviewStageCache | None = None,
+    source_key: tuple | None = None,
+    cancel: CancelToken | None = None,
 ) -> Image.Image:
     """
     Renderiza una preview visual del resultado final, sin generar .pnt.
@@ -102,189 +507,120 @@ def render_preview(
     - Border: uint8 RGBA -> uint8 RGBA
     - Dithering: float32 RGB [0–1] -> float32 RGB [0–1]
     - Alpha NO se ditheriza
+
+    analysis_cache / analysis_key (opcional):
+    - LRUCache del controller + clave (imagen, geometría, paleta) SIN strength.
+    - Ordered dithering reutiliza el nearest/2nd-nearest: mover el slider de
+      strength sólo repite la comparación con el umbral Bayer.
+
+    match_state / match_key (opcional):
+    - DyeMatchState_v1 del controller + clave de los píxeles SIN el set de dyes.
+    - Sin dither / ordered: al activar/desactivar un dye sólo se recalculan los
+      colores afectados (top-2 incremental).
+
+    stage_cache / source_key (opcional):
+    - PreviewStageCache del controller: memoiza cada etapa (resize, border,
+      quantize, overlay) por separado.
+    - source_key identifica los píxeles de `image` (p.ej. revisión de imagen);
+      sin él se usa un hash del contenido.
+
+    cancel (opcional):
+    - CancelToken; se comprueba entre etapas y por fila dentro del dither.
+      Lanza RenderCancelled (la etapa interrumpida no se cachea).
     """
 
     if target_width <= 0 or target_height <= 0:
         return Image.new("RGBA", (1, 1), (0, 0, 0, 0))
 
+    stages = stage_cache
+    # PERF (debug): PC_PERF=1 reporta hit/miss por etapa
+    trace = {} if (stages is not None and os.environ.get("PC_PERF", "0") == "1") else None
+
     # --------------------------------------------------
     # 1) Resize base (uint8 RGBA)
     # --------------------------------------------------
-    img = image.convert("RGBA")
-    if img.size != (target_width, target_height):
-        img = img.resize((target_width, target_height), Image.BILINEAR)
-
-    img_np = np.array(img, dtype=np.uint8)
+    check_cancel(cancel)
+    key = None
+    if stages is not None:
+        src = source_key if source_key is not None else ("digest", _image_digest(image))
+        key = ("resize", src, int(target_width), int(target_height))
+
+    img_np = _run_stage(
+        stages, "resize", key,
+        lambda: _stage_resize(image, target_width, target_height),
+        trace,
+    )
 
     # --------------------------------------------------
     # 2) Border (uint8 RGBA -> uint8 RGBA)
     # --------------------------------------------------
-    if border:
-        style = border.get("style", "none")
-        size = int(border.get("size", 0))
-        noise = float(border.get("noise", 0.0))
-
-        if style != "none" and size > 0:
-            if style == "image":
-                frame_img = border.get("frame_image")
-                if frame_img is None:
-                    pass  # no-op: aún no hay frame cargado
-                else:
-                    frame_np = np.array(frame_img.convert("RGBA"), dtype=np.uint8)
-                    img_np = apply_frame_border(
-                        img_np,
-                        border_size=size,
-                        style="image",
-                        frame_image=frame_np,
-                        noise_strength=float(border.get("noise", 0.0)),
-                    )
-    # --------------------------------------------------
-    # 3) Split RGBA (uint8)
-    # --------------------------------------------------
-    rgb_u8_in = img_np[..., :3]
-    a_u8_in = img_np[..., 3]
+    if _border_active(border):
+        if key is not None:
+            bkey = _border_stage_key(border)
+            key = None if bkey is None else (key, "border", bkey)
+        check_cancel(cancel)
+        base_np = img_np
+        img_np = _run_stage(stages, "border", key, lambda: _stage_border(base_np, border), trace)
 
     # --------------------------------------------------
-    # 4) Dithering + ARK simulation (bytes-first)
+    # 3) Dithering + ARK simulation (bytes-first)
     # --------------------------------------------------
     d_mode = "none"
     d_strength = 0.5
+    d_scan = None
     if dithering:
         d_mode = dithering.get("mode", "none")
         d_strength = _clamp01(float(dithering.get("strength", 0.5)))
+        d_scan = dithering.get("scan")
+    # Mismo orden de escaneo que el encode del canvas (raster en canvases grandes).
+    d_serpentine = ed_serpentine_for(target_height, target_width, d_scan)
 
+    pack, b2rgb = (None, None)
     if preview_mode == "ark_simulation":
-        if not (palette and palette.get("mode") == "palette"):
-            out = np.zeros((target_height, target_width, 4), dtype=np.uint8)
-        else:
-            translator = palette.get("translator")
-            enabled = palette.get("enabled_dyes", None)
-            # NOTE: palette fields like byte_to_rgb_u8 are numpy arrays.
-            # Never use `or` with numpy arrays (truth-value is ambiguous).
-            pack = palette.get("pack")
-            if pack is None and translator is not None:
-                pack = translator.palette_pack(enabled_dyes=enabled)
-
-            b2rgb = palette.get("byte_to_rgb_u8")
-            if b2rgb is None and translator is not None:
-                b2rgb = translator.byte_to_rgb_u8(enabled_dyes=enabled)
-
-            if pack is None or b2rgb is None:
-                out = np.zeros((target_height, target_width, 4), dtype=np.uint8)
-            else:
-                alpha_threshold = int(palette.get("alpha_threshold", 10))
-                active = a_u8_in >= alpha_threshold
-
-                # Quantization/dithering must use the same RGB space as the dye table.
-                # In this project build, TablaDyes_v1.json stores dye "linear_rgb" values
-                # already in *sRGB normalized* (0..1). Historical pipeline therefore treats
-                # image_rgb/255 as that same space (no sRGB->linear transform).
-                rgb_lin = rgb_u8_in.astype(np.float32) / 255.0
-
-                if d_mode in ("palette_fs", "fs"):
-                    bytes_map = ed_quantize_to_bytes(
-                        rgb_lin,
-                        active,
-                        pack["palette_w"],
-                        pack["palette_w_norm2"],
-                        pack["palette_bytes"],
-                        pack["palette_linear"],
-                        kernel="floyd_steinberg",
-                        strength=d_strength,
-                        serpentine=True,
-                        respect_mask=True,
-                        clamp01=True,
-                    )
-
-                elif d_mode in ("palette_ordered", "ordered"):
-                    bytes_map = ordered_quantize_to_bytes(
-                        rgb_lin,
-                        active,
-                        palette_w=pack["palette_w"],
-                        palette_w_norm2=pack["palette_w_norm2"],
-                        palette_bytes=pack["palette_bytes"],
-                        sqrt_w=pack.get("sqrt_w"),
-                        strength=d_strength,
-                    )
-
-                else:
-                    bytes_map = np.zeros((target_height, target_width), dtype=np.uint8)
-                    if np.any(active):
-                        flat = rgb_lin.reshape(-1, 3)
-                        act = active.reshape(-1)
-                        idx = np.nonzero(act)[0]
-                        bytes_sel = nearest_bytes_batch_from_pack(
-                            flat[idx],
-                            palette_w=pack["palette_w"],
-                            palette_w_norm2=pack["palette_w_norm2"],
-                            palette_bytes=pack["palette_bytes"],
-                            sqrt_w=pack.get("sqrt_w"),
-                        )
-                        bytes_map.reshape(-1)[idx] = bytes_sel
-
-                rgb_out = b2rgb[bytes_map]
-                a_out = a_u8_in.copy()
-                a_out[~active] = 0
-                out = np.dstack([rgb_out, a_out])
-
-    else:
-        # visual mode: optional legacy dithering on float RGB
-        rgb = rgb_u8_in.astype(np.float32) / 255.0
-        alpha = a_u8_in.astype(np.float32) / 255.0
-
-        def _identity_quantize(rgb_arr):
-            return rgb_arr
-
-        if d_mode == "fs":
-            rgb = floyd_steinberg_dither(rgb, quantize_fn=_identity_quantize, strength=d_strength)
-
-        elif d_mode == "ordered":
-            rgb = ordered_dither(rgb, quantize_fn=_identity_quantize, strength=d_strength)
-
-        rgb_u8 = np.clip(rgb * 255.0, 0, 255).astype(np.uint8)
-        a_u8 = np.clip(alpha * 255.0, 0, 255).astype(np.uint8)
-        out = np.dstack([rgb_u8, a_u8])
-
+        pack, b2rgb = _resolve_palette(palette)
+
+    if key is not None:
+        key = (key, "quantize", _quantize_stage_key(preview_mode, d_mode, d_strength, d_serpentine, palette, pack, b2rgb))
+
+    check_cancel(cancel)
+    base_np = img_np
+    out = _run_stage(
+        stages, "quantize", key,
+        lambda: _stage_quantize(
+            base_np,
+            target_width=target_width,
+            target_height=target_height,
+            preview_mode=preview_mode,
+            d_mode=d_mode,
+            d_strength=d_strength,
+            d_serpentine=d_serpentine,
+            palette=palette,
+            pack=pack,
+            b2rgb=b2rgb,
+            analysis_cache=analysis_cache,
+            analysis_key=analysis_key,
+            match_state=match_state,
+            match_key=match_key,
+            cancel=cancel,
+        ),
+        trace,
+    )
 
     # --------------------------------------------------
-    # 7) Overlay / Mask (optional)
+    # 4) Overlay / Mask (optional)
     # --------------------------------------------------
     if overlay_def and not (preview_mode == "ark_simulation" and (not palette or palette.get("mode") != "palette")):
-        out = out.copy()
-        size = (target_width, target_height)
-
-        # 7.1 Mask as alpha (real cut)
-        mask_alpha = overlay_def.get("mask_alpha")
-        if isinstance(mask_alpha, np.ndarray):
-            alpha2 = mask_alpha
-            if alpha2.dtype == np.bool_:
-                alpha2 = alpha2.astype(np.uint8) * 255
-            elif alpha2.dtype != np.uint8:
-                alpha2 = alpha2.astype(np.uint8)
-            # Ensure shape (H,W) and resize if needed
-            if alpha2.ndim == 3:
-                alpha2 = alpha2[..., 0]
-            if alpha2.shape != (target_height, target_width):
-                try:
-                    alpha_img = Image.fromarray(alpha2, mode="L")
-                    alpha_img = alpha_img.resize((target_width, target_height), Image.NEAREST)
-                    alpha2 = np.array(alpha_img, dtype=np.uint8)
-                except Exception:
-                    alpha2 = None
-            if alpha2 is not None:
-                out[..., 3] = alpha2
-        else:
-            mask_path = overlay_def.get("mask")
-            if mask_path is not None:
-                mask_np = _load_rgba_resized_cached(Path(mask_path), size=size, nearest=True)
-                if mask_np is not None:
-                    out[..., 3] = mask_np[..., 3]
-        # 7.2 Overlay RGB (decorative, respects overlay alpha>0)
-        overlay_path = overlay_def.get("image")
-        if overlay_path is not None:
-            overlay_np = _load_rgba_resized_cached(Path(overlay_path), size=size, nearest=True)
-            if overlay_np is not None:
-                mask_overlay = overlay_np[..., 3] > 0
-                out[..., :3][mask_overlay] = overlay_np[..., :3][mask_overlay]
+        if key is not None:
+            key = (key, "overlay", _overlay_stage_key(overlay_def))
+        check_cancel(cancel)
+        base_np = out
+        out = _run_stage(
+            stages, "overlay", key,
+            lambda: _stage_overlay(base_np, overlay_def, target_width, target_height),
+            trace,
+        )
+
+    if trace:
+        print(f"[PERF] preview stages {target_width}x{target_height} " + " ".join(f"{k}={v}" for k, v in trace.items()))
 
     return Image.fromarray(out, mode="RGBA")
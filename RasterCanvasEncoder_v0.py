@@ -6,16 +6,261 @@
 # - Soporte opcional de dithering (Floyd–Steinberg)
 # ==========================================================
 
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
+import hashlib
 import struct
+import threading
 import numpy as np
 import os
 from time import perf_counter
 
-from PntColorTranslator_v0 import PntColorTranslatorV1
+from PaletteRegistry_v1 import get_translator
 from RasterLayoutExtractor_v0 import RasterLayoutExtractor
-from PntIO import peek_pnt_info
-from ErrorDiffusion_v1 import ed_quantize_to_bytes, ordered_quantize_to_bytes
+from PntIO import PntFile, get_pnt_base_asset, patch_pnt_raster
+from CancelToken import check_cancel
+from ErrorDiffusion_v1 import ed_quantize_to_bytes, ordered_quantize_to_bytes, format_match_stats
+
+
+# ==========================================================
+# Encode plan (planks / flip / visible rows / máscara)
+# ==========================================================
+
+@dataclass(frozen=True)
+class EncodePlan:
+    """
+    Mapa precompilado ROI -> offsets absolutos del buffer de salida.
+
+    - src_index: índice plano dentro del ROI (enc_h * enc_w)
+    - dst_offset: offset absoluto en el .pnt (header incluido)
+    - has_overlap: varios planks escriben el mismo offset (gana el último)
+
+    El orden de las entradas es el mismo que el del bucle plank -> fila -> x
+    original, para conservar la semántica "último plank gana".
+    """
+
+    src_index: np.ndarray
+    dst_offset: np.ndarray
+    has_overlap: bool
+    max_offset: int
+
+    def scatter(
+        self,
+        out: np.ndarray,
+        bytes_roi: np.ndarray,
+        active_roi: np.ndarray,
+        *,
+        buffer_limit: int,
+    ) -> None:
+        """Escribe bytes_roi en out (uint8 plano) respetando active_roi."""
+        if self.src_index.size == 0:
+            return
+
+        sel = active_roi.reshape(-1)[self.src_index]
+        src = self.src_index[sel]
+        dst = self.dst_offset[sel]
+        if dst.size == 0:
+            return
+
+        if self.max_offset >= buffer_limit:
+            bad = int(dst.max())
+            if bad >= buffer_limit:
+                raise RuntimeError(f"Offset fuera de rango: {bad} >= {buffer_limit}")
+
+        if self.has_overlap:
+            # Conservar la ÚLTIMA escritura de cada offset (orden del bucle original).
+            _, first_rev = np.unique(dst[::-1], return_index=True)
+            keep = (dst.size - 1) - first_rev
+            src = src[keep]
+            dst = dst[keep]
+
+        out[dst] = bytes_roi.reshape(-1)[src]
+
+
+_ENCODE_PLAN_LOCK = threading.Lock()
+_ENCODE_PLAN_CACHE: OrderedDict[tuple, EncodePlan] = OrderedDict()
+_ENCODE_PLAN_CACHE_MAX = 8
+
+
+def _compile_encode_plan(
+    *,
+    header_size: int,
+    stride: int,
+    off_x: int,
+    off_y: int,
+    enc_w: int,
+    enc_h: int,
+    plank_spec: tuple,
+    visible_rows: tuple | None,
+    visibility_roi: np.ndarray | None,
+) -> EncodePlan:
+    if visible_rows is None:
+        dst_rows = np.arange(enc_h, dtype=np.int64) + off_y
+    else:
+        dst_rows = np.asarray(visible_rows[:min(enc_h, len(visible_rows))], dtype=np.int64)
+
+    src_parts = []
+    dst_parts = []
+
+    for y0, y1, x0, w, flip_x in plank_spec:
+        plank_h = y1 - y0 + 1
+
+        # Filtrar por rango Y del plank y por el encode_paint_area global
+        ys = dst_rows[
+            (dst_rows >= y0) & (dst_rows <= y1) &
+            (dst_rows >= off_y) & (dst_rows < off_y + enc_h)
+        ]
+
+        if flip_x:
+            src_y = (y0 - off_y) + (plank_h - 1 - (ys - y0))
+        else:
+            src_y = ys - off_y
+
+        # Seguridad extra: src dentro de ROI
+        row_ok = (src_y >= 0) & (src_y < enc_h)
+        ys = ys[row_ok]
+        src_y = src_y[row_ok]
+
+        # Resolver X lógico y X destino (flip real)
+        src_x = np.arange(max(0, w), dtype=np.int64)
+        if flip_x:
+            dst_x_canvas = x0 + (w - 1 - src_x) + off_x
+        else:
+            dst_x_canvas = x0 + src_x + off_x
+
+        col_ok = (dst_x_canvas >= off_x) & (dst_x_canvas < off_x + enc_w) & (src_x < enc_w)
+        src_x = src_x[col_ok]
+        dst_x_canvas = dst_x_canvas[col_ok]
+
+        if ys.size == 0 or src_x.size == 0:
+            continue
+
+        src_parts.append((src_y[:, None] * enc_w + src_x[None, :]).reshape(-1))
+        dst_parts.append((header_size + ys[:, None] * stride + dst_x_canvas[None, :]).reshape(-1))
+
+    if src_parts:
+        src_index = np.concatenate(src_parts)
+        dst_offset = np.concatenate(dst_parts)
+    else:
+        src_index = np.zeros((0,), dtype=np.int64)
+        dst_offset = np.zeros((0,), dtype=np.int64)
+
+    # La máscara de visibilidad es estática por template: se pliega en el plan.
+    if visibility_roi is not None and src_index.size:
+        keep = np.asarray(visibility_roi, dtype=bool).reshape(-1)[src_index]
+        src_index = src_index[keep]
+        dst_offset = dst_offset[keep]
+
+    has_overlap = bool(dst_offset.size) and np.unique(dst_offset).size != dst_offset.size
+    max_offset = int(dst_offset.max()) if dst_offset.size else -1
+
+    # int32 basta (ficheros < 2 GB) y reduce a la mitad la memoria cacheada.
+    index_dtype = np.int32 if max_offset < 2 ** 31 else np.int64
+    src_index = src_index.astype(index_dtype)
+    dst_offset = dst_offset.astype(index_dtype)
+    src_index.setflags(write=False)
+    dst_offset.setflags(write=False)
+
+    return EncodePlan(
+        src_index=src_index,
+        dst_offset=dst_offset,
+        has_overlap=has_overlap,
+        max_offset=max_offset,
+    )
+
+
+def get_encode_plan(
+    *,
+    header_size: int,
+    stride: int,
+    off_x: int,
+    off_y: int,
+    enc_w: int,
+    enc_h: int,
+    plank_spec: tuple,
+    visible_rows=None,
+    visibility_roi: np.ndarray | None = None,
+) -> EncodePlan:
+    """
+    Devuelve el EncodePlan para la geometría dada (cacheado, LRU).
+
+    La clave incluye un digest de la máscara de visibilidad, de modo que
+    los encodes repetidos del mismo template (sign/dino) reutilizan el plan.
+    """
+    rows_key = tuple(int(v) for v in visible_rows) if visible_rows is not None else None
+
+    if visibility_roi is not None:
+        vis = np.asarray(visibility_roi, dtype=bool)
+        digest = hashlib.blake2b(np.packbits(vis).tobytes(), digest_size=16).hexdigest()
+        mask_key = (vis.shape, digest)
+    else:
+        mask_key = None
+
+    key = (
+        int(header_size), int(stride),
+        int(off_x), int(off_y), int(enc_w), int(enc_h),
+        plank_spec, rows_key, mask_key,
+    )
+
+    with _ENCODE_PLAN_LOCK:
+        hit = _ENCODE_PLAN_CACHE.get(key)
+        if hit is not None:
+            _ENCODE_PLAN_CACHE.move_to_end(key)
+            return hit
+
+    plan = _compile_encode_plan(
+        header_size=int(header_size),
+        stride=int(stride),
+        off_x=int(off_x),
+        off_y=int(off_y),
+        enc_w=int(enc_w),
+        enc_h=int(enc_h),
+        plank_spec=plank_spec,
+        visible_rows=rows_key,
+        visibility_roi=visibility_roi,
+    )
+
+    with _ENCODE_PLAN_LOCK:
+        _ENCODE_PLAN_CACHE[key] = plan
+        _ENCODE_PLAN_CACHE.move_to_end(key)
+        while len(_ENCODE_PLAN_CACHE) > _ENCODE_PLAN_CACHE_MAX:
+            _ENCODE_PLAN_CACHE.popitem(last=False)
+
+    return plan
+
+
+# ==========================================================
+# preserve_source: base header20 / ASA GUID-header
+# ==========================================================
+
+def _same_file(a: Path, b: Path) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _preserve_source_raster_offset(src: PntFile, width: int, height: int) -> int:
+    """Offset del raster (width x height, contiguo) dentro del .pnt base."""
+    h20 = src.header20
+    if h20 is not None:
+        if int(h20.width) != width or int(h20.height) != height:
+            raise ValueError(
+                f"preserve_source: dims del base ({h20.width}x{h20.height}) no coinciden con el encode ({width}x{height})"
+            )
+        return 20
+
+    asa = src.asa_header
+    if asa is not None:
+        # a1/a2 no siempre son las dims: basta con que el raster tenga width*height bytes.
+        if int(asa["raster_len"]) != width * height:
+            raise ValueError(
+                f"preserve_source: raster_len del base ASA ({asa['raster_len']}) no coincide con el encode ({width}x{height})"
+            )
+        return int(asa["raster_off"])
+
+    raise ValueError("preserve_source requiere un .pnt header20 contiguo o ASA GUID-header")
 
 
 class RasterCanvasEncoder:
@@ -39,10 +284,8 @@ class RasterCanvasEncoder:
         if tabla_dyes_path is None:
             raise ValueError("tabla_dyes_path es obligatorio")
 
-        self.color_translator = PntColorTranslatorV1(
-            str(tabla_dyes_path),
-            enabled_dyes=enabled_dyes,
-        )
+        # Shared per (table, enabled dyes): no JSON re-parse per request.
+        self.color_translator = get_translator(tabla_dyes_path, enabled_dyes=enabled_dyes)
         self.layout_extractor = RasterLayoutExtractor(header_size=header_size)
 
     # ------------------------------------------------------
@@ -61,11 +304,13 @@ class RasterCanvasEncoder:
         dither_mode: str = "none",
         dither_strength: float = 1.0,
         dither_kernel: str = "floyd_steinberg",
-        dither_serpentine: bool = True,
+        dither_serpentine: bool | None = None,
         encode_paint_area: dict | None = None,
         planks: list[dict] | None = None,
         encode_visible_rows: list[int] | None = None,
         encode_visibility_mask: np.ndarray | None = None,
+        cancel=None,
+        patch_atomic: bool | None = None,
     ):
         """
         Genera un .pnt raster a partir de una imagen RGBA.
@@ -73,6 +318,11 @@ class RasterCanvasEncoder:
         - Layout físico SIEMPRE extraído del template real
         - width / height definen el raster lógico
         - dithering opcional antes de cuantizar
+        - cancel: CancelToken opcional; se comprueba por fila en el dither y antes de
+          escribir. Si se cancela lanza RenderCancelled y no se escribe nada.
+        - preserve_source con output == base (re-export sobre el mismo .pnt): se parchea
+          sólo el rango del raster en el fichero (PntIO.patch_pnt_raster); patch_atomic
+          lo hace sobre una copia temporal + os.replace (default: PC_PNT_PATCH_ATOMIC).
         """
 
         # --------------------------------------------------
@@ -81,12 +331,14 @@ class RasterCanvasEncoder:
         perf_enabled = os.environ.get("PC_PERF", "0") == "1"
         t0 = perf_counter() if perf_enabled else 0.0
         t_alloc = t_pre = t_dither = t_encode = t_write = 0.0
+        match_stats: dict | None = {} if perf_enabled else None
 
         # --------------------------------------------------
         # Resolver layout físico (legacy) o virtual (raster20)
         # --------------------------------------------------
 
         writer_mode = (writer_mode or "raster20").strip().lower()
+        patch_in_place = False
 
         if writer_mode == "raster20":
             # Layout virtual: row-major contiguous
@@ -106,29 +358,31 @@ class RasterCanvasEncoder:
                 t_alloc = perf_counter()
 
         elif writer_mode == "preserve_source":
-            # Header20 + suffix: copiar el archivo base completo y parchear SOLO el raster.
+            # Header20 / ASA GUID-header + suffix: parchear SOLO el raster.
             if base_pnt_path is None:
                 raise ValueError("writer_mode=preserve_source requiere base_pnt_path")
 
-            info = peek_pnt_info(base_pnt_path)
-            if not info.get("is_header20"):
-                raise ValueError("preserve_source requiere un .pnt header20 contiguo")
-
-            bw = int(info.get("width", 0))
-            bh = int(info.get("height", 0))
-            if bw != int(width) or bh != int(height):
-                raise ValueError(
-                    f"preserve_source: dims del base ({bw}x{bh}) no coinciden con el encode ({width}x{height})"
-                )
-
-            stride = int(width)
-            header_size = 20
-            buffer_rows = int(height)
-
-            base_bytes = bytearray(Path(base_pnt_path).read_bytes())
-            output = bytearray(base_bytes)
-            # Limitar escrituras al raster para no tocar suffix.
-            buffer_limit = header_size + stride * buffer_rows
+            # Re-export sobre el propio fichero: se lee y escribe sólo cabecera + raster.
+            patch_in_place = _same_file(base_pnt_path, output_pnt_path)
+
+            if patch_in_place:
+                src = PntFile(base_pnt_path)
+            else:
+                # Contenido + peek cacheados (path + size + mtime): sin I/O en exports repetidos.
+                asset = get_pnt_base_asset(base_pnt_path)
+                src = PntFile(asset.path, data=asset.data)
+
+            with src:
+                header_size = _preserve_source_raster_offset(src, int(width), int(height))
+                stride = int(width)
+                buffer_rows = int(height)
+                # Limitar escrituras al raster para no tocar suffix.
+                buffer_limit = header_size + stride * buffer_rows
+
+                if patch_in_place:
+                    output = bytearray(src.view(0, buffer_limit))
+                else:
+                    output = bytearray(asset.data)
 
             if perf_enabled:
                 t_alloc = perf_counter()
@@ -138,14 +392,15 @@ class RasterCanvasEncoder:
             if base_pnt_path is None:
                 raise ValueError("writer_mode=legacy_copy requiere base_pnt_path")
 
-            real_layout = self.layout_extractor.extract(base_pnt_path)
+            # Layout detectado una vez por template (caché de assets base).
+            asset = get_pnt_base_asset(base_pnt_path)
+            real_layout = asset.layout(self.layout_extractor)
 
             stride = real_layout.row_length
             header_size = real_layout.header_size
             buffer_rows = real_layout.row_count
 
-            base_bytes = bytearray(base_pnt_path.read_bytes())
-            output = bytearray(base_bytes)
+            output = bytearray(asset.data)
             buffer_limit = len(output)
 
             if perf_enabled:
@@ -221,40 +476,25 @@ class RasterCanvasEncoder:
             raise ValueError("encode_paint_area excede row_count físico")
 
 
-        # --------------------------------------------------
-        # Resolver encode_visible_rows (si existe)
-        # --------------------------------------------------
-        if encode_visible_rows is None:
-            y_iter = range(enc_h)
-            y_map = lambda y: y + off_y
-        else:
-            y_iter = range(min(enc_h, len(encode_visible_rows)))
-            y_map = lambda y: encode_visible_rows[y]
-
         # --------------------------------------------------
         # Resolver planks (sub-paint-area)
         # --------------------------------------------------
 
         if not planks:
             # Caso legacy: un solo "plank" que cubre todo el encode_paint_area
-            plank_iter = [{
-                "y0": off_y,
-                "y1": off_y + enc_h - 1,
-                "x_offset": 0,
-                "width": enc_w,
-                "flip_x": False,
-            }]
+            plank_spec = ((off_y, off_y + enc_h - 1, 0, enc_w, False),)
         else:
-            plank_iter = []
+            plank_spec = []
             for p in planks:
                 y0, y1 = p["y"]
-                plank_iter.append({
-                    "y0": y0,
-                    "y1": y1,
-                    "x_offset": int(p.get("x_offset", 0)),
-                    "width": int(p.get("width", enc_w)),
-                    "flip_x": bool(p.get("flip_x", False)),
-                })
+                plank_spec.append((
+                    int(y0),
+                    int(y1),
+                    int(p.get("x_offset", 0)),
+                    int(p.get("width", enc_w)),
+                    bool(p.get("flip_x", False)),
+                ))
+            plank_spec = tuple(plank_spec)
 
         # --------------------------------------------------
         # Preprocesado: RGBA -> RGB lineal
@@ -297,7 +537,7 @@ class RasterCanvasEncoder:
                     if perf_enabled:
                         t_pre = perf_counter()
 
-                    bytes_sel = self.color_translator.nearest_bytes_batch(rgb_sel)
+                    bytes_sel = self.color_translator.nearest_bytes_batch(rgb_sel, stats=match_stats)
                     out_raster[off_y:off_y + enc_h, off_x:off_x + enc_w][alpha] = bytes_sel
                 else:
                     if perf_enabled:
@@ -320,8 +560,14 @@ class RasterCanvasEncoder:
         # Fast-path completed: write and return (do NOT fall through)
         # --------------------------------------------------
         if goto_write:
-            output_pnt_path.parent.mkdir(parents=True, exist_ok=True)
-            output_pnt_path.write_bytes(output)
+            check_cancel(cancel)
+            self._write_output(
+                output_pnt_path, output,
+                patch_offset=header_size if patch_in_place else None,
+                patch_atomic=patch_atomic,
+            )
+            if perf_enabled:
+                print(f"[PERF] encode fast_path {enc_w}x{enc_h} {format_match_stats(match_stats)}")
             return
 
         # --------------------------------------------------
@@ -337,6 +583,7 @@ class RasterCanvasEncoder:
             vis_roi = encode_visibility_mask[off_y:off_y + enc_h, off_x:off_x + enc_w]
             active_roi = alpha_roi & vis_roi
         else:
+            vis_roi = None
             active_roi = alpha_roi
 
         pack = self.color_translator.palette_pack()
@@ -351,9 +598,10 @@ class RasterCanvasEncoder:
                 pack["palette_linear"],
                 kernel=str(dither_kernel or "floyd_steinberg"),
                 strength=dither_strength,
-                serpentine=bool(dither_serpentine),
+                serpentine=None if dither_serpentine is None else bool(dither_serpentine),
                 respect_mask=True,
                 clamp01=True,
+                cancel=cancel,
             )
 
         elif dither_mode in ("ordered", "palette_ordered"):
@@ -365,12 +613,14 @@ class RasterCanvasEncoder:
                 palette_bytes=pack["palette_bytes"],
                 sqrt_w=pack.get("sqrt_w"),
                 strength=dither_strength,
+                stats=match_stats,
+                cancel=cancel,
             )
 
         else:
             bytes_roi = np.zeros((enc_h, enc_w), dtype=np.uint8)
             if np.any(active_roi):
-                bytes_sel = self.color_translator.nearest_bytes_batch(rgb_roi[active_roi])
+                bytes_sel = self.color_translator.nearest_bytes_batch(rgb_roi[active_roi], stats=match_stats)
                 bytes_roi[active_roi] = bytes_sel
 
 
@@ -378,64 +628,60 @@ class RasterCanvasEncoder:
         # Raster encoding (con soporte de planks y rotación)
         # --------------------------------------------------
 
-        for plank in plank_iter:
-            x0 = plank["x_offset"]
-            w  = plank["width"]
-            flip_x = plank["flip_x"]
-
-            y0 = plank["y0"]
-            y1 = plank["y1"]
-            plank_h = y1 -y0 +1
-
-            for y in y_iter:
-                dst_y = y_map(y)
-
-                local_y = dst_y -y0
-
-                if flip_x:
-                    src_y = (y0 - off_y) + (plank_h - 1 - local_y)
-                else:
-                    src_y = dst_y - off_y
-
-                # Filtrar por rango Y del plank (Y global)
-                if dst_y < plank["y0"] or dst_y > plank["y1"]:
-                    continue
+        out_np = np.frombuffer(output, dtype=np.uint8)
 
-                # Seguridad: limitar al encode_paint_area global
-                if dst_y < off_y or dst_y >= off_y + enc_h:
-                    continue
-
-                row_base = header_size + dst_y * stride
-
-                for i in range(w):
-                    # Resolver X lógico y X destino (flip real)
-                    src_x = i
-                    dst_x = x0 + (w - 1 - i if flip_x else i)
-                    dst_x_canvas = dst_x + off_x
-
-                    # Seguridad: limitar a encode_paint_area
-                    if dst_x_canvas < off_x or dst_x_canvas >= off_x + enc_w:
-                        continue
-
-                    # Seguridad extra: src dentro de ROI
-                    if src_y < 0 or src_y >= enc_h or src_x < 0 or src_x >= enc_w:
-                        continue
-
-                    # active_roi ya incluye alpha_threshold + encode_visibility_mask (ROI)
-                    if not active_roi[src_y, src_x]:
-                        continue
-
-                    offset = row_base + dst_x_canvas
-                    if offset >= buffer_limit:
-                        raise RuntimeError(
-                            f"Offset fuera de rango: {offset} >= {buffer_limit}"
-                        )
-
-                    output[offset] = int(bytes_roi[src_y, src_x])
+        if not planks and encode_visible_rows is None:
+            # Un solo plank sin flip que cubre el paint_area: el mapeo es el ROI tal cual.
+            out_raster = out_np[header_size:header_size + stride * buffer_rows].reshape((buffer_rows, stride))
+            out_raster[off_y:off_y + enc_h, off_x:off_x + enc_w][active_roi] = bytes_roi[active_roi]
+        else:
+            plan = get_encode_plan(
+                header_size=header_size,
+                stride=stride,
+                off_x=off_x,
+                off_y=off_y,
+                enc_w=enc_w,
+                enc_h=enc_h,
+                plank_spec=plank_spec,
+                visible_rows=encode_visible_rows,
+                visibility_roi=vis_roi,
+            )
+            plan.scatter(out_np, bytes_roi, alpha_roi, buffer_limit=buffer_limit)
 
         # --------------------------------------------------
         # Escritura
         # --------------------------------------------------
 
-        output_pnt_path.parent.mkdir(parents=True, exist_ok=True)
-        output_pnt_path.write_bytes(output)
+        check_cancel(cancel)
+        self._write_output(
+            output_pnt_path, output,
+            patch_offset=header_size if patch_in_place else None,
+            patch_atomic=patch_atomic,
+        )
+        if perf_enabled and match_stats:
+            print(f"[PERF] encode {writer_mode} {enc_w}x{enc_h} {format_match_stats(match_stats)}")
+
+    # ------------------------------------------------------
+
+    @staticmethod
+    def _write_output(
+        output_pnt_path: Path,
+        output: bytearray,
+        *,
+        patch_offset: int | None,
+        patch_atomic: bool | None,
+    ) -> None:
+        """Escribe el .pnt completo, o sólo el raster (output[patch_offset:]) in-place."""
+        if patch_offset is None:
+            output_pnt_path.parent.mkdir(parents=True, exist_ok=True)
+            output_pnt_path.write_bytes(output)
+            return
+
+        mv = memoryview(output)
+        patch_pnt_raster(
+            output_pnt_path,
+            patch_offset,
+            mv[patch_offset:],
+            head=bytes(mv[:patch_offset]),
+            atomic=patch_atomic,
+        )
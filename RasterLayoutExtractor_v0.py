@@ -5,15 +5,68 @@
 # - header_size fijo (conocido)
 # - buffer raster lineal
 # - detección robusta de row_length y row_count
+#
+# Rendimiento:
+# - Con muchos divisores candidatos, primero se puntúan todos sobre unos pocos
+#   pares de filas muestreados y sólo los _FULL_SCORE_TOP mejores pasan al
+#   score completo (el mismo de siempre, que decide).
+# - El resultado se cachea por hash del contenido (memoria + disco en
+#   get_user_cache_dir("layouts")): tras la primera vez, detectar el layout
+#   de un .pnt cuesta un hash.
+#
+# Env:
+# - PC_LAYOUT_CACHE=0   sin caché (ni memoria ni disco)
 # ==========================================================
 
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+import hashlib
+import json
 import math
+import os
+import sys
+import threading
 import numpy as np
 
 
+_LAYOUT_VERSION = b"pc-raster-layout-v1"
+
+# Candidatos que reciben el score completo tras la criba muestreada.
+_FULL_SCORE_TOP = 6
+# Pares de filas (y, y+1) muestreados por candidato en la criba.
+_SAMPLE_ROW_PAIRS = 64
+# Layouts recordados en memoria (entradas de pocos bytes).
+_MEMO_MAX = 256
+
+_MEMO_LOCK = threading.Lock()
+_MEMO: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+
+
+def _cache_enabled() -> bool:
+    return os.environ.get("PC_LAYOUT_CACHE", "1") != "0"
+
+
+def _persist_enabled() -> bool:
+    # Pyodide: el FS es memoria, persistir no aporta nada.
+    if sys.platform == "emscripten":
+        return False
+    return _cache_enabled()
+
+
+def _layout_dir() -> Path:
+    from paths import get_user_cache_dir
+
+    return get_user_cache_dir("layouts")
+
+
+def clear_layout_cache() -> None:
+    """Olvida los layouts en memoria (los ficheros en disco se conservan)."""
+    with _MEMO_LOCK:
+        _MEMO.clear()
+
+
 # ----------------------------------------------------------
 # Estructura de salida
 # ----------------------------------------------------------
@@ -63,7 +116,11 @@ class RasterLayoutExtractor:
             RasterLayoutInfoV2
         """
 
-        data = pnt_path.read_bytes()
+        return self.extract_bytes(pnt_path.read_bytes())
+
+    def extract_bytes(self, data: bytes) -> RasterLayoutInfoV2:
+        """Igual que extract() sobre el contenido ya leído del .pnt."""
+
         file_size = len(data)
 
         if file_size <= self.header_size:
@@ -75,6 +132,21 @@ class RasterLayoutExtractor:
 
         N = paint_data.size
 
+        # --------------------------------------------------
+        # 0) Caché por contenido
+        # --------------------------------------------------
+
+        digest = self._layout_digest(data) if _cache_enabled() else None
+        if digest is not None:
+            cached = self._cached_layout(digest, N)
+            if cached is not None:
+                return RasterLayoutInfoV2(
+                    header_size=self.header_size,
+                    row_length=cached[0],
+                    row_count=cached[1],
+                    paint_data_size=N
+                )
+
         # --------------------------------------------------
         # 1) Candidatos de row_length
         # --------------------------------------------------
@@ -87,6 +159,16 @@ class RasterLayoutExtractor:
         # 2) Evaluación raster
         # --------------------------------------------------
 
+        # Criba barata; el orden por row_length se conserva para los empates.
+        if len(candidates) > _FULL_SCORE_TOP:
+            coarse = sorted(
+                candidates,
+                key=lambda rl: self._sampled_continuity_score(
+                    paint_data, rl, N // rl
+                )
+            )
+            candidates = sorted(coarse[:_FULL_SCORE_TOP])
+
         scored: List[Tuple[float, int, int]] = []
 
         for row_length in candidates:
@@ -104,6 +186,9 @@ class RasterLayoutExtractor:
 
         best_score, best_row_length, best_row_count = scored[0]
 
+        if digest is not None:
+            self._store_layout(digest, best_row_length, best_row_count)
+
         return RasterLayoutInfoV2(
             header_size=self.header_size,
             row_length=best_row_length,
@@ -140,6 +225,38 @@ class RasterLayoutExtractor:
 
     # ------------------------------------------------------
 
+    def _sampled_continuity_score(
+        self,
+        data: np.ndarray,
+        row_length: int,
+        row_count: int
+    ) -> float:
+        """
+        Estimación de _raster_continuity_score sobre pares de filas
+        (y, y+1) repartidos por todo el raster.
+        """
+
+        pairs = min(_SAMPLE_ROW_PAIRS, row_count - 1)
+        ys = np.unique(
+            np.linspace(0, row_count - 2, pairs).round().astype(np.int64)
+        )
+
+        img = data.reshape((row_count, row_length))
+        top = img[ys].astype(np.int16)
+        bottom = img[ys + 1].astype(np.int16)
+
+        mean_dv = float(np.abs(top - bottom).mean())
+        mean_dh = float(np.abs(top[:, :-1] - top[:, 1:]).mean())
+
+        score = mean_dv / (mean_dh + 1e-6)
+        aspect_penalty = abs(
+            math.log2(row_length / max(row_count, 1))
+        ) * 0.01
+
+        return score + aspect_penalty
+
+    # ------------------------------------------------------
+
     def _raster_continuity_score(
         self,
         data: np.ndarray,
@@ -172,3 +289,72 @@ class RasterLayoutExtractor:
         ) * 0.01
 
         return score + aspect_penalty
+
+    # ------------------------------------------------------
+    # Caché de layouts
+    # ------------------------------------------------------
+
+    def _layout_digest(self, data: bytes) -> str:
+        h = hashlib.blake2b(_LAYOUT_VERSION, digest_size=20)
+        h.update(
+            np.array(
+                [self.header_size, self.min_row_length, self.max_row_length],
+                dtype="<i8"
+            ).tobytes()
+        )
+        h.update(data)
+        return h.hexdigest()
+
+    def _cached_layout(self, digest: str, N: int) -> Optional[Tuple[int, int]]:
+        with _MEMO_LOCK:
+            hit = _MEMO.get(digest)
+            if hit is not None:
+                _MEMO.move_to_end(digest)
+                return hit
+
+        if not _persist_enabled():
+            return None
+        try:
+            with open(_layout_dir() / f"{digest}.json", "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            row_length = int(raw["row_length"])
+            row_count = int(raw["row_count"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        # Fichero ajeno o corrupto: recalcular.
+        if row_length <= 0 or row_length * row_count != N:
+            return None
+
+        self._remember(digest, row_length, row_count)
+        return row_length, row_count
+
+    def _store_layout(self, digest: str, row_length: int, row_count: int) -> None:
+        self._remember(digest, row_length, row_count)
+
+        if not _persist_enabled():
+            return
+        p = _layout_dir() / f"{digest}.json"
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+            tmp.write_text(
+                json.dumps({
+                    "header_size": self.header_size,
+                    "row_length": row_length,
+                    "row_count": row_count,
+                }),
+                encoding="utf-8"
+            )
+            os.replace(str(tmp), str(p))
+        except OSError:
+            # Caché best-effort: sin disco seguimos en memoria.
+            pass
+
+    @staticmethod
+    def _remember(digest: str, row_length: int, row_count: int) -> None:
+        with _MEMO_LOCK:
+            _MEMO[digest] = (int(row_length), int(row_count))
+            _MEMO.move_to_end(digest)
+            while len(_MEMO) > _MEMO_MAX:
+                _MEMO.popitem(last=False)
@@ -8,3 +8,26 @@ def get_app_root() -> Path:
     else:
         # Modo desarrollo
         return Path(__file__).resolve().parent
+
+
+def get_user_cache_dir(name: str | None = None) -> Path:
+    """Directorio de caché del usuario (LUTs, layouts, etc.).
+
+    - PC_CACHE_DIR (env) tiene prioridad.
+    - Windows: %LOCALAPPDATA%/ProyectoCanvas/cache
+    - Linux/macOS: ~/.proyecto_canvas/cache
+
+    No crea el directorio: lo hace quien escribe (y tolera fallos).
+    """
+    import os
+
+    override = os.environ.get("PC_CACHE_DIR", "").strip()
+    if override:
+        base = Path(override)
+    elif os.name == "nt":
+        appdata = os.environ.get("LOCALAPPDATA") or os.environ.get("APPDATA")
+        base = (Path(appdata) if appdata else Path.home()) / "ProyectoCanvas" / "cache"
+    else:
+        base = Path.home() / ".proyecto_canvas" / "cache"
+
+    return base / name if name else base
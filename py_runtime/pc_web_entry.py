@@ -83,9 +83,9 @@ def _ensure_translator(controller: PreviewController) -> Any | None:
         return None
 
     try:
-        from PntColorTranslator_v0 import PntColorTranslatorV1
+        from PaletteRegistry_v1 import get_translator
 
-        translator = PntColorTranslatorV1(str(tabla_path))
+        translator = get_translator(tabla_path)
         controller._ark_translator = translator
         return translator
     except Exception:
@@ -616,15 +616,13 @@ def calculate_best_colors(n: int, settings: dict[str, Any] | None = None) -> lis
     controller = _get_controller()
     apply_settings(settings)
 
+    # n <= 0 (o 'auto'): N automático según la curva error-vs-N (selección greedy).
     try:
         top_n = int(n)
     except (TypeError, ValueError):
         top_n = 0
 
-    if top_n <= 0:
-        return []
-
-    selected = controller.calculate_best_dyes(top_n, sample_side=256, max_pixels=65536)
+    selected = controller.calculate_best_dyes(top_n if top_n > 0 else None, sample_side=256, max_pixels=65536)
     state = getattr(controller, 'state', None)
     if state is not None:
         setattr(state, 'use_all_dyes', False)
@@ -683,7 +681,7 @@ def _normalize_border_config(raw: Any) -> dict[str, Any]:
 def _compose_preview_overlay_if_needed(*, controller: PreviewController, preview: 'Image.Image', mode: str) -> 'Image.Image':
     from PIL import Image
     import numpy as np
-    from FrameBorder import apply_frame_border
+    from FrameBorder import apply_frame_border, frame_image_digest
 
     """Compose template overlay in web runtime for ARK simulation previews."""
     if mode != 'ark_simulation':
@@ -743,10 +741,18 @@ def _compose_preview_overlay_if_needed(*, controller: PreviewController, preview
                             if frame_np is None and border_cfg.get('frame_image') is not None:
                                 frame_np = np.array(border_cfg['frame_image'].convert('RGBA'), dtype=np.uint8)
                                 border_cfg['frame_image_np'] = frame_np
+                                border_cfg['frame_key'] = frame_image_digest(frame_np)
                             if frame_np is not None:
-                                out_np = apply_frame_border(out_np, border_size=size, style='image', frame_image=frame_np)
+                                out_np = apply_frame_border(
+                                    out_np,
+                                    border_size=size,
+                                    style='image',
+                                    frame_image=frame_np,
+                                    noise_seed=int(border_cfg.get('noise_seed', 0) or 0),
+                                    frame_key=border_cfg.get('frame_key'),
+                                )
                         else:
-                            out_np = apply_frame_border(out_np, border_size=size, style=style)
+                            out_np = apply_frame_border(out_np, border_size=size, style=style, noise_seed=int(border_cfg.get('noise_seed', 0) or 0))
 
                     output = Image.fromarray(out_np, mode='RGBA')
     except Exception:
@@ -774,9 +780,9 @@ def init() -> dict[str, Any]:
     tabla_loaded = False
     if tabla_path.exists() and getattr(controller, '_ark_translator', None) is None:
         try:
-            from PntColorTranslator_v0 import PntColorTranslatorV1
+            from PaletteRegistry_v1 import get_translator
 
-            controller._ark_translator = PntColorTranslatorV1(str(tabla_path))
+            controller._ark_translator = get_translator(tabla_path)
             tabla_loaded = True
         except Exception:
             tabla_loaded = False
@@ -933,23 +939,18 @@ def list_templates() -> list[dict[str, Any]]:
 
 
 def set_image(image_bytes: bytes, image_name: str | None = None) -> dict[str, Any]:
-    from PIL import Image
-
     global _last_image_size
 
     controller = _get_controller()
-    with Image.open(BytesIO(image_bytes)) as image:
-        rgba = image.convert('RGBA')
+    # Decoded reduced into a pyramid (JPEG draft / power-of-two reduce); w/h report the source size.
+    controller.set_image_file(bytes(image_bytes), image_name=image_name)
 
-    controller.set_image(rgba, image_name=image_name)
+    rgba = controller.state.image_original
+    w, h = controller.image_source_size()
 
-    state = getattr(controller, 'state', None)
-    if state is not None and hasattr(state, 'image_original'):
-        state.image_original = rgba
+    _last_image_size = (w, h)
 
-    _last_image_size = rgba.size
-
-    return {'ok': True, 'w': rgba.width, 'h': rgba.height, 'mode': rgba.mode}
+    return {'ok': True, 'w': w, 'h': h, 'mode': rgba.mode}
 
 
 def set_template(template_id: str) -> dict[str, Any]:
@@ -1162,6 +1163,11 @@ def render_preview2(payload: dict[str, Any] | None = None) -> dict[str, Any]:
     Acepta `settings_delta`, `settingsDelta` o `settings` como diccionario de ajustes;
     acepta tanto `preview_mode` como `previewMode`; acepta `return_format` y `returnFormat`;
     y acepta `preview_max_dim` o `previewMaxDim`.
+
+    Preview progresiva en dos fases: `preview_pass` / `previewPass` = "quick" devuelve
+    un primer pase a resolución reducida sin dither (mismo tamaño de salida); "final"
+    (por defecto) el resultado completo. El cliente descarta el final si llega una
+    petición más nueva.
     """
     from PIL import Image
 
@@ -1191,8 +1197,13 @@ def render_preview2(payload: dict[str, Any] | None = None) -> dict[str, Any]:
     if preview_max_dim is None:
         preview_max_dim = request.get('previewMaxDim')
 
+    raw_preview_pass = request.get('preview_pass') or request.get('previewPass') or 'final'
+    preview_pass = str(raw_preview_pass).strip().lower()
+    if preview_pass not in {'quick', 'final'}:
+        raise ValueError('preview_pass must be "quick" or "final"')
+
     controller.set_preview_mode(preview_mode)
-    preview = controller.render_preview_if_possible()
+    preview = controller.render_preview_if_possible(quick=preview_pass == 'quick')
     if preview is None:
         raise RuntimeError('preview-not-ready: preview image could not be produced')
 
@@ -1218,11 +1229,12 @@ def render_preview2(payload: dict[str, Any] | None = None) -> dict[str, Any]:
             'w': int(preview_rgba.width),
             'h': int(preview_rgba.height),
             'rgba': preview_rgba.tobytes(),
+            'pass': preview_pass,
         }
 
     with BytesIO() as out:
         preview.save(out, format='PNG')
-        return {'kind': 'png', 'png': out.getvalue()}
+        return {'kind': 'png', 'png': out.getvalue(), 'pass': preview_pass}
 
 
 
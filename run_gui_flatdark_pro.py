@@ -167,7 +167,7 @@ def _validate_settings(raw: dict) -> dict:
     d["preview_mode"] = _validate_enum(d.get("preview_mode"), {"visual", "ark_simulation"})
     d["show_game_object"] = _validate_bool(d.get("show_game_object"))
     d["use_all_dyes"] = _validate_bool(d.get("use_all_dyes"))
-    d["best_colors"] = _validate_int(d.get("best_colors"), 1, 255)
+    d["best_colors"] = _validate_int(d.get("best_colors"), 0, 255)  # 0 = auto
     d["border_style"] = _validate_enum(d.get("border_style"), {"none", "image"})
     d["dither_mode"] = _validate_enum(d.get("dither_mode"), {"none", "palette_fs", "palette_ordered"})
     d["show_advanced"] = _validate_bool(d.get("show_advanced"))
@@ -2774,4 +2774,6 @@ class PreviewGUI(BasePreviewGUI):
             pass
 
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # preview process backend in frozen builds
     PreviewGUI().mainloop()
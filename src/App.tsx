@@ -859,7 +859,8 @@ function App() {
           settings_delta: buildPcSettings(quality),
           preview_mode: state.preview_mode,
           preview_max_dim: quality === 'fast' ? fastPreviewMaxDim : previewMaxDim,
-          return_format: quality === 'fast' ? 'rgba' : 'png'
+          return_format: quality === 'fast' ? 'rgba' : 'png',
+          preview_pass: quality === 'fast' ? 'quick' : 'final'
         }
       }, `preview-render-${quality}`, {
         timeoutMs: 120_000
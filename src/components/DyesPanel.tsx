@@ -84,6 +84,7 @@ export function DyesPanel({
             min={0}
             max={maxBestColors}
             value={clampedBestColors}
+            title={t('hint.best_colors_auto')}
             aria-label={t('label.best_colors')}
             onChange={(event) => onBestColorsChange(Math.min(Math.max(Number(event.target.value) || 0, 0), maxBestColors))}
           />
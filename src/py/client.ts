@@ -225,6 +225,7 @@ type RpcMethodMap = {
         preview_mode: 'visual' | 'ark_simulation'
         preview_max_dim?: number
         return_format?: 'png' | 'rgba'
+        preview_pass?: 'quick' | 'final'
       }
     }
     result:
@@ -143,12 +143,14 @@ type BorderConfig = {
 }
 
 type PreviewReturnFormat = 'png' | 'rgba'
+type PreviewPass = 'quick' | 'final'
 
 type RenderPreview2Payload = {
   settings_delta?: DyesSettings
   preview_mode: PreviewMode
   preview_max_dim?: number
   return_format?: PreviewReturnFormat
+  preview_pass?: PreviewPass
 }
 
 type RenderPreview2Result =
@@ -1047,6 +1049,14 @@ function asPreviewReturnFormat(value: unknown): PreviewReturnFormat {
   return 'png'
 }
 
+function asPreviewPass(value: unknown): PreviewPass {
+  if (value === 'quick') {
+    return 'quick'
+  }
+
+  return 'final'
+}
+
 function asRenderPreview2Payload(value: unknown): RenderPreview2Payload {
   const raw = (value ?? {}) as {
     settings_delta?: unknown
@@ -1058,6 +1068,8 @@ function asRenderPreview2Payload(value: unknown): RenderPreview2Payload {
     previewMaxDim?: unknown
     return_format?: unknown
     returnFormat?: unknown
+    preview_pass?: unknown
+    previewPass?: unknown
   }
 
   const settingsDelta = raw.settings_delta ?? raw.settingsDelta ?? raw.settings
@@ -1066,7 +1078,8 @@ function asRenderPreview2Payload(value: unknown): RenderPreview2Payload {
     settings_delta: asDyesSettings(settingsDelta),
     preview_mode: asPreviewMode(raw.preview_mode ?? raw.previewMode ?? 'visual'),
     preview_max_dim: asPositiveInt(raw.preview_max_dim ?? raw.previewMaxDim, 0),
-    return_format: asPreviewReturnFormat(raw.return_format ?? raw.returnFormat)
+    return_format: asPreviewReturnFormat(raw.return_format ?? raw.returnFormat),
+    preview_pass: asPreviewPass(raw.preview_pass ?? raw.previewPass)
   }
 }
 